@@ -1,17 +1,24 @@
 import streamlit as st
-import pandas as pd
 import os
-import json
 import time
 
-from typing import List, Optional
+from typing import TYPE_CHECKING, Iterator
 
-from langchain_core.pydantic_v1 import BaseModel, Field, ValidationError
+from langchain_core.pydantic_v1 import ValidationError
 
-from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
-from langchain_community.agents.openai_assistant import OpenAIAssistantV2Runnable
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.output_parsers import PydanticOutputParser
+from job_classification_agent.models import JobClassification, JobClassifications
+from job_classification_agent.prompts import DEFAULT_PROMPT_TEMPLATE
+from job_classification_agent.knowledge_base import load_knowledge_base, validate_occupation_code, get_career_clusters, get_career_pathways
+from job_classification_agent.retrieval import format_candidates, load_retriever
+from job_classification_agent.fast_path import load_title_matcher
+from job_classification_agent.cache import cache_key, load_cache
+from job_classification_agent.local_classifier import load_local_classifier
+from job_classification_agent.tracing import Span, configure_tracing, tracer
+
+# the assistant chain modules import langchain's agents and the OpenAI client (over a second),
+# they are imported on the first classification instead of before the first page render
+if TYPE_CHECKING:
+   from job_classification_agent.streaming import StreamUpdate
 
 st.set_page_config(layout="wide", page_title="Job Classification Assistant")
 
@@ -20,25 +27,6 @@ HINTS_PLACEHOLDER = """Did the assistant get something wrong?  Add additional hi
 example: Jobs that mention software development in a specific language (e.g. JavaScript, Java, C/C#, C++, Python, PHP) should include a classification into the 'Software Developers' occupation.
 """
 
-DEFAULT_PROMPT_TEMPLATE = """Classify the following job post into one or more O*NET 28 classifications described in the provided knowledge base.
-You can only include a classification if the job post strongly suggests that the occupation is part of that classification.
-Don't include source references.
-Consider the career pathway and clusters associated with the occupation in the knowledge base when making classification decisions.
-Consider sample and alternate job titles associated with occupations in the knowledge base when making classification decisions.
-Prioritize technical/hard skill matches over soft skill matches.  
-Do not makeup O*NET occupations not described in the provided knowledge base.
-If there are no clear O*NET 28 classifications, please indicate that in the overall_explanation.
-
-Format instructions: {format_instructions}
-
-Agent should include explanations: {include_explanation}
-
-Additional hints: {hints}
-
-job post title: {job_post_title}
-job post description: {job_post_description}
-"""
-
 if "init" not in st.session_state:
    # Initialize the session state with environment variables
 
@@ -46,21 +34,34 @@ if "init" not in st.session_state:
    assert(os.environ.get("OPENAI_API_KEY") is not None), "OPENAI_API_KEY environment variable is not set.  Please set the OPEN_API_KEY environment variable."
 
    st.session_state['ASSISTANT_ID'] = os.environ.get("ASSISTANT_ID")
+   # optional JSON file of assistant tiers, cheapest first (see job_classification_agent/router.py)
+   st.session_state['ASSISTANT_TIERS'] = os.environ.get("ASSISTANT_TIERS")
    
    st.session_state['init'] = True
 
 st.sidebar.title("Assistant Configuration")
 st.sidebar.write(f"Assistant ID: `{st.session_state.ASSISTANT_ID}`")
+st.sidebar.radio("Classification Engine", ["OpenAI Assistant", "Local (offline)"], key="engine",
+                 help="The local engine classifies by similarity to O*NET occupations, without the assistant and without explanations")
 st.sidebar.checkbox("Include Explanation?", True, key="include_explanation")
+st.sidebar.checkbox("Stream Results?", True, key="stream", help="Show each occupation as soon as the assistant has generated it")
+st.sidebar.checkbox("Reuse Threads?", False, key="reuse_threads", help="Run (non-streamed) classifications on pooled warm threads with adaptive polling, shared by all sessions", disabled=st.session_state.get("stream", True))
+if st.session_state.ASSISTANT_TIERS:
+   st.sidebar.write(f"Assistant Tiers: `{st.session_state.ASSISTANT_TIERS}`")
+   st.sidebar.checkbox("Route Across Assistant Tiers?", True, key="route", help="Run (non-streamed) classifications on the cheapest assistant tier and escalate invalid, dropped or low confidence answers to the next tier", disabled=st.session_state.get("stream", True))
+   st.sidebar.checkbox("Hedge Slow Runs?", False, key="hedge", help="Start a second run when a run exceeds its tier's p95 latency and keep the first answer", disabled=st.session_state.get("stream", True) or not st.session_state.get("route", True))
+st.sidebar.checkbox("Title Fast Path?", True, key="fast_path", help="Classify job posts whose title matches an O*NET occupation, sample or alternate title without running the assistant")
+st.sidebar.checkbox("Use Cache?", True, key="use_cache", help="Reuse classifications of identical job posts with the same prompt, hints and assistant")
+st.sidebar.checkbox("Shortlist Candidate Occupations?", False, key="shortlist", help="Pre-select candidate occupations with a local search index and include them in the prompt")
+st.sidebar.number_input("Shortlist Size", min_value=1, max_value=50, value=10, key="shortlist_size", disabled=not st.session_state.get("shortlist"))
   
-if "career_clusters" not in st.session_state: 
-   # Load the career clusters from data/occupation_career_clusters.json into a DataFrame
-  df_career_clusters = pd.read_json("data/processed/occupation_career_clusters.json", orient="records", lines=True)
-  st.session_state["career_clusters"] = df_career_clusters
+# Load the occupations and career clusters from data/processed (once per process)
+load_knowledge_base()
+title_matcher = load_title_matcher()
+classification_cache = load_cache()
 
-if "occupations" not in st.session_state:
-   df_occupations = pd.read_json("data/processed/occupation_descriptions.json", orient="records", lines=True)
-   st.session_state['occupations'] = df_occupations
+# per-stage latency metrics of all sessions (TRACE_FILE also logs the spans, TRACE_OTEL exports them through OpenTelemetry)
+trace_metrics = configure_tracing(os.environ.get("TRACE_FILE"), otel=bool(os.environ.get("TRACE_OTEL")))
 
 with st.expander("Prompt Config"):
 
@@ -70,137 +71,13 @@ with st.expander("Prompt Config"):
    - {format_instructions}: instructions for formatting the job post (managed by the PydanticOutputParser)
    - {include_explanation}: whether to include an explanation for the classification (controlled by the Include Explanation? checkbox in the sidebar)
    - {hints}: additional hints for the assistant
+   - {candidate_occupations}: candidate occupations from the local search index (controlled by the Shortlist Candidate Occupations? checkbox in the sidebar)
 """
 
    st.text_area("Prompt Template", key="prompt_template", value=DEFAULT_PROMPT_TEMPLATE, height=320, help=help_text)
 
    st.text_area("Hints", key="hints", placeholder=HINTS_PLACEHOLDER)
 
-class JobClassification (BaseModel):
-   occupation_code: str = Field(description="O*NET 28 occupation code", pattern=r'(\d{2}-\d{4}\.\d{2})', examples=["15-2051.00"])
-   occupation_title: str = Field(description="O*NET 28 occupation title", max_length=80, examples=["Data Scientists"])
-   explanation: Optional[str] = Field(description="explanation from Agent for occupation classification", max_length=1000, default=None)
-
-   @property
-   def occupation_link(self) -> str:
-      return f'https://www.onetonline.org/link/summary/{self.occupation_code}'
-
-
-class JobClassifications(BaseModel):
-   job_classifications: List[JobClassification] = Field(description="List of Job Classifications", min_items=0, max_items=3)
-   overall_explanation: Optional[str] = Field(description="Overall explanation from Agent for all occupation classifications", max_length=1000, default=None)
-
-parser = PydanticOutputParser(pydantic_object=JobClassifications)
-
-prompt_template = st.session_state.get("prompt_template", DEFAULT_PROMPT_TEMPLATE)
-
-prompt = ChatPromptTemplate.from_template(
-   prompt_template, 
-   partial_variables={
-      "format_instructions": parser.get_format_instructions(),
-      "include_explanation": st.session_state["include_explanation"],
-      "hints": st.session_state["hints"]
-   })
-
-def parse_output(output: OpenAIAssistantFinish) -> JobClassifications:
-   '''Parse the output from the assistant into a JobClassifications object'''   
-   output_text = output.return_values.get('output')
-   output_text = output_text.lstrip('```json').rstrip('```')
-   output_obj = json.loads(output_text)
-   return JobClassifications(**output_obj)
-
-# check that the occupation code exists in the knowledge base
-def get_occupation_by_code(occupation_code: str) -> Optional[dict]:
-   '''Verify that occupation code exists in knowledge base'''
-   if "occupations" not in st.session_state:
-      return None
-
-   df = st.session_state["occupations"]
-   values = df[df['occupation_code'] == occupation_code].to_dict(orient='records')
-   return values[0] if len(values) > 0 else None
-
-# check that the occupation title exists in the knowledge base
-def get_occupation_by_title(occupation_title: str) -> Optional[dict]:
-   '''Verify that occupation title exists in knowledge base'''
-   if "occupations" not in st.session_state:
-      return None
-
-   df = st.session_state["occupations"]
-   values = df[df['occupation_title'] == occupation_title].to_dict(orient='records')
-   return values[0] if len(values) > 0 else None
-
-# Verify that occupation code is valid for occupation title
-def validate_occupation_code(occupation_code: str, occupation_title: str) -> bool:
-   '''Verify that occupation code is valid for occupation title'''
-   if "occupations" not in st.session_state:
-      return False
-
-   df = st.session_state["occupations"]
-   values = df[df['occupation_code'] == occupation_code]['occupation_title'].to_list()
-   return values[0] == occupation_title if values else False
-
-def post_process_classification(input: JobClassification) -> Optional[JobClassification]:
-
-   # if the occupation code and title are valid & match, return the classification unchanged
-   if validate_occupation_code(input.occupation_code, input.occupation_title):
-      return input
-
-   # if the occupation name exists in KB, return occupation with that name
-   occ = get_occupation_by_title(input.occupation_title)
-   if occ:
-      classification = JobClassification(occupation_code=occ['occupation_code'], 
-                                         occupation_title=occ['occupation_title'], 
-                                         explanation=input.explanation)
-      return classification
-
-   # else, check if the occupation code exists in KB, return occupation with that code
-   occ = get_occupation_by_code(input.occupation_code)
-   if occ:
-      classification = JobClassification(occupation_code=occ['occupation_code'], 
-                                         occupation_title=occ['occupation_title'], 
-                                         explanation=input.explanation)
-      return classification
-
-   # else, do not include the occupation
-   return None
-
-def post_process(input: JobClassifications) -> JobClassifications:
-   "post-process the job classifications to fix occupation title and code mismatches"
-
-   _classifications = [post_process_classification(c) for c in input.job_classifications]
-   _classifications = [c for c in _classifications if c is not None]
-
-   output = JobClassifications(job_classifications=_classifications, 
-                               overall_explanation=input.overall_explanation)
-
-   return output
-
-if "agent" not in st.session_state:
-   agent = OpenAIAssistantV2Runnable(assistant_id=st.session_state.ASSISTANT_ID, as_agent=True)
-   st.session_state['agent'] = agent
-   st.session_state['chain'] = (agent | parse_output | post_process )
-
-def get_career_clusters(occupation_code: str) -> List[str]:
-   '''Get Career Clusters for a given occupation code'''
-   
-   if "career_clusters" not in st.session_state:
-      return []
-   
-   df = st.session_state["career_clusters"]
-   values = df[df['occupation_code'] == occupation_code]['career_cluster'].to_list()
-   return values[0] if len(values) > 0 else []
-
-def get_career_pathways(occupation_code: str) -> List[str]:
-   '''Get Career Pathways for a given occupation code'''
-   
-   if "career_clusters" not in st.session_state:
-      return []
-   
-   df = st.session_state["career_clusters"]
-
-   values = df[df['occupation_code'] == occupation_code]['career_pathway'].to_list()
-   return values[0] if len(values) > 0 else []
-
 def display_results(results: JobClassifications):
    '''Display the results of the job classification from the Assistant'''
 
@@ -212,23 +89,70 @@ def display_results(results: JobClassifications):
       return
 
    for job_classification in results.job_classifications:
+      display_classification(job_classification)
+
+def display_streamed_results(updates: Iterator["StreamUpdate"]) -> JobClassifications:
+   '''Display each classification as it is streamed, then the overall explanation'''
 
-      if not validate_occupation_code(job_classification.occupation_code, job_classification.occupation_title):
-         st.error(f"Invalid occupation code: {job_classification.occupation_code} for occupation title: {job_classification.occupation_title}")
+   overall = st.container()
+   displayed = set()
+   for update in updates:
+      if update.classification is not None:
+         display_classification(update.classification)
+         displayed.add(update.classification.occupation_code)
          continue
 
-      career_clusters = get_career_clusters(job_classification.occupation_code)
-      career_pathways = get_career_pathways(job_classification.occupation_code)
+      results = update.result
+      # classifications that were only recovered when parsing the complete answer
+      for job_classification in results.job_classifications:
+         if job_classification.occupation_code not in displayed:
+            display_classification(job_classification)
 
-      st.write(f"#### [{job_classification.occupation_title}]({job_classification.occupation_link })")
-      st.write(f"**O*NET-SOC Code**: {job_classification.occupation_code}")
-    
-      # show career cluster and career pathway
-      st.write(f"**Career Clusters**: {', '.join(career_clusters) if len(career_clusters) else 'N/A'}")
-      st.write(f"**Career Pathways**: {', '.join(career_pathways) if len(career_clusters) else 'N/A'}")
+      with overall:
+         st.write("**Overall Explanation**")
+         st.write(results.overall_explanation)
+         if not results.job_classifications:
+            st.write("No classifications found for the job post.")
+
+   return results
+
+def display_classification(job_classification: JobClassification):
+   '''Display one job classification with its career clusters and pathways'''
+
+   if not validate_occupation_code(job_classification.occupation_code, job_classification.occupation_title):
+      st.error(f"Invalid occupation code: {job_classification.occupation_code} for occupation title: {job_classification.occupation_title}")
+      return
+
+   career_clusters = get_career_clusters(job_classification.occupation_code)
+   career_pathways = get_career_pathways(job_classification.occupation_code)
+
+   st.write(f"#### [{job_classification.occupation_title}]({job_classification.occupation_link })")
+   st.write(f"**O*NET-SOC Code**: {job_classification.occupation_code}")
 
-      if job_classification.explanation:
-         st.write(f"**Explanation**:\n\n{job_classification.explanation}")
+   # classifications repaired by post-processing (RepairedJobClassification)
+   repair_confidence = getattr(job_classification, "repair_confidence", None)
+   if repair_confidence is not None:
+      st.caption(f"Repaired from the assistant's answer \"{job_classification.repaired_from}\" (confidence {repair_confidence:.2f})")
+    
+   # show career cluster and career pathway
+   st.write(f"**Career Clusters**: {', '.join(career_clusters) if len(career_clusters) else 'N/A'}")
+   st.write(f"**Career Pathways**: {', '.join(career_pathways) if len(career_clusters) else 'N/A'}")
+
+   if job_classification.explanation:
+      st.write(f"**Explanation**:\n\n{job_classification.explanation}")
+
+def display_trace(trace: Span):
+   '''Display the stage timings of a classification'''
+   spans = trace_metrics.trace(trace.trace_id)
+   depth = {trace.span_id: 0}
+   rows = []
+   for span in spans:
+      depth[span.span_id] = depth.get(span.parent_id, 0) + 1 if span.parent_id else 0
+      rows.append({"stage": "· " * depth[span.span_id] + span.name,
+                   "ms": round(span.duration * 1000, 1),
+                   "tokens": span.attributes.get("total_tokens"),
+                   "error": span.error or ""})
+   st.dataframe(rows, hide_index=True)
 
 with st.form("job_post"):
    job_post_title = st.text_input("Job Post Title", key="job_post_title")
@@ -237,7 +161,20 @@ with st.form("job_post"):
    submitted = st.form_submit_button("Classify Job Post")
 
    if submitted:
-      chain = st.session_state["chain"]
+      from job_classification_agent.chain import build_input, get_prompt_template, load_chain, load_prompt
+      from job_classification_agent.run_pool import load_pooled_chain
+      from job_classification_agent.streaming import load_streaming_classifier
+
+      # the prompt, chain and OpenAI clients are built once per process and shared by all sessions
+      prompt = load_prompt(st.session_state["prompt_template"], st.session_state["include_explanation"], st.session_state["hints"])
+      _, chain = load_chain(st.session_state.ASSISTANT_ID)
+      assistant_id = st.session_state.ASSISTANT_ID
+      if st.session_state["reuse_threads"]:
+         _, chain = load_pooled_chain(st.session_state.ASSISTANT_ID)
+      if st.session_state.ASSISTANT_TIERS and st.session_state["route"] and not st.session_state["stream"]:
+         from job_classification_agent.router import load_router
+         chain = load_router(st.session_state.ASSISTANT_TIERS, hedge=st.session_state["hedge"])
+         assistant_id = chain.assistant_id
 
       job_post_title = st.session_state["job_post_title"]
       job_post_description = st.session_state["job_post_description"]
@@ -245,20 +182,48 @@ with st.form("job_post"):
       include_explanation = st.session_state["include_explanation"]
       hints = st.session_state["hints"]
 
-      template_args = { 
-         "job_post_title": job_post_title, 
-         "job_post_description": job_post_description, 
-         "include_explanation": include_explanation, 
-         "hints": hints if hints else "N/A"
-      }
-
-      input = {"content": prompt.format(**template_args)}
-
+      trace = None
       try:
          start_time = time.time()
-         with st.spinner('Classifying...'):
-            results = chain.invoke(input)            
-            display_results(results)
+         with st.spinner('Classifying...'), tracer.span("classify", engine=st.session_state["engine"]) as trace:
+            candidate_occupations = None
+            if st.session_state["shortlist"]:
+               with tracer.span("shortlist"):
+                  candidates = load_retriever().shortlist(job_post_title, job_post_description, st.session_state["shortlist_size"])
+               candidate_occupations = format_candidates(candidates)
+
+            input = build_input(prompt, job_post_title, job_post_description, include_explanation, hints, candidate_occupations)
+
+            results = None
+            if st.session_state["engine"] == "Local (offline)":
+               with tracer.span("local_classifier"):
+                  results = load_local_classifier().classify(job_post_title, job_post_description)
+
+            if results is None and st.session_state["fast_path"]:
+               with tracer.span("fast_path"):
+                  results = title_matcher.classify(job_post_title, include_explanation)
+
+            key = cache_key(job_post_title, job_post_description, hints, include_explanation,
+                            get_prompt_template(prompt), assistant_id, candidate_occupations)
+            if results is None and st.session_state["use_cache"]:
+               with tracer.span("cache.get"):
+                  results = classification_cache.get(key)
+
+            if results is None and st.session_state["stream"]:
+               results = display_streamed_results(load_streaming_classifier(st.session_state.ASSISTANT_ID).stream(input))
+               title_matcher.stats.record_assistant_run(time.time() - start_time)
+               with tracer.span("cache.put"):
+                  classification_cache.put(key, results)
+
+            elif results is None:
+               results = chain.invoke(input)
+               title_matcher.stats.record_assistant_run(time.time() - start_time)
+               with tracer.span("cache.put"):
+                  classification_cache.put(key, results)
+               display_results(results)
+
+            else:
+               display_results(results)
       
       except ValidationError as e:
          st.error(f"Validation Error: {e}\n\n{e.errors()}")
@@ -269,4 +234,24 @@ with st.form("job_post"):
       finally: 
          end_time = time.time()
          execution_time = end_time - start_time
-         st.info(f"Execution time: {execution_time} seconds")
\ No newline at end of file
+         st.info(f"Execution time: {execution_time} seconds")
+         if trace is not None:
+            with st.expander("Stage Timings"):
+               display_trace(trace)
+
+fast_path_stats = title_matcher.stats
+st.sidebar.caption(f"Title fast path: {fast_path_stats.hits}/{fast_path_stats.lookups} hits ({fast_path_stats.hit_rate:.0%}), "
+                   f"~{fast_path_stats.time_saved:.0f} seconds of assistant time saved")
+
+cache_stats = classification_cache.stats
+st.sidebar.caption(f"Cache: {cache_stats.hits} hits, {cache_stats.misses} misses ({cache_stats.hit_rate:.0%}), {len(classification_cache)} entries")
+
+if st.session_state.ASSISTANT_TIERS and st.session_state["route"] and not st.session_state["stream"]:
+   from job_classification_agent.router import load_router
+   router_stats = load_router(st.session_state.ASSISTANT_TIERS, hedge=st.session_state["hedge"]).stats
+   st.sidebar.caption(f"Routing: {router_stats.posts} job posts, {router_stats.format_summary()}")
+
+if st.session_state["reuse_threads"]:
+   from job_classification_agent.run_pool import load_pooled_chain
+   pool_stats = load_pooled_chain(st.session_state.ASSISTANT_ID)[0].stats
+   st.sidebar.caption(f"Thread pool: {pool_stats.runs} runs, {pool_stats.threads_reused} on reused threads, {pool_stats.polls_per_run:.1f} polls per run")
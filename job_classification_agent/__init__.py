@@ -0,0 +1,6 @@
+'''Job Classification Agent - classify job posts into O*NET 28 occupations'''
+
+from job_classification_agent.models import JobClassification, JobClassifications
+from job_classification_agent.taxonomy import Occupation, TaxonomyIndex
+
+__all__ = ["JobClassification", "JobClassifications", "Occupation", "TaxonomyIndex"]
@@ -0,0 +1,656 @@
+'''Headless batch classification of job posts
+
+Reads job posts from a JSON Lines or CSV file, classifies them with many concurrent
+assistant runs and streams one JSON Lines record per job post to the output file.
+
+The output file doubles as the checkpoint: when a batch is restarted, job posts that
+already have a successful record in the output file are skipped.
+
+With --pack-size N, up to N job posts are classified per assistant run (see packing.py).
+With --hierarchical, job posts are classified in two stages, SOC major group first (see hierarchy.py).
+With --tiers, job posts are routed across assistant tiers, cheapest first, and slow runs can be hedged (see router.py).
+
+With --engine local the assistant is not used at all: job posts are classified in
+chunks by the offline similarity classifier (see local_classifier.py).
+
+usage: python -m job_classification_agent.batch [-h] [--assistant-id ASSISTANT_ID] [--concurrency CONCURRENCY] ... input output
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterable, List, Optional, Set, Tuple
+
+import openai
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+
+from job_classification_agent.models import JobClassifications
+from job_classification_agent.job_posts import JobPost, read_job_posts
+from job_classification_agent.chain import DEFAULT_PROMPT_TEMPLATE, build_chain, build_input, build_prompt, get_prompt_template
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.retrieval import OccupationRetriever, format_candidates, load_retriever
+from job_classification_agent.fast_path import DEFAULT_THRESHOLD, TitleMatcher
+from job_classification_agent.cache import CACHE_PATH, ClassificationCache, cache_key
+from job_classification_agent.dedup import DEFAULT_THRESHOLD as DEFAULT_DEDUP_THRESHOLD, Cluster, NearDuplicateDetector
+from job_classification_agent.hierarchy import SUBTREE_PROMPT_TEMPLATE, Hierarchy
+from job_classification_agent.local_classifier import LocalClassifier, load_local_classifier
+from job_classification_agent.packing import DEFAULT_PACK_SIZE, build_packed_chain, build_packed_input, build_packed_prompt
+from job_classification_agent.router import DEFAULT_MIN_CONFIDENCE, build_router, load_tiers
+from job_classification_agent.run_pool import build_pooled_chain
+from job_classification_agent.streaming import StreamingClassifier
+from job_classification_agent.tracing import configure_tracing, tracer
+
+logger = logging.getLogger(__name__)
+
+# errors raised by the OpenAI client that are worth retrying
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+# run failures reported by the Assistants API (surfaced by langchain as a ValueError)
+RETRYABLE_RUN_ERRORS = ("rate_limit_exceeded", "server_error")
+
+@dataclass
+class BatchResult:
+   post_id: str
+   result: Optional[JobClassifications] = None
+   error: Optional[str] = None
+   attempts: int = 0
+   elapsed: float = 0.0
+   source: str = "assistant"
+   duplicate_of: Optional[str] = None
+   # set when the run failed with a transient error: the suggested delay before trying again (not written to the output)
+   retry_after: Optional[float] = None
+
+   @property
+   def ok(self) -> bool:
+      return self.error is None
+
+   def to_record(self) -> dict:
+      record = {"id": self.post_id}
+      if self.ok:
+         record.update(json.loads(self.result.json()))
+      else:
+         record["error"] = self.error
+      record["source"] = self.source
+      if self.duplicate_of is not None:
+         record["duplicate_of"] = self.duplicate_of
+      record["attempts"] = self.attempts
+      record["elapsed"] = round(self.elapsed, 3)
+      return record
+
+@dataclass
+class BatchStats:
+   submitted: int = 0
+   succeeded: int = 0
+   failed: int = 0
+   skipped: int = 0
+   retries: int = 0
+   duplicates: int = 0
+   packs: int = 0
+   pack_fallbacks: int = 0
+   hierarchical: int = 0
+   hierarchy_fallbacks: int = 0
+   started_at: float = field(default_factory=time.monotonic)
+
+   @property
+   def elapsed(self) -> float:
+      return time.monotonic() - self.started_at
+
+   @property
+   def throughput(self) -> float:
+      '''Completed job posts per second'''
+      return (self.succeeded + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+def read_checkpoint(path: str) -> Set[str]:
+   '''Get the ids of job posts that were already classified successfully in an output file'''
+   completed = set()
+   if not os.path.exists(path):
+      return completed
+
+   with open(path, encoding="utf-8") as f:
+      for line in f:
+         try:
+            record = json.loads(line)
+         except json.JSONDecodeError:
+            # a partially written last line from an interrupted run
+            continue
+         if "error" not in record:
+            completed.add(str(record["id"]))
+
+   return completed
+
+def is_retryable(error: Exception) -> bool:
+   '''Check if an error is transient (rate limits, timeouts, server errors)'''
+   if isinstance(error, RETRYABLE_ERRORS):
+      return True
+   return isinstance(error, ValueError) and any(code in str(error) for code in RETRYABLE_RUN_ERRORS)
+
+def retry_after(error: Exception) -> Optional[float]:
+   '''Get the server requested delay (in seconds) from a rate limit response, if any'''
+   response = getattr(error, "response", None)
+   if response is None:
+      return None
+   try:
+      return float(response.headers.get("retry-after"))
+   except (TypeError, ValueError):
+      return None
+
+class BatchClassifier:
+   '''Classify job posts with a bounded pool of concurrent assistant runs
+
+   Rate limit errors pause all workers, not just the one that hit the limit, so that
+   the pool backs off together instead of hammering the API with retries.
+   '''
+
+   def __init__(self, chain: Runnable, prompt: ChatPromptTemplate, concurrency: int = 8, max_retries: int = 5,
+                backoff_base: float = 1.0, backoff_max: float = 60.0, include_explanation: bool = True, hints: Optional[str] = None,
+                retriever: Optional[OccupationRetriever] = None, shortlist_size: int = 10, fast_path: Optional[TitleMatcher] = None,
+                cache: Optional[ClassificationCache] = None, assistant_id: str = "",
+                deduplicator: Optional[NearDuplicateDetector] = None, dedup_window: int = 10_000,
+                pack_size: int = 1, packed_chain: Optional[Runnable] = None, packed_prompt: Optional[ChatPromptTemplate] = None,
+                hierarchy: Optional[Hierarchy] = None):
+      assert pack_size == 1 or packed_chain is not None, "packed_chain is required for pack_size > 1"
+      assert pack_size == 1 or hierarchy is None, "packed runs are not hierarchical"
+      self.chain = chain
+      self.prompt = prompt
+      self.concurrency = concurrency
+      self.max_retries = max_retries
+      self.backoff_base = backoff_base
+      self.backoff_max = backoff_max
+      self.include_explanation = include_explanation
+      self.hints = hints
+      self.retriever = retriever
+      self.shortlist_size = shortlist_size
+      self.fast_path = fast_path
+      self.cache = cache
+      self.assistant_id = assistant_id
+      self.deduplicator = deduplicator
+      self.dedup_window = dedup_window
+      self.pack_size = pack_size
+      self.packed_chain = packed_chain
+      self.packed_prompt = packed_prompt or build_packed_prompt(include_explanation=include_explanation, hints=hints)
+      self.hierarchy = hierarchy
+      self.clusters: List[Cluster] = []
+      self.stats = BatchStats()
+      self._resume_at = 0.0
+
+   def backoff(self, attempt: int, error: Exception) -> float:
+      '''Exponential backoff with full jitter, honoring retry-after when the API sends one'''
+      delay = retry_after(error)
+      if delay is None:
+         delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+      return delay
+
+   async def classify(self, post: JobPost) -> BatchResult:
+      '''Classify a single job post, retrying transient errors'''
+      with tracer.span("classify", post_id=post.id) as span:
+         result = await self._classify(post)
+         if span is not None:
+            span.set(source=result.source, attempts=result.attempts, ok=result.ok)
+         return result
+
+   async def _classify(self, post: JobPost) -> BatchResult:
+      result, candidate_occupations, key = self._prepare_or_fail(post)
+      if result is not None:
+         return result
+      return await self._classify_with_assistant(post, candidate_occupations, key)
+
+   def _prompt_template(self) -> str:
+      return get_prompt_template(self.packed_prompt if self.pack_size > 1 else self.prompt)
+
+   def _cache_key(self, post: JobPost, prompt_template: str, candidate_occupations: Optional[str]) -> str:
+      return cache_key(post.title, post.description, self.hints, self.include_explanation,
+                       prompt_template, self.assistant_id, candidate_occupations)
+
+   def _single_post_key(self, post: JobPost, candidate_occupations: Optional[str], key: Optional[str]) -> Optional[str]:
+      '''Cache key of a single-post run of a job post prepared for packing (None without a cache)'''
+      return None if key is None else self._cache_key(post, get_prompt_template(self.prompt), candidate_occupations)
+
+   def _prepare(self, post: JobPost) -> Tuple[Optional[BatchResult], Optional[str], Optional[str]]:
+      '''Classify a job post without the assistant (fast path, cache), or get its candidate occupations and cache key'''
+      if self.fast_path is not None:
+         with tracer.span("fast_path"):
+            fast_result = self.fast_path.classify(post.title, self.include_explanation)
+         if fast_result is not None:
+            return BatchResult(post_id=post.id, result=fast_result, source="fast_path"), None, None
+
+      candidate_occupations = None
+      if self.retriever is not None:
+         with tracer.span("shortlist"):
+            candidate_occupations = format_candidates(self.retriever.shortlist(post.title, post.description, self.shortlist_size))
+
+      key = None
+      if self.cache is not None:
+         key = self._cache_key(post, self._prompt_template(), candidate_occupations)
+         keys = [key]
+         if self.pack_size > 1:
+            # job posts that fell back from a pack to a single-post run
+            keys.append(self._single_post_key(post, candidate_occupations, key))
+         if self.hierarchy is not None:
+            # two-stage results are cached apart from flat results (job posts that fell back to flat mode)
+            keys.insert(0, self._cache_key(post, SUBTREE_PROMPT_TEMPLATE, None))
+         with tracer.span("cache.get"):
+            cached_result = next((result for result in map(self.cache.get, keys) if result is not None), None)
+         if cached_result is not None:
+            return BatchResult(post_id=post.id, result=cached_result, source="cache"), None, None
+
+      return None, candidate_occupations, key
+
+   def _prepare_or_fail(self, post: JobPost) -> Tuple[Optional[BatchResult], Optional[str], Optional[str]]:
+      '''_prepare, with its errors (fast path, shortlist or cache) turned into a failed result for the job post'''
+      try:
+         return self._prepare(post)
+      except Exception as e:
+         logger.warning("job post %s: preparing the classification failed: %s: %s", post.id, type(e).__name__, e)
+         return BatchResult(post_id=post.id, error=f"{type(e).__name__}: {e}"), None, None
+
+   def _record_result(self, key: Optional[str], result: JobClassifications, elapsed: float) -> None:
+      if self.fast_path is not None:
+         self.fast_path.stats.record_assistant_run(elapsed)
+      if self.cache is not None:
+         with tracer.span("cache.put"):
+            self.cache.put(key, result)
+
+   async def _classify_with_assistant(self, post: JobPost, candidate_occupations: Optional[str], key: Optional[str]) -> BatchResult:
+      '''Classify a prepared job post with the assistant, errors outside the runs (hierarchy, cache) turned into a failed result'''
+      result = BatchResult(post_id=post.id)
+      start_time = time.monotonic()
+
+      try:
+         if self.hierarchy is not None:
+            result.result = await self._classify_hierarchical(post, result)
+         if result.result is None and result.error is None:
+            input = build_input(self.prompt, post.title, post.description, self.include_explanation, self.hints, candidate_occupations)
+            result.result = await self._invoke(self.chain, input, result)
+         if result.ok:
+            if result.source == "hierarchical" and key is not None:
+               key = self._cache_key(post, SUBTREE_PROMPT_TEMPLATE, None)
+            self._record_result(key, result.result, time.monotonic() - start_time)
+      except Exception as e:
+         logger.warning("job post %s: classification failed: %s: %s", post.id, type(e).__name__, e)
+         result.result, result.error = None, f"{type(e).__name__}: {e}"
+
+      result.elapsed = time.monotonic() - start_time
+      return result
+
+   async def _classify_hierarchical(self, post: JobPost, result: BatchResult) -> Optional[JobClassifications]:
+      '''Select the major groups of a job post, then classify it among their occupations
+
+      Returns None without an error when stage one selected no known major group, the job post is then classified in flat mode.
+      '''
+      with tracer.span("hierarchy.select_groups"):
+         groups = await self._invoke(self.hierarchy.group_chain, self.hierarchy.group_input(post.title, post.description, self.hints), result)
+      if not groups:
+         if result.ok:
+            self.stats.hierarchy_fallbacks += 1
+         return None
+
+      with tracer.span("hierarchy.classify", major_groups=",".join(groups)):
+         input = self.hierarchy.subtree_input(groups, post.title, post.description, self.include_explanation, self.hints)
+         classifications = await self._invoke(self.hierarchy.chain, input, result)
+      if classifications is not None:
+         result.source = "hierarchical"
+         self.stats.hierarchical += 1
+      return classifications
+
+   async def _invoke(self, chain: Runnable, input: dict, result: BatchResult) -> Any:
+      '''Invoke a chain, retrying transient errors (sets result.error when giving up)
+
+      Every invocation has its own max_retries budget, so the stages of a two-stage
+      classification do not use up each other's retries; result.attempts counts the
+      runs of all of them.
+      '''
+      attempt = 0
+      while True:
+         # wait out a pool-wide pause triggered by a rate limit
+         pause = self._resume_at - time.monotonic()
+         if pause > 0:
+            with tracer.span("backoff"):
+               await asyncio.sleep(pause)
+
+         attempt += 1
+         result.attempts += 1
+         try:
+            return await chain.ainvoke(input)
+         except Exception as e:
+            if not is_retryable(e) or attempt > self.max_retries:
+               result.error = f"{type(e).__name__}: {e}"
+               if is_retryable(e):
+                  result.retry_after = self.backoff(attempt, e)
+               return None
+
+            delay = self.backoff(attempt, e)
+            logger.warning("job post %s: %s, retrying in %.1fs (attempt %d)", result.post_id, type(e).__name__, delay, attempt)
+            self.stats.retries += 1
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+   async def classify_pack(self, pack: List[Tuple[JobPost, Optional[str], Optional[str]]]) -> List[BatchResult]:
+      '''Classify prepared job posts (post, candidate occupations, cache key) in one packed assistant run
+
+      Job posts missing from the packed answer, or all of them when the packed run fails,
+      fall back to single-post runs.
+      '''
+      if len(pack) == 1:
+         post, candidate_occupations, key = pack[0]
+         return [await self._classify_with_assistant(post, candidate_occupations, self._single_post_key(post, candidate_occupations, key))]
+
+      with tracer.span("classify_pack", size=len(pack)) as span:
+         input = build_packed_input(self.packed_prompt, [(str(i + 1), post.title, post.description, candidate_occupations)
+                                                         for i, (post, candidate_occupations, _) in enumerate(pack)])
+         pack_result = BatchResult(post_id=",".join(post.id for post, _, _ in pack))
+         start_time = time.monotonic()
+         answers = await self._invoke(self.packed_chain, input, pack_result) or {}
+         elapsed = time.monotonic() - start_time
+         self.stats.packs += 1
+         if not pack_result.ok:
+            logger.warning("pack of %d job posts failed (%s), falling back to single-post runs", len(pack), pack_result.error)
+
+         results = []
+         for i, (post, candidate_occupations, key) in enumerate(pack):
+            answer = answers.get(str(i + 1))
+            if answer is None:
+               self.stats.pack_fallbacks += 1
+               results.append(await self._classify_with_assistant(post, candidate_occupations, self._single_post_key(post, candidate_occupations, key)))
+               continue
+            result = BatchResult(post_id=post.id, result=answer, attempts=pack_result.attempts, elapsed=elapsed, source="packed")
+            try:
+               # the assistant time of a packed post is its share of the run
+               self._record_result(key, answer, elapsed / len(pack))
+            except Exception as e:
+               logger.warning("job post %s: recording the classification failed: %s: %s", post.id, type(e).__name__, e)
+               result.result, result.error = None, f"{type(e).__name__}: {e}"
+            results.append(result)
+
+         if span is not None:
+            span.set(answered=len(answers), fallbacks=sum(r.source != "packed" for r in results))
+      return results
+
+   async def stream(self, posts: Iterable[JobPost], skip: Optional[Set[str]] = None) -> AsyncIterator[BatchResult]:
+      '''Classify job posts concurrently, yielding results in completion order
+
+      With a deduplicator, job posts are clustered in windows of dedup_window posts and
+      only the representative of each near-duplicate cluster is classified; its result
+      is fanned out to the other members of the cluster.
+      '''
+      skip = skip or set()
+      pending = asyncio.Queue(maxsize=self.concurrency * 2)
+      results = asyncio.Queue()
+      duplicates = {}
+
+      async def submit_clusters(window: List[JobPost]):
+         clusters = await asyncio.get_running_loop().run_in_executor(None, self.deduplicator.cluster, window)
+         for cluster in clusters:
+            if cluster.members:
+               duplicates[cluster.representative.id] = cluster.members
+               self.clusters.append(cluster)
+            await pending.put(cluster.representative)
+
+      async def produce():
+         window = []
+         for post in posts:
+            if post.id in skip:
+               self.stats.skipped += 1
+               continue
+            self.stats.submitted += 1
+            if self.deduplicator is None:
+               await pending.put(post)
+               continue
+            window.append(post)
+            if len(window) >= self.dedup_window:
+               await submit_clusters(window)
+               window = []
+         if window:
+            await submit_clusters(window)
+         for _ in range(self.concurrency):
+            await pending.put(None)
+
+      async def work():
+         try:
+            while (post := await pending.get()) is not None:
+               await results.put(await self.classify(post))
+         finally:
+            # the consumer waits for one None per worker, even when a worker fails
+            await results.put(None)
+
+      async def work_packed():
+         # job posts answered without the assistant are passed on right away, the others are packed
+         pack, done = [], False
+         try:
+            while not done:
+               post = await pending.get()
+               if post is None:
+                  done = True
+               else:
+                  with tracer.span("prepare", post_id=post.id):
+                     result, candidate_occupations, key = self._prepare_or_fail(post)
+                  if result is not None:
+                     await results.put(result)
+                     continue
+                  pack.append((post, candidate_occupations, key))
+               if pack and (done or len(pack) >= self.pack_size):
+                  for result in await self.classify_pack(pack):
+                     await results.put(result)
+                  pack = []
+         finally:
+            await results.put(None)
+
+      worker = work_packed if self.pack_size > 1 else work
+      tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+
+      try:
+         running = self.concurrency
+         while running:
+            result = await results.get()
+            if result is None:
+               running -= 1
+               continue
+
+            fanned_out = [BatchResult(post_id=member.id, result=result.result, error=result.error, source="near_duplicate", duplicate_of=result.post_id)
+                          for member in duplicates.pop(result.post_id, [])]
+            self.stats.duplicates += len(fanned_out)
+
+            for r in [result] + fanned_out:
+               if r.ok:
+                  self.stats.succeeded += 1
+               else:
+                  self.stats.failed += 1
+               yield r
+      finally:
+         for task in tasks:
+            task.cancel()
+         await asyncio.gather(*tasks, return_exceptions=True)
+
+   async def run(self, posts: Iterable[JobPost], output_path: str, resume: bool = True) -> BatchStats:
+      '''Classify job posts and append one JSON Lines record per job post to output_path'''
+      skip = read_checkpoint(output_path) if resume else set()
+
+      with open(output_path, "a" if resume else "w", encoding="utf-8") as f:
+         async for result in self.stream(posts, skip=skip):
+            f.write(json.dumps(result.to_record()) + "\n")
+            f.flush()
+
+            completed = self.stats.succeeded + self.stats.failed
+            if completed % 100 == 0:
+               logger.info("classified %d job posts (%d failed, %.2f posts/s)", completed, self.stats.failed, self.stats.throughput)
+
+      return self.stats
+
+def run_local(classifier: LocalClassifier, posts: Iterable[JobPost], output_path: str, resume: bool = True, chunk_size: int = 1000) -> BatchStats:
+   '''Classify job posts offline in chunks and append one JSON Lines record per job post to output_path'''
+   stats = BatchStats()
+   skip = read_checkpoint(output_path) if resume else set()
+
+   def classify_chunk(chunk: List[JobPost], f) -> None:
+      start_time = time.perf_counter()
+      results = classifier.classify_batch([(post.title, post.description) for post in chunk])
+      elapsed = (time.perf_counter() - start_time) / len(chunk)
+      for post, result in zip(chunk, results):
+         f.write(json.dumps(BatchResult(post_id=post.id, result=result, attempts=1, elapsed=elapsed, source="local").to_record()) + "\n")
+      f.flush()
+      stats.succeeded += len(chunk)
+      logger.info("classified %d job posts (%.0f posts/s)", stats.succeeded, stats.throughput)
+
+   with open(output_path, "a" if resume else "w", encoding="utf-8") as f:
+      chunk = []
+      for post in posts:
+         if post.id in skip:
+            stats.skipped += 1
+            continue
+         stats.submitted += 1
+         chunk.append(post)
+         if len(chunk) >= chunk_size:
+            classify_chunk(chunk, f)
+            chunk = []
+      if chunk:
+         classify_chunk(chunk, f)
+
+   return stats
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Classify a batch of job posts")
+   parser.add_argument("--engine", type=str, choices=["assistant", "local"], default="assistant", help="Classify with the OpenAI assistant or the offline similarity classifier (default: assistant)")
+   parser.add_argument("--assistant-id", type=str, default=os.environ.get("ASSISTANT_ID"), help="Assistant ID (default: ASSISTANT_ID environment variable)")
+   parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of concurrent assistant runs (default: 8)")
+   parser.add_argument("--max-retries", type=int, default=5, help="Maximum retries for rate limited or failed runs (default: 5)")
+   parser.add_argument("--backoff-base", type=float, default=1.0, help="Base delay in seconds for exponential backoff (default: 1.0)")
+   parser.add_argument("--backoff-max", type=float, default=60.0, help="Maximum delay in seconds for exponential backoff (default: 60.0)")
+   parser.add_argument("--prompt-template", type=str, default=None, help="File with a custom prompt template (single-post runs only, not with --pack-size)")
+   parser.add_argument("--hints", type=str, default=None, help="Additional hints for the assistant")
+   parser.add_argument("--shortlist", type=int, default=0, metavar="K", help="Include the top K candidate occupations from the local search index in the prompt (default: 0, disabled)")
+   parser.add_argument("--fast-path", action="store_true", help="Classify job posts with a matching O*NET title without running the assistant")
+   parser.add_argument("--fast-path-threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Minimum title match confidence for the fast path (default: {DEFAULT_THRESHOLD})")
+   parser.add_argument("--cache", type=str, default=CACHE_PATH, help="Classification cache database (default: data/cache/classifications.db)")
+   parser.add_argument("--no-cache", action="store_true", help="Do not read or write the classification cache")
+   parser.add_argument("--dedup", action="store_true", help="Classify one job post per near-duplicate cluster and copy its result to the other members")
+   parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_DEDUP_THRESHOLD, help=f"Minimum description similarity for near-duplicates (default: {DEFAULT_DEDUP_THRESHOLD})")
+   parser.add_argument("--dedup-report", type=str, default=None, help="JSON Lines file for the near-duplicate clusters (for auditing)")
+   parser.add_argument("--stream", action="store_true", help="Stream assistant runs instead of polling them (no polling delay, tolerant parsing of the streamed answer)")
+   parser.add_argument("--pack-size", type=int, default=1, help=f"Classify up to N job posts per assistant run, falling back to single-post runs for posts missing from the answer (default: 1, packing disabled; try {DEFAULT_PACK_SIZE})")
+   parser.add_argument("--hierarchical", action="store_true", help="Two-stage classification: select the SOC major groups, then classify among their occupations (no file_search)")
+   parser.add_argument("--tiers", type=str, default=None, help="JSON file of assistant tiers, cheapest first: weak answers are escalated to the next tier (replaces --assistant-id)")
+   parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE, help=f"Escalate answers whose first classification was repaired with a lower confidence (default: {DEFAULT_MIN_CONFIDENCE})")
+   parser.add_argument("--hedge", action="store_true", help="With --tiers, start a second run when a run exceeds the tier's p95 latency and keep the first answer")
+   parser.add_argument("--hedge-after", type=float, default=None, help="Hedge runs after this many seconds instead of the tier's p95 latency (implies --hedge)")
+   parser.add_argument("--reuse-threads", action="store_true", help="Run on reused warm threads with adaptive polling instead of a new thread per run")
+   parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum number of in-flight runs with --reuse-threads (default: --concurrency)")
+   parser.add_argument("--trace", action="store_true", help="Trace the stages of every classification and print per-stage latency percentiles and token usage")
+   parser.add_argument("--trace-file", type=str, default=None, help="JSON Lines file for the trace spans (implies --trace)")
+   parser.add_argument("--otel", action="store_true", help="Export the trace spans through OpenTelemetry (implies --trace, requires opentelemetry)")
+   parser.add_argument("--trace-run-steps", action="store_true", help="Also fetch the run steps of every run to split file_search from generation time (one more API call per run)")
+   parser.add_argument("--no-explanation", action="store_true", help="Do not ask the assistant for explanations")
+   parser.add_argument("--no-resume", action="store_true", help="Overwrite the output file instead of resuming from it")
+   parser.add_argument("input", type=str, help="JSON Lines or CSV file of job posts")
+   parser.add_argument("output", type=str, help="JSON Lines file for the classification results")
+   return parser.parse_args()
+
+def main(args) -> None:
+
+   if args.engine == "local":
+      stats = run_local(load_local_classifier(), read_job_posts(args.input), args.output, resume=not args.no_resume)
+      print(f"Classified {stats.succeeded} job posts offline in {stats.elapsed:.1f} seconds ({stats.throughput:.0f} posts/s), skipped (checkpoint): {stats.skipped}")
+      return
+
+   assert(args.assistant_id is not None or args.tiers), "ASSISTANT_ID environment variable is not set.  Please run create_assistant.py to create an assistant."
+   assert(not args.tiers or not (args.stream or args.pack_size > 1 or args.hierarchical)), "routed runs are not streamed, packed or hierarchical"
+   assert(not args.prompt_template or args.pack_size == 1), "packed runs use the packed prompt, --prompt-template needs --pack-size 1"
+
+   prompt_template = DEFAULT_PROMPT_TEMPLATE
+   if args.prompt_template:
+      with open(args.prompt_template, encoding="utf-8") as f:
+         prompt_template = f.read()
+
+   include_explanation = not args.no_explanation
+
+   metrics = None
+   if args.trace or args.trace_file or args.otel or args.trace_run_steps:
+      metrics = configure_tracing(args.trace_file, otel=args.otel)
+
+   load_knowledge_base()
+   pool = router = None
+   if args.tiers:
+      router = build_router(load_tiers(args.tiers), reuse_threads=args.reuse_threads, trace_run_steps=args.trace_run_steps,
+                            max_in_flight=args.max_in_flight or args.concurrency, min_confidence=args.min_confidence,
+                            hedge=args.hedge or args.hedge_after is not None, hedge_after=args.hedge_after)
+      agent, chain = None, router
+      # results of routed runs are cached apart from single-assistant results
+      args.assistant_id = router.assistant_id
+   elif args.reuse_threads:
+      pool, chain = build_pooled_chain(args.assistant_id, max_in_flight=args.max_in_flight or args.concurrency, warm_threads=args.concurrency)
+      pool.warm()
+      agent = pool
+   else:
+      agent, chain = build_chain(args.assistant_id, trace_run_steps=args.trace_run_steps)
+   if args.stream:
+      # packed runs are not streamed (the stream parser reads a single post's classifications)
+      chain = StreamingClassifier(args.assistant_id)
+   prompt = build_prompt(prompt_template, include_explanation=include_explanation, hints=args.hints)
+
+   classifier = BatchClassifier(chain, prompt,
+                                concurrency=args.concurrency,
+                                max_retries=args.max_retries,
+                                backoff_base=args.backoff_base,
+                                backoff_max=args.backoff_max,
+                                include_explanation=include_explanation,
+                                hints=args.hints,
+                                retriever=load_retriever() if args.shortlist > 0 else None,
+                                shortlist_size=args.shortlist,
+                                fast_path=TitleMatcher.build(threshold=args.fast_path_threshold) if args.fast_path else None,
+                                cache=None if args.no_cache else ClassificationCache(args.cache),
+                                assistant_id=args.assistant_id,
+                                deduplicator=NearDuplicateDetector(threshold=args.dedup_threshold) if args.dedup else None,
+                                pack_size=args.pack_size,
+                                packed_chain=build_packed_chain(agent) if args.pack_size > 1 else None,
+                                hierarchy=Hierarchy(agent, load_knowledge_base()) if args.hierarchical else None)
+
+   stats = asyncio.run(classifier.run(read_job_posts(args.input), args.output, resume=not args.no_resume))
+
+   print(f"Classified {stats.succeeded + stats.failed} job posts in {stats.elapsed:.1f} seconds ({stats.throughput:.2f} posts/s)")
+   print(f"succeeded: {stats.succeeded}, failed: {stats.failed}, skipped (checkpoint): {stats.skipped}, retries: {stats.retries}")
+
+   if classifier.deduplicator is not None:
+      print(f"near-duplicates: {stats.duplicates} job posts in {len(classifier.clusters)} clusters classified from their representative")
+      if args.dedup_report:
+         with open(args.dedup_report, "w", encoding="utf-8") as f:
+            for cluster in classifier.clusters:
+               f.write(json.dumps(cluster.to_record()) + "\n")
+
+   if classifier.fast_path is not None:
+      fast_path_stats = classifier.fast_path.stats
+      print(f"title fast path: {fast_path_stats.hits}/{fast_path_stats.lookups} hits ({fast_path_stats.hit_rate:.1%}), "
+            f"~{fast_path_stats.time_saved:.0f} seconds of assistant time saved")
+
+   if classifier.cache is not None:
+      cache_stats = classifier.cache.stats
+      print(f"cache: {cache_stats.hits} hits, {cache_stats.misses} misses ({cache_stats.hit_rate:.1%}), {cache_stats.evictions} evictions")
+
+   if args.pack_size > 1:
+      print(f"packing: {stats.packs} packed runs of up to {args.pack_size} job posts, {stats.pack_fallbacks} job posts fell back to single-post runs")
+
+   if args.hierarchical:
+      print(f"hierarchical: {stats.hierarchical} job posts classified in two stages, {stats.hierarchy_fallbacks} fell back to flat mode (no major group selected)")
+
+   if (args.pack_size > 1 or args.hierarchical) and metrics is not None and metrics.tokens:
+      print(f"tokens per classified job post: {metrics.tokens['total_tokens'] / max(1, stats.succeeded):.0f}")
+
+   if router is not None:
+      print(f"routing: {router.stats.format_summary()}")
+
+   if pool is not None:
+      pool_stats = pool.stats
+      print(f"thread pool: {pool_stats.runs} runs, {pool_stats.round_trips_per_run:.1f} round trips and {pool_stats.polls_per_run:.1f} polls per run, "
+            f"threads created {pool_stats.threads_created}, reused {pool_stats.threads_reused}, retired {pool_stats.threads_retired}")
+
+   if metrics is not None:
+      print(metrics.format_summary())
+
+if __name__ == "__main__":
+   logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+   args = get_args()
+   main(args)
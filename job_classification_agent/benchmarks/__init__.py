@@ -0,0 +1 @@
+'''Benchmarks for the classification pipeline (run with python -m job_classification_agent.benchmarks.<name>)'''
@@ -0,0 +1,80 @@
+'''Benchmark the startup and rerun cost of the Streamlit app
+
+Runs app.py headless with streamlit's AppTest and measures:
+
+- cold start: the first run of the script in a fresh process (imports, knowledge base,
+  title matcher and cache), i.e. the time to the first page render
+- new session: the first run of the script for another session in a warm process
+- rerun: re-executing the script after a widget interaction (p50 and p95)
+- deferred imports: importing the assistant chain modules, paid once per process on the first classification
+
+and compares them against the time budgets below (exits with status 1 when a budget is
+exceeded).  No assistant run is started, dummy ASSISTANT_ID / OPENAI_API_KEY values are used if unset.
+
+usage: python -m job_classification_agent.benchmarks.app_startup [-h] [--reruns RERUNS] [--app APP]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+# time budgets in seconds (measured: ~0.5 s cold start, ~0.2 s new session, ~30 ms rerun)
+COLD_START_BUDGET = 1.0
+NEW_SESSION_BUDGET = 0.3
+RERUN_BUDGET = 0.1
+
+def timed_run(app: AppTest) -> float:
+   start_time = time.perf_counter()
+   app.run()
+   elapsed = time.perf_counter() - start_time
+   if app.exception:
+      raise RuntimeError(f"app.py raised: {app.exception[0].value}")
+   return elapsed
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Benchmark the startup and rerun cost of the Streamlit app")
+   parser.add_argument("--reruns", type=int, default=20, help="Number of reruns to time (default: 20)")
+   parser.add_argument("--app", type=str, default=os.path.join(os.getcwd(), "app.py"), help="Path of app.py (default: ./app.py)")
+   return parser.parse_args()
+
+def main(args) -> None:
+   os.environ.setdefault("ASSISTANT_ID", "asst_benchmark")
+   os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+   cold_start = timed_run(AppTest.from_file(args.app, default_timeout=120))
+   new_session = timed_run(AppTest.from_file(args.app, default_timeout=120))
+
+   app = AppTest.from_file(args.app, default_timeout=120)
+   timed_run(app)
+   reruns = []
+   for i in range(args.reruns):
+      app.checkbox(key="include_explanation").set_value(i % 2 == 1)
+      reruns.append(timed_run(app))
+   reruns.sort()
+   rerun_p50 = reruns[len(reruns) // 2]
+   rerun_p95 = reruns[min(len(reruns) - 1, int(0.95 * len(reruns)))]
+
+   deferred = [name for name in ("job_classification_agent.chain", "job_classification_agent.streaming", "job_classification_agent.run_pool")
+               if name in sys.modules]
+   start_time = time.perf_counter()
+   import job_classification_agent.chain, job_classification_agent.streaming, job_classification_agent.run_pool  # noqa: E401,F401
+   import_time = time.perf_counter() - start_time
+
+   rows = [("cold start", cold_start, COLD_START_BUDGET),
+           ("new session", new_session, NEW_SESSION_BUDGET),
+           ("rerun p50", rerun_p50, RERUN_BUDGET),
+           ("rerun p95", rerun_p95, RERUN_BUDGET)]
+   for name, value, budget in rows:
+      print(f"{name:<12} {value * 1000:>8.1f} ms   budget {budget * 1000:>6.0f} ms   {'ok' if value <= budget else 'OVER BUDGET'}")
+   print(f"chain imports on the first classification: {import_time * 1000:.0f} ms" +
+         (f" (already imported before the first classification: {', '.join(deferred)})" if deferred else ""))
+
+   if any(value > budget for _, value, budget in rows):
+      sys.exit(1)
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
@@ -0,0 +1,234 @@
+'''Benchmark the per-classification overhead of assistant runs
+
+Runs job post classifications against an in-process fake of the Assistants API
+endpoints used by the classification runnables.  The fake simulates the network
+round trip time of every call, the cost of creating a thread and log-normally
+distributed queue and run durations (optionally with a fraction of very slow runs),
+and counts the API calls it receives.  It compares:
+
+- baseline: TracedAssistantRunnable (a new thread per run, polling every second)
+- pooled: PooledAssistantRunnable (reused warm threads, adaptive polling, capped in-flight runs)
+
+and reports the latency percentiles, round trips and polls per classification and
+the throughput at the given concurrency.  All simulated durations and poll intervals
+are multiplied by --time-scale to shorten the benchmark; reported times are scaled back.
+
+usage: python -m job_classification_agent.benchmarks.assistant_overhead [-h] [--posts POSTS] [--concurrency CONCURRENCY] [--time-scale TIME_SCALE] ...
+'''
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import threading
+import time
+
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Callable, List, Optional
+
+from openai.types.beta.threads import Text, TextContentBlock
+
+from job_classification_agent.chain import TracedAssistantRunnable
+from job_classification_agent.run_pool import AdaptivePoller, PooledAssistantRunnable
+
+ANSWER = json.dumps({"job_classifications": [{"occupation_code": "15-1252.00", "occupation_title": "Software Developers"}],
+                     "overall_explanation": "benchmark answer"})
+
+class FakeAssistantsAPI:
+   '''Simulated Assistants API: threads, runs with queue and run durations, and their messages
+
+   A slow_fraction of the runs takes slow_factor times longer (the occasional very slow run).
+   answer returns the assistant's answer to a message (default: ANSWER).
+   '''
+
+   def __init__(self, rtt: float = 0.08, thread_create: float = 0.15, queue_median: float = 0.4, run_median: float = 3.0,
+                sigma: float = 0.5, time_scale: float = 1.0, seed: int = 0, slow_fraction: float = 0.0, slow_factor: float = 10.0,
+                model: str = "gpt-4o-mini", answer: Optional[Callable[[str], str]] = None):
+      self.rtt = rtt
+      self.thread_create = thread_create
+      self.queue_median = queue_median
+      self.run_median = run_median
+      self.sigma = sigma
+      self.time_scale = time_scale
+      self.slow_fraction = slow_fraction
+      self.slow_factor = slow_factor
+      self.model = model
+      self.answer = answer or (lambda content: ANSWER)
+      self.calls: Counter = Counter()
+      self.runs = {}
+      self.active_runs = {}
+      self._random = random.Random(seed)
+      self._ids = itertools.count()
+      self._lock = threading.Lock()
+
+   def _delay(self, endpoint: str) -> float:
+      with self._lock:
+         self.calls[endpoint] += 1
+      return (self.rtt + (self.thread_create if endpoint in ("threads.create", "threads.create_and_run") else 0.0)) * self.time_scale
+
+   def _new_thread(self) -> str:
+      return f"thread_{next(self._ids)}"
+
+   def _new_run(self, thread_id: str, messages: List[dict]) -> Any:
+      with self._lock:
+         if thread_id in self.active_runs:
+            raise ValueError(f"Thread {thread_id} already has an active run {self.active_runs[thread_id]}")
+         queued = self._random.lognormvariate(math.log(self.queue_median), self.sigma) * self.time_scale
+         running = self._random.lognormvariate(math.log(self.run_median), self.sigma) * self.time_scale
+         if self._random.random() < self.slow_fraction:
+            running *= self.slow_factor
+         now = time.perf_counter()
+         run = SimpleNamespace(id=f"run_{next(self._ids)}", thread_id=thread_id, status="queued", last_error=None, usage=None,
+                               model=self.model, started=now + queued, completed=now + queued + running,
+                               answer=self.answer(messages[-1]["content"] if messages else ""))
+         self.runs[run.id] = run
+         self.active_runs[thread_id] = run.id
+      return run
+
+   def _retrieve(self, run_id: str) -> Any:
+      with self._lock:
+         run = self.runs[run_id]
+         now = time.perf_counter()
+         if run.status == "cancelled":
+            pass
+         elif now >= run.completed:
+            run.status = "completed"
+            run.usage = SimpleNamespace(prompt_tokens=1500, completion_tokens=80, total_tokens=1580)
+            self.active_runs.pop(run.thread_id, None)
+         elif now >= run.started:
+            run.status = "in_progress"
+      return run
+
+   def _messages(self, thread_id: str, run_id: Optional[str]) -> Any:
+      with self._lock:
+         runs = [run for run in self.runs.values() if run.thread_id == thread_id and run.status == "completed"]
+      data = [SimpleNamespace(run_id=run.id, content=[TextContentBlock(type="text", text=Text(value=run.answer, annotations=[]))])
+              for run in runs if run_id is None or run.id == run_id]
+      return _Page(data)
+
+   # -- endpoints --
+
+   def threads_create(self, **kwargs) -> Any:
+      return SimpleNamespace(id=self._new_thread())
+
+   def create_and_run(self, thread: dict, **kwargs) -> Any:
+      return self._new_run(self._new_thread(), thread.get("messages", []))
+
+   def runs_create(self, thread_id: str, additional_messages: Optional[List[dict]] = None, **kwargs) -> Any:
+      return self._new_run(thread_id, additional_messages or [])
+
+   def runs_cancel(self, run_id: str) -> Any:
+      with self._lock:
+         run = self.runs[run_id]
+         if run.status in ("queued", "in_progress"):
+            run.status = "cancelled"
+            self.active_runs.pop(run.thread_id, None)
+      return run
+
+   def clients(self):
+      '''Sync and async client stand-ins (client.beta.threads...)'''
+      def sync(endpoint, func):
+         def call(*args, **kwargs):
+            time.sleep(self._delay(endpoint))
+            return func(*args, **kwargs)
+         return call
+
+      def asynchronous(endpoint, func):
+         async def call(*args, **kwargs):
+            await asyncio.sleep(self._delay(endpoint))
+            return func(*args, **kwargs)
+         return call
+
+      def threads(wrap):
+         return SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(
+            create=wrap("threads.create", self.threads_create),
+            create_and_run=wrap("threads.create_and_run", self.create_and_run),
+            runs=SimpleNamespace(create=wrap("runs.create", self.runs_create),
+                                 retrieve=wrap("runs.retrieve", lambda run_id, thread_id: self._retrieve(run_id)),
+                                 cancel=wrap("runs.cancel", lambda run_id, thread_id: self.runs_cancel(run_id))),
+            messages=SimpleNamespace(list=wrap("messages.list", lambda thread_id, run_id=None, order="desc": self._messages(thread_id, run_id))))))
+
+      return threads(sync), threads(asynchronous)
+
+class _Page:
+   '''A page of messages (iterable, with .data, like the OpenAI client pages)'''
+
+   def __init__(self, data: list):
+      self.data = data
+
+   def __iter__(self):
+      return iter(self.data)
+
+def percentile(values: List[float], p: float) -> float:
+   values = sorted(values)
+   return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+async def classify_all(agent: Any, posts: int, concurrency: int) -> List[float]:
+   semaphore = asyncio.Semaphore(concurrency)
+
+   async def classify(i: int) -> float:
+      async with semaphore:
+         start_time = time.perf_counter()
+         await agent.ainvoke({"content": f"Job Post Title: benchmark job post {i}"})
+         return time.perf_counter() - start_time
+
+   return await asyncio.gather(*(classify(i) for i in range(posts)))
+
+def benchmark(label: str, agent: Any, api: FakeAssistantsAPI, args) -> None:
+   start_time = time.perf_counter()
+   latencies = asyncio.run(classify_all(agent, args.posts, args.concurrency))
+   elapsed = (time.perf_counter() - start_time) / args.time_scale
+   latencies = [latency / args.time_scale for latency in latencies]
+
+   calls = sum(api.calls.values())
+   print(f"{label:<9} latency p50 {percentile(latencies, 50):6.2f} s, p95 {percentile(latencies, 95):6.2f} s | "
+         f"round trips/post {calls / args.posts:5.2f}, polls/post {api.calls['runs.retrieve'] / args.posts:5.2f} | "
+         f"throughput {args.posts / elapsed:6.2f} posts/s")
+   print(f"{'':<9} calls: " + ", ".join(f"{endpoint} {count}" for endpoint, count in sorted(api.calls.items())))
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Benchmark the per-classification overhead of assistant runs against a simulated Assistants API")
+   parser.add_argument("--posts", type=int, default=200, help="Number of classifications (default: 200)")
+   parser.add_argument("--concurrency", type=int, default=16, help="Concurrent classifications (default: 16)")
+   parser.add_argument("--max-in-flight", type=int, default=16, help="In-flight run cap of the pooled runnable (default: 16)")
+   parser.add_argument("--warm-threads", type=int, default=4, help="Warm threads of the pooled runnable (default: 4)")
+   parser.add_argument("--rtt", type=float, default=0.08, help="Simulated round trip time per API call in seconds (default: 0.08)")
+   parser.add_argument("--thread-create", type=float, default=0.15, help="Simulated extra cost of creating a thread in seconds (default: 0.15)")
+   parser.add_argument("--queue-median", type=float, default=0.4, help="Median simulated queue time in seconds (default: 0.4)")
+   parser.add_argument("--run-median", type=float, default=3.0, help="Median simulated run time in seconds (default: 3.0)")
+   parser.add_argument("--sigma", type=float, default=0.5, help="Log-normal sigma of the queue and run times (default: 0.5)")
+   parser.add_argument("--time-scale", type=float, default=0.1, help="Multiplier for all simulated times and poll intervals (default: 0.1)")
+   return parser.parse_args()
+
+def main(args) -> None:
+   def api() -> FakeAssistantsAPI:
+      return FakeAssistantsAPI(rtt=args.rtt, thread_create=args.thread_create, queue_median=args.queue_median,
+                               run_median=args.run_median, sigma=args.sigma, time_scale=args.time_scale)
+
+   print(f"{args.posts} classifications, concurrency {args.concurrency}, simulated rtt {args.rtt} s, "
+         f"median queue {args.queue_median} s, median run {args.run_median} s")
+
+   baseline_api = api()
+   client, async_client = baseline_api.clients()
+   baseline = TracedAssistantRunnable(assistant_id="asst_benchmark", as_agent=True, client=client, async_client=async_client,
+                                      check_every_ms=1000 * args.time_scale)
+   benchmark("baseline", baseline, baseline_api, args)
+
+   pooled_api = api()
+   client, async_client = pooled_api.clients()
+   scale = args.time_scale
+   poller = AdaptivePoller(min_interval=0.1 * scale, max_interval=1.0 * scale, initial_interval=0.5 * scale)
+   pooled = PooledAssistantRunnable("asst_benchmark", client=client, async_client=async_client, max_in_flight=args.max_in_flight,
+                                    warm_threads=args.warm_threads, poller=poller)
+   pooled.warm()
+   pooled_api.calls.clear()
+   benchmark("pooled", pooled, pooled_api, args)
+   stats = pooled.stats
+   print(f"{'':<9} threads created {stats.threads_created}, reused {stats.threads_reused}, retired {stats.threads_retired}")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
@@ -0,0 +1,145 @@
+'''Benchmark the prompt tokens of hierarchical classification against flat mode
+
+Classifies the same job posts in flat and in hierarchical mode (BatchClassifier) against
+a simulated Assistants API (see assistant_overhead.py) and reports the runs and prompt
+tokens per job post of each stage.  The simulated assistant selects the labeled major
+group of a job post in stage one (with --groups 2 also a second, random major group) and
+answers with the labeled occupation.
+
+Prompt tokens are estimated from the message (4 characters per token) plus the assistant
+instructions that every run pays for.  Flat runs keep the assistant's file_search tool, so
+each flat run also pays for the retrieved chunks: --file-search-tokens, by default 20
+chunks of 800 tokens (the Assistants API defaults of max_num_results for gpt-4o models
+and of the chunk size).  Hierarchical runs override the tools with none.  The break-even
+line is the file_search retrieval at which both modes use the same prompt tokens.
+
+Labeled job posts are JSON Lines records with `title`, `description` and `occupation_code`.
+Without a labeled file, a sample of the O*NET sample job titles is used as title-only job posts.
+
+usage: python -m job_classification_agent.benchmarks.hierarchy [-h] [--labeled LABELED] [--limit LIMIT] [--groups {1,2}] [--file-search-tokens N]
+'''
+
+import argparse
+import asyncio
+import json
+import random
+
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from job_classification_agent.batch import BatchClassifier, JobPost
+from job_classification_agent.benchmarks.assistant_overhead import FakeAssistantsAPI
+from job_classification_agent.benchmarks.shortlist import labeled_posts, sample_title_posts
+from job_classification_agent.chain import TracedAssistantRunnable, build_prompt, parse_output, post_process
+from job_classification_agent.hierarchy import MAJOR_GROUPS, Hierarchy, major_group
+from job_classification_agent.knowledge_base import load_knowledge_base
+
+CHARS_PER_TOKEN = 4
+# the instructions of scripts/create_assistant.py
+INSTRUCTIONS_TOKENS = 180
+# file_search defaults of the Assistants API: max_num_results for gpt-4o models, and tokens per chunk
+FILE_SEARCH_RESULTS, FILE_SEARCH_CHUNK_TOKENS = 20, 800
+
+STAGES = ("flat", "stage one", "stage two")
+
+def stage(content: str) -> str:
+   if "Select the SOC major groups" in content:
+      return "stage one"
+   if "Occupations (code, title, description):" in content:
+      return "stage two"
+   return "flat"
+
+class PromptCountingAPI(FakeAssistantsAPI):
+   '''Simulated Assistants API that counts the runs and estimated prompt tokens of each stage'''
+
+   def __init__(self, file_search_tokens: int, **kwargs):
+      super().__init__(**kwargs)
+      self.file_search_tokens = file_search_tokens
+      self.stage_runs: Counter = Counter()
+      self.message_tokens: Counter = Counter()
+      self.retrieval_tokens: Counter = Counter()
+
+   def create_and_run(self, thread: dict, tools=None, **kwargs):
+      content = thread["messages"][-1]["content"]
+      with self._lock:
+         name = stage(content)
+         self.stage_runs[name] += 1
+         self.message_tokens[name] += len(content) // CHARS_PER_TOKEN + INSTRUCTIONS_TOKENS
+         # runs without a tools override use the assistant's file_search
+         self.retrieval_tokens[name] += self.file_search_tokens if tools is None else 0
+      return super().create_and_run(thread, **kwargs)
+
+def labeled_answer(posts: List[JobPost], groups: int, seed: int = 0):
+   '''Answers of the simulated assistant: the labeled major group (and a random second one), the labeled occupation'''
+   codes = {post.title: post.id for post in posts}
+   rng = random.Random(seed)
+
+   def answer(content: str) -> str:
+      title = content.rsplit("job post title: ", 1)[-1].split("\n", 1)[0]
+      code = codes.get(title, "15-1252.00")
+      if stage(content) == "stage one":
+         selected = [major_group(code)]
+         if groups > 1:
+            selected.append(rng.choice([group for group in MAJOR_GROUPS if group != selected[0]]))
+         return json.dumps({"major_groups": selected})
+      return json.dumps({"job_classifications": [{"occupation_code": code, "occupation_title": "unknown"}], "overall_explanation": "benchmark answer"})
+
+   return answer
+
+def benchmark_mode(label: str, posts: List[JobPost], hierarchical: bool, args) -> Tuple[Dict[str, float], BatchClassifier]:
+   api = PromptCountingAPI(args.file_search_tokens, rtt=0.0, thread_create=0.0, queue_median=0.01, run_median=0.01, sigma=0.0,
+                           answer=labeled_answer(posts, args.groups))
+   client, async_client = api.clients()
+   agent = TracedAssistantRunnable(assistant_id="asst_benchmark", as_agent=True, client=client, async_client=async_client, check_every_ms=5)
+   classifier = BatchClassifier(agent | parse_output | post_process, build_prompt(), concurrency=16,
+                                hierarchy=Hierarchy(agent, load_knowledge_base()) if hierarchical else None)
+
+   async def run():
+      return [r async for r in classifier.stream(posts)]
+
+   asyncio.run(run())
+
+   totals = {}
+   for name in STAGES:
+      runs = api.stage_runs[name]
+      if not runs:
+         continue
+      message, retrieval = api.message_tokens[name] / len(posts), api.retrieval_tokens[name] / len(posts)
+      totals[name] = message + retrieval
+      print(f"{label:<13} {name:<10} {runs / len(posts):>9.2f} {message:>15.0f} {retrieval:>19.0f} {message + retrieval:>14.0f}")
+   total = sum(totals.values())
+   print(f"{label:<13} {'total':<10} {sum(api.stage_runs.values()) / len(posts):>9.2f} {'':>15} {'':>19} {total:>14.0f}")
+   return {"total": total, "retrieval": sum(api.retrieval_tokens.values()) / len(posts), "flat_runs": api.stage_runs["flat"] / len(posts)}, classifier
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Benchmark the prompt tokens of hierarchical classification against flat mode")
+   parser.add_argument("--labeled", type=str, default=None, help="JSON Lines file of labeled job posts (default: O*NET sample titles)")
+   parser.add_argument("--limit", type=int, default=200, help="Maximum number of job posts (default: 200)")
+   parser.add_argument("--groups", type=int, choices=[1, 2], default=1, help="Major groups selected by the simulated stage one (default: 1)")
+   parser.add_argument("--file-search-tokens", type=int, default=FILE_SEARCH_RESULTS * FILE_SEARCH_CHUNK_TOKENS,
+                       help=f"Tokens of retrieved chunks per flat run (default: {FILE_SEARCH_RESULTS * FILE_SEARCH_CHUNK_TOKENS})")
+   return parser.parse_args()
+
+def main(args) -> None:
+   posts = labeled_posts(args.labeled, args.limit) if args.labeled else sample_title_posts(args.limit)
+   load_knowledge_base()
+   print(f"{len(posts)} labeled job posts, {args.groups} major group(s) per job post, {args.file_search_tokens} file_search tokens per flat run")
+
+   print(f"{'mode':<13} {'stage':<10} {'runs/post':>9} {'message/post':>15} {'file_search/post':>19} {'prompt/post':>14}")
+   flat, _ = benchmark_mode("flat", posts, False, args)
+   hierarchical, classifier = benchmark_mode("hierarchical", posts, True, args)
+
+   # both modes use the same prompt tokens when a flat run retrieves this many tokens
+   flat_message = flat["total"] - flat["retrieval"]
+   break_even = (hierarchical["total"] - hierarchical["retrieval"] - flat_message) / max(flat["flat_runs"] - hierarchical["flat_runs"], 1e-9)
+   print(f"prompt tokens per job post: hierarchical / flat {hierarchical['total'] / flat['total']:.2f}, "
+         f"break-even at {break_even:.0f} file_search tokens per flat run")
+
+   hierarchy = classifier.hierarchy
+   pair = max(((a, b) for a in MAJOR_GROUPS for b in MAJOR_GROUPS if a < b), key=lambda pair: len(hierarchy.knowledge_slice(pair)))
+   tokens = len(hierarchy.subtree_input(list(pair), "", "")["content"]) // CHARS_PER_TOKEN
+   print(f"largest two-group knowledge slice: {'+'.join(pair)}, {tokens} tokens in the stage two prompt of a title-only job post")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
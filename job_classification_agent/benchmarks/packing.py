@@ -0,0 +1,73 @@
+'''Benchmark multi-post packing against single-post runs
+
+Classifies the same job posts with single-post runs and with packed runs of each of
+the given pack sizes, and reports per mode the throughput, the token usage per job
+post (from the traced run usage), the number of assistant runs, the job posts that
+fell back to single-post runs and, for labeled job posts, the accuracy (a job post is
+correct when its labeled occupation is among the classifications).
+
+Labeled job posts are JSON Lines records with `title`, `description` and `occupation_code`.
+Without a labeled file, a sample of the O*NET sample job titles is used as title-only job posts.
+
+usage: python -m job_classification_agent.benchmarks.packing [-h] [--labeled LABELED] [--limit LIMIT] [--pack-sizes PACK_SIZES] [--concurrency CONCURRENCY] [--assistant-id ASSISTANT_ID]
+'''
+
+import argparse
+import asyncio
+import os
+
+from typing import List
+
+from langchain_core.runnables import Runnable
+
+from job_classification_agent.batch import BatchClassifier, JobPost
+from job_classification_agent.chain import build_chain, build_prompt, parse_output, post_process
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.packing import build_packed_chain
+from job_classification_agent.tracing import configure_tracing
+from job_classification_agent.benchmarks.shortlist import labeled_posts, sample_title_posts
+
+def benchmark_pack_sizes(agent: Runnable, posts: List[JobPost], pack_sizes: List[int], concurrency: int) -> None:
+   metrics = configure_tracing()
+   chain = agent | parse_output | post_process
+   packed_chain = build_packed_chain(agent)
+
+   print(f"{'mode':<12} {'posts/s':>8} {'runs':>6} {'tokens/post':>12} {'prompt/post':>12} {'fallbacks':>10} {'errors':>7} {'accuracy':>9}")
+   for pack_size in pack_sizes:
+      metrics.tokens.clear()
+      classifier = BatchClassifier(chain, build_prompt(), concurrency=concurrency, pack_size=pack_size,
+                                   packed_chain=packed_chain if pack_size > 1 else None)
+
+      async def run():
+         return [r async for r in classifier.stream(posts)]
+
+      results = asyncio.run(run())
+      stats = classifier.stats
+      runs = stats.packs + sum(r.source == "assistant" for r in results)
+      correct = sum(any(c.occupation_code == r.post_id for c in r.result.job_classifications) for r in results if r.ok)
+      label = "single" if pack_size == 1 else f"pack of {pack_size}"
+      print(f"{label:<12} {stats.throughput:>8.2f} {runs:>6} {metrics.tokens['total_tokens'] / len(posts):>12.0f} "
+            f"{metrics.tokens['prompt_tokens'] / len(posts):>12.0f} {stats.pack_fallbacks:>10} {stats.failed:>7} {correct / len(posts):>9.3f}")
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Benchmark multi-post packing against single-post runs")
+   parser.add_argument("--labeled", type=str, default=None, help="JSON Lines file of labeled job posts (default: O*NET sample titles)")
+   parser.add_argument("--limit", type=int, default=100, help="Maximum number of job posts (default: 100)")
+   parser.add_argument("--pack-sizes", type=str, default="1,5,10", help="Comma separated pack sizes to compare, 1 is single-post mode (default: 1,5,10)")
+   parser.add_argument("--concurrency", type=int, default=8, help="Concurrent assistant runs (default: 8)")
+   parser.add_argument("--assistant-id", type=str, default=os.environ.get("ASSISTANT_ID"), help="Assistant ID (default: ASSISTANT_ID environment variable)")
+   return parser.parse_args()
+
+def main(args) -> None:
+   assert(args.assistant_id is not None), "ASSISTANT_ID environment variable is not set.  Please run create_assistant.py to create an assistant."
+
+   posts = labeled_posts(args.labeled, args.limit) if args.labeled else sample_title_posts(args.limit)
+   print(f"{len(posts)} labeled job posts")
+
+   load_knowledge_base()
+   agent, _ = build_chain(args.assistant_id)
+   benchmark_pack_sizes(agent, posts, [int(size) for size in args.pack_sizes.split(",")], args.concurrency)
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
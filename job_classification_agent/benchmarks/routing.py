@@ -0,0 +1,138 @@
+'''Benchmark assistant tier routing and hedged runs against a simulated Assistants API
+
+Classifies benchmark job posts with AssistantRouter against one simulated Assistants API
+per tier (see assistant_overhead.py): a fast tier (gpt-4o-mini) and a strong tier (gpt-4o)
+with log-normal run durations and a fraction of very slow runs.  The fast tier returns
+invalid answers, unknown occupations and wrong (but valid) occupations for a share of the
+job posts; the strong tier always answers correctly.  It compares:
+
+- strong: the strong tier only
+- fast: the fast tier only
+- routed: the fast tier, escalating to the strong tier
+- routed+hedge: routed, with hedged runs at the p95 latency budget of each tier
+
+and reports accuracy, latency percentiles, runs per job post and the cost per 1,000 job
+posts.  All simulated durations and poll intervals are multiplied by --time-scale to
+shorten the benchmark; reported times are scaled back.
+
+usage: python -m job_classification_agent.benchmarks.routing [-h] [--posts POSTS] [--concurrency CONCURRENCY] [--slow-fraction SLOW_FRACTION] ...
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+from typing import Callable, Dict, List, Tuple
+
+from job_classification_agent.benchmarks.assistant_overhead import FakeAssistantsAPI, percentile
+from job_classification_agent.chain import TracedAssistantRunnable
+from job_classification_agent.evaluation import model_price
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.router import AssistantRouter, AssistantTier
+
+CORRECT = {"occupation_code": "15-1252.00", "occupation_title": "Software Developers"}
+WRONG = {"occupation_code": "15-1251.00", "occupation_title": "Computer Programmers"}
+UNKNOWN = {"occupation_code": "99-9999.00", "occupation_title": "Imaginary Occupation"}
+
+# simulated usage of every run (see FakeAssistantsAPI)
+PROMPT_TOKENS, COMPLETION_TOKENS = 1500, 80
+
+def post_number(content: str) -> int:
+   return int(re.search(r"benchmark job post (\d+)", content).group(1))
+
+def fast_answer(invalid_rate: float, wrong_rate: float) -> Callable[[str], str]:
+   '''Answers of the fast tier: invalid, unknown occupation or wrong for a fixed share of the job posts'''
+   def answer(content: str) -> str:
+      draw = random.Random(post_number(content)).random()
+      if draw < invalid_rate / 2:
+         return "Sorry, I could not find an occupation for this job post."
+      if draw < invalid_rate:
+         classification = UNKNOWN
+      elif draw < invalid_rate + wrong_rate:
+         classification = WRONG
+      else:
+         classification = CORRECT
+      return json.dumps({"job_classifications": [classification], "overall_explanation": "fast tier"})
+   return answer
+
+def strong_answer(content: str) -> str:
+   return json.dumps({"job_classifications": [CORRECT], "overall_explanation": "strong tier"})
+
+async def classify_all(router: AssistantRouter, posts: int, concurrency: int) -> Tuple[List[float], int]:
+   semaphore = asyncio.Semaphore(concurrency)
+
+   async def classify(i: int) -> Tuple[float, bool]:
+      async with semaphore:
+         start_time = time.perf_counter()
+         try:
+            result = await router.ainvoke({"content": f"Job Post Title: benchmark job post {i}"})
+            correct = bool(result.job_classifications) and result.job_classifications[0].occupation_code == CORRECT["occupation_code"]
+         except ValueError:
+            correct = False
+         return time.perf_counter() - start_time, correct
+
+   results = await asyncio.gather(*(classify(i) for i in range(posts)))
+   return [latency for latency, _ in results], sum(correct for _, correct in results)
+
+def benchmark(label: str, tier_names: List[str], hedge: bool, args) -> None:
+   apis: Dict[str, FakeAssistantsAPI] = {}
+   tiers, agents = [], []
+   for name in tier_names:
+      model, run_median, answer = {"fast": ("gpt-4o-mini", args.fast_run_median, fast_answer(args.invalid_rate, args.wrong_rate)),
+                                   "strong": ("gpt-4o", args.strong_run_median, strong_answer)}[name]
+      api = FakeAssistantsAPI(rtt=args.rtt, run_median=run_median, sigma=args.sigma, time_scale=args.time_scale,
+                              slow_fraction=args.slow_fraction, slow_factor=args.slow_factor, model=model, answer=answer,
+                              seed=args.seed)
+      client, async_client = api.clients()
+      apis[name] = api
+      tiers.append(AssistantTier(name=name, assistant_id=f"asst_{name}", model=model))
+      agents.append(TracedAssistantRunnable(assistant_id=f"asst_{name}", as_agent=True, client=client, async_client=async_client,
+                                            check_every_ms=1000 * args.poll_interval * args.time_scale))
+   router = AssistantRouter(tiers, agents, hedge=hedge, hedge_percentile=args.hedge_percentile)
+
+   latencies, correct = asyncio.run(classify_all(router, args.posts, args.concurrency))
+   latencies = [latency / args.time_scale for latency in latencies]
+
+   runs = {name: api.calls["threads.create_and_run"] for name, api in apis.items()}
+   cost = 0.0
+   for tier in tiers:
+      prompt_price, completion_price = model_price(tier.model)
+      cost += runs[tier.name] * (PROMPT_TOKENS * prompt_price + COMPLETION_TOKENS * completion_price) / 1e6
+   print(f"{label:<13} accuracy {correct / args.posts:6.1%} | latency p50 {percentile(latencies, 50):6.2f} s, p95 {percentile(latencies, 95):6.2f} s, "
+         f"p99 {percentile(latencies, 99):6.2f} s, max {max(latencies):6.2f} s | "
+         f"runs/post {sum(runs.values()) / args.posts:4.2f} | cost/1k posts ${1000 * cost / args.posts:5.2f}")
+   print(f"{'':<13} runs: " + ", ".join(f"{name} {count}" for name, count in runs.items()) + f" | {router.stats.format_summary()}")
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Benchmark assistant tier routing and hedged runs against a simulated Assistants API")
+   parser.add_argument("--posts", type=int, default=300, help="Number of classifications (default: 300)")
+   parser.add_argument("--concurrency", type=int, default=16, help="Concurrent classifications (default: 16)")
+   parser.add_argument("--rtt", type=float, default=0.08, help="Simulated round trip time per API call in seconds (default: 0.08)")
+   parser.add_argument("--fast-run-median", type=float, default=2.0, help="Median simulated run time of the fast tier in seconds (default: 2.0)")
+   parser.add_argument("--strong-run-median", type=float, default=4.0, help="Median simulated run time of the strong tier in seconds (default: 4.0)")
+   parser.add_argument("--sigma", type=float, default=0.3, help="Log-normal sigma of the queue and run times (default: 0.3)")
+   parser.add_argument("--slow-fraction", type=float, default=0.03, help="Fraction of very slow runs (default: 0.03)")
+   parser.add_argument("--slow-factor", type=float, default=8.0, help="How many times longer very slow runs take (default: 8.0)")
+   parser.add_argument("--invalid-rate", type=float, default=0.1, help="Share of the fast tier's answers that are invalid or unknown occupations (default: 0.1)")
+   parser.add_argument("--wrong-rate", type=float, default=0.05, help="Share of the fast tier's answers that are valid but wrong (default: 0.05)")
+   parser.add_argument("--hedge-percentile", type=float, default=95, help="Latency percentile of a tier after which a run is hedged (default: 95)")
+   parser.add_argument("--poll-interval", type=float, default=0.25, help="Simulated poll interval in seconds (default: 0.25)")
+   parser.add_argument("--time-scale", type=float, default=0.05, help="Multiplier for all simulated times and poll intervals (default: 0.05)")
+   parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated run durations (default: 0)")
+   return parser.parse_args()
+
+def main(args) -> None:
+   load_knowledge_base()
+   print(f"{args.posts} classifications, concurrency {args.concurrency}, median run fast {args.fast_run_median} s / strong {args.strong_run_median} s, "
+         f"{args.slow_fraction:.0%} of runs {args.slow_factor:g}x slower")
+   benchmark("strong", ["strong"], False, args)
+   benchmark("fast", ["fast"], False, args)
+   benchmark("routed", ["fast", "strong"], False, args)
+   benchmark("routed+hedge", ["fast", "strong"], True, args)
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
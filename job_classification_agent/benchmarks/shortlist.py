@@ -0,0 +1,102 @@
+'''Benchmark the local candidate shortlist
+
+Measures the retrieval latency and recall@K of the local search index on a set of
+labeled job posts.  With --assistant-id the labeled job posts are also classified by
+the assistant with and without the shortlist in the prompt, comparing latency and
+accuracy (a job post is correct when its labeled occupation is among the classifications).
+
+Labeled job posts are JSON Lines records with `title`, `description` and `occupation_code`.
+Without a labeled file, a sample of the O*NET sample job titles is used as title-only
+job posts (a retrieval sanity check: the sample titles are also part of the index).
+
+usage: python -m job_classification_agent.benchmarks.shortlist [-h] [--labeled LABELED] [--limit LIMIT] [--top-k TOP_K] [--assistant-id ASSISTANT_ID]
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from typing import List
+
+from job_classification_agent.batch import BatchClassifier, JobPost
+from job_classification_agent.chain import build_chain, build_prompt
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.retrieval import load_retriever
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, read_jsonl
+
+def sample_title_posts(limit: int, seed: int = 0) -> List[JobPost]:
+   records = list(read_jsonl(os.path.join(PROCESSED_DATA_DIR, "occupation_sample_titles.json")))
+   random.Random(seed).shuffle(records)
+   return [JobPost(id=r["occupation_code"], title=r["sample_job_title"], description="") for r in records[:limit]]
+
+def labeled_posts(path: str, limit: int) -> List[JobPost]:
+   # the labeled occupation code is carried in the job post id
+   records = list(read_jsonl(path))[:limit]
+   return [JobPost(id=r["occupation_code"], title=r.get("title", ""), description=r.get("description", "")) for r in records]
+
+def percentile(values: List[float], p: float) -> float:
+   values = sorted(values)
+   return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+def benchmark_retrieval(posts: List[JobPost], top_k: int) -> None:
+   start_time = time.perf_counter()
+   retriever = load_retriever()
+   print(f"index load: {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+   latencies = []
+   hits = {k: 0 for k in (1, 5, top_k)}
+   for post in posts:
+      start_time = time.perf_counter()
+      candidates = retriever.shortlist(post.title, post.description, top_k)
+      latencies.append((time.perf_counter() - start_time) * 1000)
+
+      codes = [c.occupation_code for c in candidates]
+      for k in hits:
+         hits[k] += post.id in codes[:k]
+
+   print(f"retrieval latency: mean {statistics.mean(latencies):.2f} ms, p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms")
+   for k, n in sorted(hits.items()):
+      print(f"recall@{k}: {n / len(posts):.3f}")
+
+def benchmark_assistant(posts: List[JobPost], top_k: int, assistant_id: str, concurrency: int) -> None:
+   load_knowledge_base()
+   _, chain = build_chain(assistant_id)
+   prompt = build_prompt()
+
+   for label, retriever in (("without shortlist", None), (f"with top-{top_k} shortlist", load_retriever())):
+      classifier = BatchClassifier(chain, prompt, concurrency=concurrency, retriever=retriever, shortlist_size=top_k)
+
+      async def run():
+         return [r async for r in classifier.stream(posts)]
+
+      results = asyncio.run(run())
+      latencies = [r.elapsed for r in results if r.ok]
+      correct = sum(any(c.occupation_code == r.post_id for c in r.result.job_classifications) for r in results if r.ok)
+      print(f"assistant {label}: accuracy {correct / len(posts):.3f}, errors {sum(not r.ok for r in results)}, "
+            f"latency p50 {percentile(latencies, 50):.2f} s, p95 {percentile(latencies, 95):.2f} s, "
+            f"throughput {classifier.stats.throughput:.2f} posts/s")
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Benchmark the local candidate shortlist")
+   parser.add_argument("--labeled", type=str, default=None, help="JSON Lines file of labeled job posts (default: O*NET sample titles)")
+   parser.add_argument("--limit", type=int, default=1000, help="Maximum number of job posts (default: 1000)")
+   parser.add_argument("--top-k", type=int, default=10, help="Shortlist size (default: 10)")
+   parser.add_argument("--assistant-id", type=str, default=None, help="Also compare assistant classifications with and without the shortlist")
+   parser.add_argument("--concurrency", type=int, default=8, help="Concurrent assistant runs (default: 8)")
+   return parser.parse_args()
+
+def main(args) -> None:
+   posts = labeled_posts(args.labeled, args.limit) if args.labeled else sample_title_posts(args.limit)
+   print(f"{len(posts)} labeled job posts")
+
+   benchmark_retrieval(posts, args.top_k)
+
+   if args.assistant_id:
+      benchmark_assistant(posts, args.top_k, args.assistant_id, args.concurrency)
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
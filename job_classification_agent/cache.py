@@ -0,0 +1,163 @@
+'''Persistent cache of validated classifications
+
+Classifications are stored in a local SQLite database under a content hash of the
+normalized job post and everything else that shapes the assistant's answer (hints,
+include_explanation, prompt template, candidate shortlist and assistant id), so
+re-posted and duplicated job posts are classified once.  Entries expire after a TTL
+and the least recently used entries are evicted when the cache grows past max_entries.
+Classifications repaired by post-processing are stored and returned with their repair
+confidence and the assistant's original answer.
+'''
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Optional
+
+from job_classification_agent.models import JobClassification, JobClassifications, RepairedJobClassification
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR
+
+CACHE_PATH = os.path.join(os.path.dirname(PROCESSED_DATA_DIR), "cache", "classifications.db")
+
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 100_000
+
+# writes between recounts of the entries, which other processes (the app and batch runs) may add to the database
+RECOUNT_EVERY = 1000
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _normalize(text: Optional[str]) -> str:
+   return _WHITESPACE.sub(" ", text).strip().casefold() if text else ""
+
+def cache_key(job_post_title: str, job_post_description: str, hints: Optional[str], include_explanation: bool,
+              prompt_template: str, assistant_id: str, candidate_occupations: Optional[str] = None) -> str:
+   '''Content hash of a classification request'''
+   parts = [_normalize(job_post_title), _normalize(job_post_description), hints or "", bool(include_explanation),
+            prompt_template, assistant_id, candidate_occupations or ""]
+   return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def _parse(value: str) -> JobClassifications:
+   # JobClassifications.parse_raw would turn repaired classifications into plain ones
+   obj = json.loads(value)
+   classifications = [(RepairedJobClassification if "repair_confidence" in item else JobClassification).parse_obj(item)
+                      for item in obj["job_classifications"]]
+   return JobClassifications(job_classifications=classifications, overall_explanation=obj.get("overall_explanation"))
+
+@dataclass
+class CacheStats:
+   hits: int = 0
+   misses: int = 0
+   expired: int = 0
+   evictions: int = 0
+
+   @property
+   def hit_rate(self) -> float:
+      lookups = self.hits + self.misses
+      return self.hits / lookups if lookups else 0.0
+
+class ClassificationCache:
+   '''SQLite backed cache of JobClassifications with TTL and LRU eviction
+
+   A single connection is shared by all threads (Streamlit runs sessions in threads)
+   and guarded by a lock.  The number of entries is tracked in memory and recounted
+   before evicting and every RECOUNT_EVERY writes.
+   '''
+
+   def __init__(self, path: str = CACHE_PATH, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+      self.path = path
+      self.ttl = ttl
+      self.max_entries = max_entries
+      self.stats = CacheStats()
+      self._lock = threading.Lock()
+
+      if path != ":memory:":
+         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+      self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+      self._db.execute("PRAGMA journal_mode=WAL")
+      self._db.execute("""CREATE TABLE IF NOT EXISTS classifications (
+         key TEXT PRIMARY KEY,
+         value TEXT NOT NULL,
+         created_at REAL NOT NULL,
+         accessed_at REAL NOT NULL)""")
+      self._db.execute("CREATE INDEX IF NOT EXISTS classifications_accessed_at ON classifications (accessed_at)")
+      self._size = self._count()
+      self._writes = 0
+
+   def __len__(self) -> int:
+      with self._lock:
+         return self._count()
+
+   def _count(self) -> int:
+      return self._db.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+
+   def get(self, key: str) -> Optional[JobClassifications]:
+      '''Get a cached classification, or None if it is missing or expired'''
+      now = time.time()
+      with self._lock:
+         row = self._db.execute("SELECT value, created_at FROM classifications WHERE key = ?", (key,)).fetchone()
+
+         if row is not None and now - row[1] > self.ttl:
+            self._size -= self._db.execute("DELETE FROM classifications WHERE key = ?", (key,)).rowcount
+            self.stats.expired += 1
+            row = None
+
+         if row is None:
+            self.stats.misses += 1
+            return None
+
+         self._db.execute("UPDATE classifications SET accessed_at = ? WHERE key = ?", (now, key))
+         self.stats.hits += 1
+
+      return _parse(row[0])
+
+   def put(self, key: str, value: JobClassifications) -> None:
+      now = time.time()
+      with self._lock:
+         exists = self._db.execute("SELECT 1 FROM classifications WHERE key = ?", (key,)).fetchone() is not None
+         self._db.execute("INSERT OR REPLACE INTO classifications (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                          (key, value.json(), now, now))
+         self._size += not exists
+         self._writes += 1
+         if self._writes % RECOUNT_EVERY == 0:
+            self._size = self._count()
+         if self._size > self.max_entries:
+            self._evict(now)
+
+   def _evict(self, now: float) -> None:
+      # other processes may have added or evicted entries since the last count
+      self._size = self._count()
+      if self._size <= self.max_entries:
+         return
+      # drop expired entries first, then the least recently used down to 90% of max_entries
+      removed = self._db.execute("DELETE FROM classifications WHERE created_at < ?", (now - self.ttl,)).rowcount
+      excess = self._size - removed - int(self.max_entries * 0.9)
+      if excess > 0:
+         removed += self._db.execute("""DELETE FROM classifications WHERE key IN
+            (SELECT key FROM classifications ORDER BY accessed_at LIMIT ?)""", (excess,)).rowcount
+      self._size -= removed
+      self.stats.evictions += removed
+
+   def clear(self) -> None:
+      with self._lock:
+         self._db.execute("DELETE FROM classifications")
+         self._size = 0
+
+   def close(self) -> None:
+      self._db.close()
+
+# the cache is opened once per process and shared by all app sessions
+_cache: Optional[ClassificationCache] = None
+
+def load_cache(path: str = CACHE_PATH) -> ClassificationCache:
+   global _cache
+   if _cache is None:
+      _cache = ClassificationCache(path)
+   return _cache
@@ -0,0 +1,312 @@
+'''Prompt, output parsing and post-processing for the Job Classification Assistant chain'''
+
+import asyncio
+import contextvars
+import functools
+import time
+
+from typing import Any, List, Optional, Tuple
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+from langchain_community.agents.openai_assistant import OpenAIAssistantV2Runnable
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import ValidationError
+from langchain_core.runnables import Runnable
+from langchain.output_parsers import PydanticOutputParser
+
+from job_classification_agent.models import JobClassification, JobClassifications, RepairedJobClassification
+from job_classification_agent.prompts import DEFAULT_PROMPT_TEMPLATE
+from job_classification_agent.knowledge_base import get_occupation_by_code, get_occupation_by_title, repair_occupation, validate_occupation_code
+from job_classification_agent.json_stream import loads_tolerant
+from job_classification_agent.tracing import Span, current_span, tracer
+
+parser = PydanticOutputParser(pydantic_object=JobClassifications)
+
+@functools.lru_cache(maxsize=None)
+def format_instructions() -> str:
+   '''The parser's format instructions (the JSON schema is rendered once per process)'''
+   return parser.get_format_instructions()
+
+def build_prompt(prompt_template: str = DEFAULT_PROMPT_TEMPLATE, include_explanation: bool = True, hints: Optional[str] = None) -> ChatPromptTemplate:
+   '''Build the classification prompt with the format instructions filled in'''
+   return ChatPromptTemplate.from_template(
+      prompt_template, 
+      partial_variables={
+         "format_instructions": format_instructions(),
+         "include_explanation": include_explanation,
+         "hints": hints,
+         "candidate_occupations": "N/A"
+      })
+
+@functools.lru_cache(maxsize=64)
+def load_prompt(prompt_template: str = DEFAULT_PROMPT_TEMPLATE, include_explanation: bool = True, hints: Optional[str] = None) -> ChatPromptTemplate:
+   '''build_prompt, memoized per process (prompts are not modified after they are built, so app reruns and sessions share them)'''
+   return build_prompt(prompt_template, include_explanation=include_explanation, hints=hints)
+
+def get_prompt_template(prompt: ChatPromptTemplate) -> str:
+   '''Get the template text of a prompt created by build_prompt'''
+   return prompt.messages[0].prompt.template
+
+@tracer.traced("format_prompt")
+def build_input(prompt: ChatPromptTemplate, job_post_title: str, job_post_description: str, include_explanation: bool = True, hints: Optional[str] = None,
+                candidate_occupations: Optional[str] = None) -> dict:
+   '''Build the assistant input for a single job post'''
+   template_args = { 
+      "job_post_title": job_post_title, 
+      "job_post_description": job_post_description, 
+      "include_explanation": include_explanation, 
+      "hints": hints if hints else "N/A",
+      "candidate_occupations": candidate_occupations if candidate_occupations else "N/A"
+   }
+
+   return {"content": prompt.format(**template_args)}
+
+# classifications kept from an answer, streamed or not
+MAX_CLASSIFICATIONS = JobClassifications.__fields__["job_classifications"].field_info.max_items
+
+def to_job_classification(obj: Any) -> Optional[JobClassification]:
+   '''Validate one classification object of the assistant answer (None if it is invalid)'''
+   try:
+      return JobClassification.parse_obj(obj)
+   except ValidationError:
+      return None
+
+def to_job_classifications(obj: Any) -> JobClassifications:
+   '''Validate the assistant answer, dropping invalid classifications instead of rejecting the whole answer'''
+   if not isinstance(obj, dict):
+      raise ValueError(f"Expected a JSON object from the assistant, got {type(obj).__name__}")
+
+   items: List[Any] = obj.get("job_classifications") or []
+   classifications = [c for c in (to_job_classification(item) for item in items) if c is not None]
+
+   overall_explanation = obj.get("overall_explanation")
+   if overall_explanation is not None:
+      overall_explanation = str(overall_explanation)[:JobClassifications.__fields__["overall_explanation"].field_info.max_length]
+
+   span = current_span()
+   if span is not None and len(classifications) < len(items):
+      span.set(dropped_classifications=len(items) - len(classifications))
+
+   return JobClassifications(job_classifications=classifications[:MAX_CLASSIFICATIONS], overall_explanation=overall_explanation)
+
+@tracer.traced()
+def parse_output(output: OpenAIAssistantFinish) -> JobClassifications:
+   '''Parse the output from the assistant into a JobClassifications object
+
+   Code fences, surrounding prose, truncated output and trailing commas are repaired
+   and invalid classifications are dropped, so a slightly malformed answer does not
+   need a new run.
+   '''
+   output_text = output.return_values.get('output')
+   return to_job_classifications(loads_tolerant(output_text))
+
+# repair confidence of an exact title match, and of an exact code match (the assistant's title is not the code's occupation title)
+EXACT_TITLE_CONFIDENCE = 1.0
+EXACT_CODE_CONFIDENCE = 0.9
+
+def repaired_classification(input: JobClassification, occ: dict, confidence: float) -> RepairedJobClassification:
+   return RepairedJobClassification(occupation_code=occ['occupation_code'],
+                                    occupation_title=occ['occupation_title'],
+                                    explanation=input.explanation,
+                                    repair_confidence=confidence,
+                                    repaired_from=f"{input.occupation_code} {input.occupation_title}")
+
+def post_process_classification(input: JobClassification) -> Optional[JobClassification]:
+
+   # if the occupation code and title are valid & match, return the classification unchanged
+   if validate_occupation_code(input.occupation_code, input.occupation_title):
+      return input
+
+   # if the occupation name exists in KB, return occupation with that name
+   occ = get_occupation_by_title(input.occupation_title)
+   if occ:
+      return repaired_classification(input, occ, EXACT_TITLE_CONFIDENCE)
+
+   # else, check if the occupation code exists in KB, return occupation with that code
+   occ = get_occupation_by_code(input.occupation_code)
+   if occ:
+      return repaired_classification(input, occ, EXACT_CODE_CONFIDENCE)
+
+   # else, resolve a near-miss title or a malformed code to the most likely occupation
+   occ = repair_occupation(input.occupation_code, input.occupation_title)
+   if occ:
+      return repaired_classification(input, occ, occ['confidence'])
+
+   # else, do not include the occupation
+   return None
+
+@tracer.traced()
+def post_process(input: JobClassifications) -> JobClassifications:
+   "post-process the job classifications to fix occupation title and code mismatches"
+   output, _ = match_classifications(input)
+   return output
+
+def match_classifications(input: JobClassifications) -> Tuple[JobClassifications, int]:
+   '''post_process, also returning the number of unmatched classifications
+
+   Unmatched classifications are dropped because no occupation matched them, unlike the
+   duplicates that are merged when repairs resolve two classifications to the same occupation.
+   '''
+   _classifications = [post_process_classification(c) for c in input.job_classifications]
+   unmatched = sum(c is None for c in _classifications)
+
+   span = current_span()
+   if span is not None:
+      # repaired: title or code replaced from the knowledge base, unmatched: dropped (no repair reached the minimum confidence)
+      span.set(classifications=len(_classifications),
+               repaired=sum(c is not None and c is not i for c, i in zip(_classifications, input.job_classifications)),
+               unmatched=unmatched)
+
+   # repairs can resolve two classifications to the same occupation, keep the first
+   unique = {}
+   for c in _classifications:
+      if c is not None:
+         unique.setdefault(c.occupation_code, c)
+   _classifications = list(unique.values())
+
+   output = JobClassifications(job_classifications=_classifications, 
+                               overall_explanation=input.overall_explanation)
+
+   return output, unmatched
+
+class RunStatusTimer:
+   '''Split the wall time of a run into its statuses (queued, in_progress) as observed by polling'''
+
+   def __init__(self):
+      self.status = "queued"
+      self.since = time.time()
+      self.polls = 0
+
+   def observe(self, run: Any) -> None:
+      self.polls += 1
+      if run.status != self.status:
+         now = time.time()
+         tracer.record(f"assistant.run.{self.status}", self.since, now - self.since)
+         self.status, self.since = run.status, now
+
+   def finish(self, span: Optional[Span], run: Any) -> None:
+      if span is None:
+         return
+      span.set(run_id=run.id, thread_id=run.thread_id, status=run.status, polls=self.polls)
+      usage = getattr(run, "usage", None)
+      if usage is not None:
+         span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, total_tokens=usage.total_tokens)
+
+# runs started from the current context, collected by hedged requests to cancel the run they abandon (see router.py)
+_started_runs: contextvars.ContextVar[Optional[List[Any]]] = contextvars.ContextVar("started_runs", default=None)
+
+def collect_started_runs(runs: List[Any]) -> contextvars.Token:
+   '''Append the runs that the assistant runnables start from the current context (a task or a copied context) to runs
+
+   Returns the token for reset_started_runs, which stops collecting.
+   '''
+   return _started_runs.set(runs)
+
+def reset_started_runs(token: contextvars.Token) -> None:
+   _started_runs.reset(token)
+
+def started_run(run: Any) -> Any:
+   runs = _started_runs.get()
+   if runs is not None:
+      runs.append(run)
+   return run
+
+def record_run_steps(steps: Any) -> None:
+   '''Record the file_search and message_creation (generation) steps of a run
+
+   Run step timestamps have a resolution of one second.
+   '''
+   for step in steps:
+      if step.completed_at is None:
+         continue
+      if step.type == "tool_calls":
+         kind = "+".join(sorted({tool_call.type for tool_call in step.step_details.tool_calls})) or "tool_calls"
+      else:
+         kind = step.type
+      attributes = {"step_id": step.id}
+      if getattr(step, "usage", None) is not None:
+         attributes.update(step_prompt_tokens=step.usage.prompt_tokens, step_completion_tokens=step.usage.completion_tokens)
+      tracer.record(f"assistant.step.{kind}", step.created_at, step.completed_at - step.created_at, **attributes)
+
+class TracedAssistantRunnable(OpenAIAssistantV2Runnable):
+   '''OpenAIAssistantV2Runnable that reports its stages to the tracer
+
+   Thread creation, the queued and in_progress time of the run, fetching the messages
+   and the token usage of the run are traced.  With trace_run_steps the run steps are
+   also fetched (one more API call per run) to split the run into file_search and
+   generation time.
+   '''
+
+   trace_run_steps: bool = False
+
+   def _create_thread_and_run(self, input: dict, thread: dict) -> Any:
+      with tracer.span("assistant.create_thread_and_run"):
+         return started_run(super()._create_thread_and_run(input, thread))
+
+   async def _acreate_thread_and_run(self, input: dict, thread: dict) -> Any:
+      with tracer.span("assistant.create_thread_and_run"):
+         return started_run(await super()._acreate_thread_and_run(input, thread))
+
+   def _create_run(self, input: dict) -> Any:
+      with tracer.span("assistant.create_run"):
+         return started_run(super()._create_run(input))
+
+   async def _acreate_run(self, input: dict) -> Any:
+      with tracer.span("assistant.create_run"):
+         return started_run(await super()._acreate_run(input))
+
+   def _wait_for_run(self, run_id: str, thread_id: str) -> Any:
+      if not tracer.enabled:
+         return super()._wait_for_run(run_id, thread_id)
+
+      with tracer.span("assistant.run") as span:
+         timer = RunStatusTimer()
+         while True:
+            run = self.client.beta.threads.runs.retrieve(run_id, thread_id=thread_id)
+            timer.observe(run)
+            if run.status not in ("in_progress", "queued"):
+               break
+            time.sleep(self.check_every_ms / 1000)
+         timer.finish(span, run)
+
+         if self.trace_run_steps:
+            record_run_steps(self.client.beta.threads.runs.steps.list(run_id, thread_id=thread_id).data)
+
+      return run
+
+   async def _await_for_run(self, run_id: str, thread_id: str) -> Any:
+      if not tracer.enabled:
+         return await super()._await_for_run(run_id, thread_id)
+
+      with tracer.span("assistant.run") as span:
+         timer = RunStatusTimer()
+         while True:
+            run = await self.async_client.beta.threads.runs.retrieve(run_id, thread_id=thread_id)
+            timer.observe(run)
+            if run.status not in ("in_progress", "queued"):
+               break
+            await asyncio.sleep(self.check_every_ms / 1000)
+         timer.finish(span, run)
+
+         if self.trace_run_steps:
+            record_run_steps((await self.async_client.beta.threads.runs.steps.list(run_id, thread_id=thread_id)).data)
+
+      return run
+
+   def _get_response(self, run: Any) -> Any:
+      with tracer.span("assistant.get_messages"):
+         return super()._get_response(run)
+
+def build_chain(assistant_id: str, **kwargs) -> Tuple[OpenAIAssistantV2Runnable, Runnable]:
+   '''Create the assistant runnable and the classification chain (assistant | parse_output | post_process)'''
+   agent = TracedAssistantRunnable(assistant_id=assistant_id, as_agent=True, **kwargs)
+   return agent, (agent | parse_output | post_process)
+
+# the assistant runnable keeps no state between runs, so the app shares one (and its OpenAI clients) across sessions
+_chain: Optional[Tuple[OpenAIAssistantV2Runnable, Runnable]] = None
+
+def load_chain(assistant_id: str) -> Tuple[OpenAIAssistantV2Runnable, Runnable]:
+   global _chain
+   if _chain is None or _chain[0].assistant_id != assistant_id:
+      _chain = build_chain(assistant_id)
+   return _chain
@@ -0,0 +1,166 @@
+'''Near-duplicate job post detection with MinHash and locality sensitive hashing
+
+Job posts are reduced to MinHash signatures of their description's word shingles.
+Signatures are split into LSH bands so that only posts sharing a band bucket are
+compared.  Each post joins the cluster of the most similar earlier representative
+whose estimated Jaccard similarity reaches the threshold (and whose title words
+overlap, so shared company boilerplate does not merge different roles), otherwise it
+becomes the representative of a new cluster.
+
+usage: python -m job_classification_agent.dedup [-h] [--threshold THRESHOLD] [--num-perm NUM_PERM] input [report]
+'''
+
+import argparse
+import hashlib
+import json
+import time
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from job_classification_agent.job_posts import JobPost, read_job_posts
+from job_classification_agent.retrieval import tokenize
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_TITLE_THRESHOLD = 0.3
+
+# candidate comparisons per post within one LSH bucket
+MAX_BUCKET_COMPARISONS = 50
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingles(text: str, k: int = 3) -> Set[bytes]:
+   '''Word k-shingles of a text (a single shingle for texts shorter than k words)'''
+   words = tokenize(text)
+   if len(words) <= k:
+      return {" ".join(words).encode("utf-8")} if words else set()
+   return {" ".join(words[i:i + k]).encode("utf-8") for i in range(len(words) - k + 1)}
+
+def title_similarity(a: str, b: str) -> float:
+   '''Jaccard similarity of title words ("Software Engineer - Boston" and "Software Engineer - Chicago" -> 0.5)'''
+   a, b = set(tokenize(a)), set(tokenize(b))
+   if not a or not b:
+      return 1.0 if a == b else 0.0
+   return len(a & b) / len(a | b)
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+   '''Number of bands and rows per band with the highest S-curve threshold (1/b)^(1/r) at or below threshold
+
+   Erring low keeps LSH false negatives rare, false positives are removed by the similarity check.
+   '''
+   options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+   below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+   return max(below or options[-1:], key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+@dataclass
+class Cluster:
+   representative: JobPost
+   members: List[JobPost] = field(default_factory=list)
+   similarities: List[float] = field(default_factory=list)
+
+   def to_record(self) -> dict:
+      return {"representative": self.representative.id,
+              "members": [m.id for m in self.members],
+              "similarities": [round(s, 3) for s in self.similarities]}
+
+class NearDuplicateDetector:
+   '''Cluster job posts into near-duplicate groups'''
+
+   def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = 128, title_threshold: float = DEFAULT_TITLE_THRESHOLD,
+                shingle_size: int = 3, seed: int = 1):
+      self.threshold = threshold
+      self.num_perm = num_perm
+      self.shingle_size = shingle_size
+      self.title_threshold = title_threshold
+      self.bands, self.rows = lsh_params(threshold, num_perm)
+
+      rng = np.random.RandomState(seed)
+      self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+      self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+   def signature(self, text: str) -> np.ndarray:
+      '''MinHash signature of a text (num_perm 32 bit hashes)'''
+      return self._minhash(shingles(text, self.shingle_size))
+
+   def _minhash(self, text_shingles: Set[bytes]) -> np.ndarray:
+      hashes = np.array([int.from_bytes(hashlib.blake2b(s, digest_size=4).digest(), "little") for s in text_shingles], dtype=np.uint64)
+      if not len(hashes):
+         return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+      # uint64 overflow wraps, as in the usual numpy MinHash implementations
+      permuted = np.bitwise_and((np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME, _MAX_HASH)
+      return permuted.min(axis=1)
+
+   def cluster(self, posts: Sequence[JobPost]) -> List[Cluster]:
+      '''Group posts into clusters (every post is in exactly one cluster, most clusters have a single member)
+
+      The representative of a cluster is its first post in input order.  Posts with fewer than
+      shingle_size shingles (empty or boilerplate descriptions such as "See website") have
+      near-identical signatures whatever the job is, so they are singletons that never merge.
+      '''
+      post_shingles = [shingles(post.description, self.shingle_size) for post in posts]
+      signatures = np.array([self._minhash(s) for s in post_shingles]).reshape(len(posts), self.num_perm)
+
+      # posts are compared with cluster representatives only: a post joins the most similar earlier
+      # representative that reaches both thresholds, so members never chain through each other
+      representatives: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+      clusters: Dict[int, Cluster] = {}
+      for j, post in enumerate(posts):
+         if len(post_shingles[j]) < self.shingle_size:
+            clusters[j] = Cluster(representative=post)
+            continue
+
+         keys = [(band, signatures[j][band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+         # the latest representatives of every bucket (capped for very large buckets)
+         candidates = sorted({i for key in keys for i in representatives[key][-MAX_BUCKET_COMPARISONS:]})
+
+         best, best_estimate = None, 0.0
+         for i in candidates:
+            estimate = float(np.mean(signatures[i] == signatures[j]))
+            if estimate < self.threshold or estimate <= best_estimate:
+               continue
+            if title_similarity(posts[i].title, post.title) < self.title_threshold:
+               continue
+            best, best_estimate = i, estimate
+
+         if best is None:
+            clusters[j] = Cluster(representative=post)
+            for key in keys:
+               representatives[key].append(j)
+         else:
+            clusters[best].members.append(post)
+            clusters[best].similarities.append(best_estimate)
+
+      return list(clusters.values())
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Find near-duplicate job posts")
+   parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Minimum estimated Jaccard similarity of descriptions (default: {DEFAULT_THRESHOLD})")
+   parser.add_argument("--title-threshold", type=float, default=DEFAULT_TITLE_THRESHOLD, help=f"Minimum Jaccard similarity of title words (default: {DEFAULT_TITLE_THRESHOLD})")
+   parser.add_argument("--num-perm", type=int, default=128, help="Number of MinHash permutations (default: 128)")
+   parser.add_argument("input", type=str, help="JSON Lines or CSV file of job posts")
+   parser.add_argument("report", type=str, nargs="?", default=None, help="JSON Lines file for the near-duplicate clusters")
+   return parser.parse_args()
+
+def main(args) -> None:
+
+   posts = list(read_job_posts(args.input))
+   detector = NearDuplicateDetector(threshold=args.threshold, num_perm=args.num_perm, title_threshold=args.title_threshold)
+
+   start_time = time.perf_counter()
+   clusters = detector.cluster(posts)
+   duplicates = [c for c in clusters if c.members]
+   print(f"Clustered {len(posts)} job posts in {time.perf_counter() - start_time:.2f} seconds ({detector.bands} bands x {detector.rows} rows)")
+   print(f"{len(clusters)} unique job posts, {len(duplicates)} near-duplicate clusters covering {sum(len(c.members) for c in duplicates)} duplicates")
+
+   if args.report:
+      with open(args.report, "w", encoding="utf-8") as f:
+         for cluster in duplicates:
+            f.write(json.dumps(cluster.to_record()) + "\n")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
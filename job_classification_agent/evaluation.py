@@ -0,0 +1,365 @@
+'''Offline evaluation of the classification chain on a labeled set of job posts
+
+Runs labeled job posts through the chain (with BatchClassifier, as in batch mode) for one
+or more configurations (assistant, prompt template, hints, explanations, shortlist, fast
+path, hierarchical mode) and reports per configuration:
+
+- precision, recall and F1 of the classified occupations and of their major groups (the
+  first two digits of the SOC code), micro-averaged over the job posts, and top-1 accuracy
+- latency percentiles per job post
+- token usage and cost per 1,000 job posts (from the model prices below)
+- the post_process repair rate: the share of the assistant's classifications whose title
+  or code was replaced from the knowledge base, and the share dropped as unknown occupations
+
+Assistant answers are recorded and replayed (recording.py).  With --mode replay (the
+default) the evaluation makes no API calls and is deterministic; the latencies are the
+recorded run durations plus the local processing time.  Record once (--mode auto records
+the missing answers, --mode record re-records all of them), then compare post-processing
+changes offline.  Prompt, hints and assistant changes need new recordings.  The
+classification cache is not used.
+
+Labeled job posts are JSON Lines records with `title`, `description` and `occupation_code`
+(or a list of `occupation_codes`), and optionally an `id`.
+
+Configurations (--configs) are a JSON list of objects with a `name` and any of
+`assistant_id`, `prompt_template` (a file), `hints`, `include_explanation`, `shortlist`,
+`fast_path` and `hierarchical`; unset fields default to the command line options.  To compare models,
+create an assistant per model with scripts/create_assistant.py --model and add a
+configuration per assistant id.
+
+usage: python -m job_classification_agent.evaluation [-h] --labeled LABELED [--limit LIMIT] [--mode {record,replay,auto}] [--recordings RECORDINGS] [--configs CONFIGS] ...
+'''
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import threading
+
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from job_classification_agent.batch import BatchClassifier, BatchResult
+from job_classification_agent.chain import DEFAULT_PROMPT_TEMPLATE, build_chain, load_prompt, parse_output, post_process
+from job_classification_agent.fast_path import load_title_matcher
+from job_classification_agent.hierarchy import Hierarchy
+from job_classification_agent.job_posts import JobPost
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.recording import MODES, RECORDINGS_PATH, RecordingAssistantRunnable, RecordingStore
+from job_classification_agent.retrieval import load_retriever
+from job_classification_agent.taxonomy import read_jsonl
+from job_classification_agent.tracing import TOKEN_ATTRIBUTES, Sink, Span, tracer
+
+# USD per 1M prompt and completion tokens for the MODEL_OPTIONS of scripts/create_assistant.py (file search calls and storage are not included)
+MODEL_PRICES = {
+   "gpt-3.5-turbo": (0.50, 1.50),
+   "gpt-4o-mini": (0.15, 0.60),
+   "gpt-4o": (2.50, 10.00),
+   "gpt-4-turbo": (10.00, 30.00),
+}
+
+# a labeled job post: the job post and its labeled occupation codes
+LabeledPost = Tuple[JobPost, FrozenSet[str]]
+
+def model_price(model: Optional[str]) -> Optional[Tuple[float, float]]:
+   '''Prices of a model, also of its dated versions (e.g. gpt-4o-mini-2024-07-18)'''
+   if not model:
+      return None
+   names = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+   return MODEL_PRICES[max(names, key=len)] if names else None
+
+def read_labeled_posts(path: str, limit: Optional[int] = None) -> List[LabeledPost]:
+   posts = []
+   for i, record in enumerate(read_jsonl(path), start=1):
+      if limit is not None and len(posts) >= limit:
+         break
+      codes = record.get("occupation_codes") or [record["occupation_code"]]
+      post = JobPost(id=str(record.get("id", i)), title=record.get("title", ""), description=record.get("description", ""))
+      posts.append((post, frozenset(codes)))
+   return posts
+
+def major_group(occupation_code: str) -> str:
+   return occupation_code[:2]
+
+def precision_recall_f1(true_positives: int, predicted: int, actual: int) -> Tuple[float, float, float]:
+   precision = true_positives / predicted if predicted else 0.0
+   recall = true_positives / actual if actual else 0.0
+   f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+   return precision, recall, f1
+
+def percentile(values: List[float], p: float) -> float:
+   values = sorted(values)
+   return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+@dataclass
+class EvaluationConfig:
+   name: str = "default"
+   assistant_id: Optional[str] = None
+   prompt_template: Optional[str] = None
+   hints: Optional[str] = None
+   include_explanation: bool = True
+   shortlist: int = 0
+   fast_path: bool = False
+   hierarchical: bool = False
+
+def load_configs(path: str, base: EvaluationConfig) -> List[EvaluationConfig]:
+   '''Read a JSON list of configurations, unset fields default to the base configuration'''
+   with open(path, encoding="utf-8") as f:
+      items = json.load(f)
+   return [dataclasses.replace(base, **{"name": f"config {i}", **item}) for i, item in enumerate(items, start=1)]
+
+@dataclass
+class PostTrace:
+   '''What the trace of one job post's classification recorded'''
+   latency: float = 0.0
+   replayed: float = 0.0
+   tokens: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+   classifications: int = 0
+   repaired: int = 0
+   unmatched: int = 0
+   dropped: int = 0
+
+class EvaluationSink(Sink):
+   '''Collect the latency, token usage and post_process repairs of each classified job post from its trace'''
+
+   def __init__(self):
+      self.posts: Dict[str, PostTrace] = {}
+      self._traces: Dict[str, PostTrace] = defaultdict(PostTrace)
+      self._lock = threading.Lock()
+
+   def on_end(self, span: Span) -> None:
+      attributes = span.attributes
+      with self._lock:
+         trace = self._traces[span.trace_id]
+         if attributes.get("replayed"):
+            trace.replayed += span.duration
+         for key in TOKEN_ATTRIBUTES:
+            if isinstance(attributes.get(key), int):
+               trace.tokens[key] += attributes[key]
+         if span.name == "post_process":
+            trace.classifications += attributes.get("classifications", 0)
+            trace.repaired += attributes.get("repaired", 0)
+            trace.unmatched += attributes.get("unmatched", 0)
+         elif span.name == "parse_output":
+            trace.dropped += attributes.get("dropped_classifications", 0)
+         elif span.name == "classify":
+            # replayed runs take no time, add their recorded durations
+            trace.latency = span.duration + trace.replayed
+            self.posts[str(attributes.get("post_id"))] = self._traces.pop(span.trace_id)
+
+@dataclass
+class EvaluationReport:
+   name: str
+   assistant_id: Optional[str]
+   model: Optional[str]
+   posts: int = 0
+   errors: int = 0
+   replay_misses: int = 0
+   fast_path: int = 0
+   hierarchical: int = 0
+   occupation_precision: float = 0.0
+   occupation_recall: float = 0.0
+   occupation_f1: float = 0.0
+   major_group_precision: float = 0.0
+   major_group_recall: float = 0.0
+   major_group_f1: float = 0.0
+   top1_accuracy: float = 0.0
+   latency_mean: float = 0.0
+   latency_p50: float = 0.0
+   latency_p95: float = 0.0
+   latency_p99: float = 0.0
+   prompt_tokens_per_post: float = 0.0
+   completion_tokens_per_post: float = 0.0
+   cost_per_1k_posts: Optional[float] = None
+   repair_rate: float = 0.0
+   unmatched_rate: float = 0.0
+   dropped_classifications: int = 0
+
+def build_classifier(config: EvaluationConfig, store: RecordingStore, mode: str, concurrency: int) -> Tuple[BatchClassifier, RecordingAssistantRunnable]:
+   '''A BatchClassifier for a configuration, with the assistant runs recorded to or replayed from the store'''
+   agent = None
+   if mode != "replay":
+      agent, _ = build_chain(config.assistant_id)
+   recorder = RecordingAssistantRunnable(config.assistant_id, store, mode=mode, agent=agent)
+
+   prompt_template = DEFAULT_PROMPT_TEMPLATE
+   if config.prompt_template:
+      with open(config.prompt_template, encoding="utf-8") as f:
+         prompt_template = f.read()
+
+   classifier = BatchClassifier(recorder | parse_output | post_process,
+                                load_prompt(prompt_template, config.include_explanation, config.hints),
+                                concurrency=concurrency,
+                                include_explanation=config.include_explanation,
+                                hints=config.hints,
+                                retriever=load_retriever() if config.shortlist > 0 else None,
+                                shortlist_size=config.shortlist,
+                                fast_path=load_title_matcher() if config.fast_path else None,
+                                assistant_id=config.assistant_id,
+                                hierarchy=Hierarchy(recorder, load_knowledge_base()) if config.hierarchical else None)
+   return classifier, recorder
+
+def score(config: EvaluationConfig, posts: List[LabeledPost], results: Dict[str, BatchResult], traces: Dict[str, PostTrace],
+          model: Optional[str]) -> Tuple[EvaluationReport, List[dict]]:
+   '''Compute the metrics of a configuration from the results and traces of its job posts'''
+   report = EvaluationReport(name=config.name, assistant_id=config.assistant_id, model=model, posts=len(posts))
+   occupations = [0, 0, 0]  # true positives, predicted, actual
+   major_groups = [0, 0, 0]
+   top1 = 0
+   details = []
+
+   for post, labels in posts:
+      result = results[post.id]
+      predicted = [c.occupation_code for c in result.result.job_classifications] if result.ok else []
+      report.errors += not result.ok
+      report.fast_path += result.source == "fast_path"
+      report.hierarchical += result.source == "hierarchical"
+      top1 += bool(predicted) and predicted[0] in labels
+
+      for counts, predicted_set, label_set in ((occupations, set(predicted), labels),
+                                               (major_groups, {major_group(c) for c in predicted}, {major_group(c) for c in labels})):
+         counts[0] += len(predicted_set & label_set)
+         counts[1] += len(predicted_set)
+         counts[2] += len(label_set)
+
+      trace = traces.get(post.id, PostTrace())
+      detail = {"config": config.name, "id": post.id, "labels": sorted(labels), "predicted": predicted,
+                "correct": bool(set(predicted) & labels), "source": result.source, "latency": round(trace.latency, 3)}
+      if result.error is not None:
+         detail["error"] = result.error
+      details.append(detail)
+
+   report.occupation_precision, report.occupation_recall, report.occupation_f1 = precision_recall_f1(*occupations)
+   report.major_group_precision, report.major_group_recall, report.major_group_f1 = precision_recall_f1(*major_groups)
+   report.top1_accuracy = top1 / len(posts) if posts else 0.0
+
+   latencies = [trace.latency for trace in traces.values()]
+   report.latency_mean = sum(latencies) / len(latencies) if latencies else 0.0
+   report.latency_p50, report.latency_p95, report.latency_p99 = (percentile(latencies, p) for p in (50, 95, 99))
+
+   prompt_tokens = sum(trace.tokens["prompt_tokens"] for trace in traces.values())
+   completion_tokens = sum(trace.tokens["completion_tokens"] for trace in traces.values())
+   report.prompt_tokens_per_post = prompt_tokens / len(posts) if posts else 0.0
+   report.completion_tokens_per_post = completion_tokens / len(posts) if posts else 0.0
+   price = model_price(model)
+   if price is not None:
+      report.cost_per_1k_posts = 1000 * (report.prompt_tokens_per_post * price[0] + report.completion_tokens_per_post * price[1]) / 1e6
+
+   classifications = sum(trace.classifications for trace in traces.values())
+   report.repair_rate = sum(trace.repaired for trace in traces.values()) / classifications if classifications else 0.0
+   report.unmatched_rate = sum(trace.unmatched for trace in traces.values()) / classifications if classifications else 0.0
+   report.dropped_classifications = sum(trace.dropped for trace in traces.values())
+
+   return report, details
+
+def evaluate(config: EvaluationConfig, posts: List[LabeledPost], store: RecordingStore, mode: str = "replay",
+             concurrency: int = 8) -> Tuple[EvaluationReport, List[dict]]:
+   '''Classify the labeled job posts with a configuration and score the results'''
+   classifier, recorder = build_classifier(config, store, mode, concurrency)
+
+   sink = EvaluationSink()
+   tracer.add_sink(sink)
+   try:
+      async def run():
+         return [r async for r in classifier.stream([post for post, _ in posts])]
+
+      results = {r.post_id: r for r in asyncio.run(run())}
+   finally:
+      tracer.remove_sink(sink)
+
+   models = sorted({r.model for r in store.recordings.values() if r.assistant_id == config.assistant_id and r.model})
+   report, details = score(config, posts, results, sink.posts, ", ".join(models) or None)
+   report.replay_misses = recorder.stats.missed
+   return report, details
+
+# rows of the comparison table: (label, report attribute, format)
+REPORT_ROWS = [
+   ("model", "model", "{}"),
+   ("job posts", "posts", "{:d}"),
+   ("errors", "errors", "{:d}"),
+   ("replay misses", "replay_misses", "{:d}"),
+   ("fast path", "fast_path", "{:d}"),
+   ("hierarchical", "hierarchical", "{:d}"),
+   ("occupation precision", "occupation_precision", "{:.3f}"),
+   ("occupation recall", "occupation_recall", "{:.3f}"),
+   ("occupation F1", "occupation_f1", "{:.3f}"),
+   ("major group precision", "major_group_precision", "{:.3f}"),
+   ("major group recall", "major_group_recall", "{:.3f}"),
+   ("major group F1", "major_group_f1", "{:.3f}"),
+   ("top-1 accuracy", "top1_accuracy", "{:.3f}"),
+   ("latency mean (s)", "latency_mean", "{:.2f}"),
+   ("latency p50 (s)", "latency_p50", "{:.2f}"),
+   ("latency p95 (s)", "latency_p95", "{:.2f}"),
+   ("latency p99 (s)", "latency_p99", "{:.2f}"),
+   ("prompt tokens / post", "prompt_tokens_per_post", "{:.0f}"),
+   ("completion tokens / post", "completion_tokens_per_post", "{:.0f}"),
+   ("cost / 1k posts (USD)", "cost_per_1k_posts", "{:.2f}"),
+   ("repair rate", "repair_rate", "{:.3f}"),
+   ("unmatched rate", "unmatched_rate", "{:.3f}"),
+   ("dropped (invalid)", "dropped_classifications", "{:d}"),
+]
+
+def format_reports(reports: List[EvaluationReport]) -> str:
+   '''A table with a column per configuration'''
+   width = max([12] + [len(report.name) for report in reports])
+   lines = [f"{'':<26}" + "".join(f" {report.name:>{width}}" for report in reports)]
+   for label, attribute, fmt in REPORT_ROWS:
+      values = [getattr(report, attribute) for report in reports]
+      lines.append(f"{label:<26}" + "".join(f" {(fmt.format(value) if value is not None else '-'):>{width}}" for value in values))
+   return "\n".join(lines)
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Evaluate the classification chain on a labeled set of job posts")
+   parser.add_argument("--labeled", type=str, required=True, help="JSON Lines file of labeled job posts")
+   parser.add_argument("--limit", type=int, default=None, help="Maximum number of job posts")
+   parser.add_argument("--mode", type=str, default="replay", choices=MODES, help="replay recorded answers only (default), record all answers, or auto: record the missing answers")
+   parser.add_argument("--recordings", type=str, default=RECORDINGS_PATH, help="Recorded assistant answers (default: data/recordings/assistant_responses.jsonl)")
+   parser.add_argument("--configs", type=str, default=None, help="JSON file with a list of configurations to compare")
+   parser.add_argument("--assistant-id", type=str, default=os.environ.get("ASSISTANT_ID"), help="Assistant ID (default: ASSISTANT_ID environment variable)")
+   parser.add_argument("--prompt-template", type=str, default=None, help="File with a custom prompt template")
+   parser.add_argument("--hints", type=str, default=None, help="Additional hints for the assistant")
+   parser.add_argument("--no-explanation", action="store_true", help="Do not ask the assistant for per-classification explanations")
+   parser.add_argument("--shortlist", type=int, default=0, metavar="K", help="Include the top K candidate occupations from the local search index in the prompt (default: 0, disabled)")
+   parser.add_argument("--fast-path", action="store_true", help="Classify job posts with a matching O*NET title without running the assistant")
+   parser.add_argument("--hierarchical", action="store_true", help="Classify in two stages: SOC major groups first, then their occupations")
+   parser.add_argument("--concurrency", type=int, default=8, help="Concurrent assistant runs when recording (default: 8)")
+   parser.add_argument("--output", type=str, default=None, help="Write the reports to a JSON file")
+   parser.add_argument("--details", type=str, default=None, help="Write the per job post results to a JSON Lines file")
+   return parser.parse_args()
+
+def main(args) -> None:
+   base = EvaluationConfig(assistant_id=args.assistant_id, prompt_template=args.prompt_template, hints=args.hints,
+                           include_explanation=not args.no_explanation, shortlist=args.shortlist, fast_path=args.fast_path,
+                           hierarchical=args.hierarchical)
+   configs = load_configs(args.configs, base) if args.configs else [base]
+   for config in configs:
+      assert(config.assistant_id is not None), f"No assistant ID for configuration {config.name}.  Set ASSISTANT_ID or --assistant-id."
+
+   posts = read_labeled_posts(args.labeled, args.limit)
+   store = RecordingStore(args.recordings)
+   print(f"{len(posts)} labeled job posts, {len(store)} recorded answers")
+
+   load_knowledge_base()
+   reports, details = [], []
+   for config in configs:
+      report, config_details = evaluate(config, posts, store, mode=args.mode, concurrency=args.concurrency)
+      reports.append(report)
+      details.extend(config_details)
+      if report.replay_misses:
+         print(f"{config.name}: {report.replay_misses} job posts have no recorded answer, record them with --mode auto")
+
+   print(format_reports(reports))
+
+   if args.output:
+      with open(args.output, "w", encoding="utf-8") as f:
+         json.dump([asdict(report) for report in reports], f, indent=2)
+   if args.details:
+      with open(args.details, "w", encoding="utf-8") as f:
+         for detail in details:
+            f.write(json.dumps(detail) + "\n")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
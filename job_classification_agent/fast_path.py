@@ -0,0 +1,203 @@
+'''Deterministic title-only classification that skips the assistant
+
+Job post titles are normalized and looked up in a hash index of O*NET occupation
+titles, sample titles and alternate titles.  A confident hit is returned as a
+JobClassifications immediately; anything else falls through to the assistant.
+
+usage: python -m job_classification_agent.fast_path [-h] [--threshold THRESHOLD] [title ...]
+'''
+
+import argparse
+import os
+import re
+import time
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from job_classification_agent.models import JobClassification, JobClassifications
+from job_classification_agent.retrieval import stem
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, read_jsonl
+
+# processed file, title field and confidence of an exact match for each title source
+SOURCES = [
+   ("occupation_descriptions.json", "occupation_title", 1.0),
+   ("occupation_sample_titles.json", "sample_job_title", 0.95),
+   ("occupation_alternate_titles.json", "alternate_job_title", 0.9),
+]
+
+DEFAULT_THRESHOLD = 0.9
+
+# confidence multiplier when a match needed seniority / level words removed
+STRIPPED_PENALTY = 0.95
+
+SENIORITY_PREFIXES = ("senior", "sr", "junior", "jr", "entry level", "experienced")
+LEVEL_SUFFIXES = ("i", "ii", "iii", "iv", "1", "2", "3", "4")
+
+_PARENTHETICAL = re.compile(r"\([^)]*\)")
+_NON_WORD = re.compile(r"[^a-z0-9+#]+")
+
+def normalize_job_title(title: str) -> str:
+   '''Lowercase and singularize the title, reducing punctuation to single spaces ("Sr. Engineers - II" -> "sr engineer ii")'''
+   if not title:
+      return ""
+   title = title.lower().replace("&", " and ")
+   return " ".join(stem(word) for word in _NON_WORD.sub(" ", title).split())
+
+def strip_seniority(normalized: str) -> str:
+   '''Remove leading seniority words and trailing level numbers from a normalized title'''
+   words = normalized.split()
+   changed = True
+   while changed and len(words) > 1:
+      changed = False
+      for prefix in SENIORITY_PREFIXES:
+         prefix_words = prefix.split()
+         if words[:len(prefix_words)] == prefix_words and len(words) > len(prefix_words):
+            words = words[len(prefix_words):]
+            changed = True
+      if words[-1] in LEVEL_SUFFIXES and len(words) > 1:
+         words = words[:-1]
+         changed = True
+   return " ".join(words)
+
+def title_variants(title: str) -> List[str]:
+   '''Normalized lookup keys for an O*NET title: the title, and for "CEO (Chief Executive Officer)" also "ceo" and "chief executive officer"'''
+   variants = [normalize_job_title(title)]
+   if "(" in title:
+      variants.append(normalize_job_title(_PARENTHETICAL.sub(" ", title)))
+      variants.extend(normalize_job_title(m.strip("()")) for m in _PARENTHETICAL.findall(title))
+   return [v for v in variants if v]
+
+class TitleMatch(NamedTuple):
+   occupation_code: str
+   occupation_title: str
+   matched_title: str
+   confidence: float
+
+@dataclass
+class FastPathStats:
+   lookups: int = 0
+   hits: int = 0
+   lookup_time: float = 0.0
+   assistant_runs: int = 0
+   assistant_time: float = 0.0
+
+   @property
+   def hit_rate(self) -> float:
+      return self.hits / self.lookups if self.lookups else 0.0
+
+   @property
+   def time_saved(self) -> float:
+      '''Estimated seconds saved: the mean assistant latency for every hit, minus the time spent on lookups'''
+      if not self.assistant_runs:
+         return 0.0
+      return self.hits * self.assistant_time / self.assistant_runs - self.lookup_time
+
+   def record_assistant_run(self, elapsed: float) -> None:
+      self.assistant_runs += 1
+      self.assistant_time += elapsed
+
+class TitleMatcher:
+   '''Hash index of normalized O*NET titles'''
+
+   def __init__(self, titles: Dict[str, Tuple[str, str, str, float]], threshold: float = DEFAULT_THRESHOLD):
+      self.titles = titles
+      self.threshold = threshold
+      self.stats = FastPathStats()
+
+   @classmethod
+   def build(cls, data_dir: str = PROCESSED_DATA_DIR, threshold: float = DEFAULT_THRESHOLD) -> "TitleMatcher":
+      '''Build the index from the processed JSON Lines files (files that are missing are skipped)'''
+      # normalized title -> occupation code -> (occupation title, matched title, confidence)
+      candidates = defaultdict(dict)
+
+      for filename, title_field, confidence in SOURCES:
+         path = os.path.join(data_dir, filename)
+         if not os.path.exists(path):
+            continue
+         for record in read_jsonl(path):
+            code = record["occupation_code"]
+            for key in title_variants(record[title_field]):
+               best = candidates[key].get(code)
+               if best is None or best[2] < confidence:
+                  candidates[key][code] = (record["occupation_title"], record[title_field], confidence)
+
+      titles = {}
+      for key, codes in candidates.items():
+         code, (occupation_title, matched_title, confidence) = max(codes.items(), key=lambda item: item[1][2])
+         # a title shared by several occupations is ambiguous, its confidence is split between them
+         titles[key] = (code, occupation_title, matched_title, confidence / len(codes))
+
+      return cls(titles, threshold)
+
+   def match(self, job_post_title: str) -> Optional[TitleMatch]:
+      '''Find the best matching O*NET title (regardless of the confidence threshold)'''
+      best = None
+      for key in title_variants(job_post_title):
+         for lookup, penalty in ((key, 1.0), (strip_seniority(key), STRIPPED_PENALTY)):
+            value = self.titles.get(lookup)
+            if value is None:
+               continue
+            code, occupation_title, matched_title, confidence = value
+            if best is None or confidence * penalty > best.confidence:
+               best = TitleMatch(code, occupation_title, matched_title, confidence * penalty)
+            break
+
+      return best
+
+   def classify(self, job_post_title: str, include_explanation: bool = True) -> Optional[JobClassifications]:
+      '''Classify a job post by its title, or return None if there is no confident match'''
+      start_time = time.perf_counter()
+      match = self.match(job_post_title)
+      self.stats.lookups += 1
+
+      if match is None or match.confidence < self.threshold:
+         self.stats.lookup_time += time.perf_counter() - start_time
+         return None
+
+      explanation = None
+      if include_explanation:
+         explanation = f"The job post title matches the O*NET title '{match.matched_title}' (confidence {match.confidence:.2f})."
+
+      result = JobClassifications(job_classifications=[JobClassification(occupation_code=match.occupation_code,
+                                                                         occupation_title=match.occupation_title,
+                                                                         explanation=explanation)],
+                                  overall_explanation="Classified by job post title match, the assistant was not used.")
+
+      self.stats.hits += 1
+      self.stats.lookup_time += time.perf_counter() - start_time
+      return result
+
+# the title matcher is built once per process and shared by the app and batch runs
+_matcher: Optional[TitleMatcher] = None
+
+def load_title_matcher(data_dir: str = PROCESSED_DATA_DIR) -> TitleMatcher:
+   global _matcher
+   if _matcher is None:
+      _matcher = TitleMatcher.build(data_dir)
+   return _matcher
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Match job post titles to O*NET titles")
+   parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Minimum confidence for a fast path classification (default: {DEFAULT_THRESHOLD})")
+   parser.add_argument("titles", type=str, nargs="*", help="Job post titles")
+   return parser.parse_args()
+
+def main(args) -> None:
+
+   start_time = time.perf_counter()
+   matcher = TitleMatcher.build(threshold=args.threshold)
+   print(f"Indexed {len(matcher.titles)} titles in {time.perf_counter() - start_time:.2f} seconds")
+
+   for title in args.titles:
+      match = matcher.match(title)
+      if match is None:
+         print(f"{title!r}: no match")
+      else:
+         status = "hit" if match.confidence >= matcher.threshold else "below threshold"
+         print(f"{title!r}: {match.occupation_code} {match.occupation_title} (matched {match.matched_title!r}, confidence {match.confidence:.2f}, {status})")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
@@ -0,0 +1,182 @@
+'''Hierarchical two-stage classification: SOC major group first, then its occupations
+
+Flat mode classifies a job post against all ~1,000 occupations with file_search over the
+whole knowledge base.  Hierarchical mode splits the decision into two smaller ones:
+
+1. stage one picks up to two SOC major groups (the first two code digits, e.g. 15
+   Computer and Mathematical Occupations) from a compact list of the 23 major groups
+   with their main career clusters
+2. stage two classifies the job post among the occupations of the selected major groups
+   only: their codes, titles and the first sentence of their descriptions are listed in
+   the prompt (a knowledge slice of 10 to 200 occupations instead of the whole knowledge base)
+
+Both runs override the assistant's tools with none, so no file_search retrieval is paid
+for.  The two prompts are larger than the flat prompt (about 1,200 tokens for stage one and
+3,300 to 5,000 for stage two, up to 8,900 for the largest slice), so the savings depend on
+how many tokens file_search retrieves in flat mode (see benchmarks/hierarchy.py).  The stage two answer is parsed and post-processed like a flat answer into
+JobClassifications.  When stage one returns no known major group, the job post is
+classified in flat mode (see BatchClassifier._classify_with_assistant).
+'''
+
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+from langchain.output_parsers import PydanticOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+
+from job_classification_agent.chain import format_instructions, parse_output, post_process
+from job_classification_agent.json_stream import loads_tolerant
+from job_classification_agent.models import MajorGroupSelection
+from job_classification_agent.taxonomy import TaxonomyIndex
+from job_classification_agent.tracing import current_span, tracer
+
+# SOC 2018 major groups
+MAJOR_GROUPS = {
+   "11": "Management Occupations",
+   "13": "Business and Financial Operations Occupations",
+   "15": "Computer and Mathematical Occupations",
+   "17": "Architecture and Engineering Occupations",
+   "19": "Life, Physical, and Social Science Occupations",
+   "21": "Community and Social Service Occupations",
+   "23": "Legal Occupations",
+   "25": "Educational Instruction and Library Occupations",
+   "27": "Arts, Design, Entertainment, Sports, and Media Occupations",
+   "29": "Healthcare Practitioners and Technical Occupations",
+   "31": "Healthcare Support Occupations",
+   "33": "Protective Service Occupations",
+   "35": "Food Preparation and Serving Related Occupations",
+   "37": "Building and Grounds Cleaning and Maintenance Occupations",
+   "39": "Personal Care and Service Occupations",
+   "41": "Sales and Related Occupations",
+   "43": "Office and Administrative Support Occupations",
+   "45": "Farming, Fishing, and Forestry Occupations",
+   "47": "Construction and Extraction Occupations",
+   "49": "Installation, Maintenance, and Repair Occupations",
+   "51": "Production Occupations",
+   "53": "Transportation and Material Moving Occupations",
+   "55": "Military Specific Occupations",
+}
+
+DEFAULT_MAX_GROUPS = 2
+
+# runs of both stages use no tools: the knowledge they need is in the prompt
+NO_TOOLS: List[dict] = []
+
+GROUP_PROMPT_TEMPLATE = """Select the SOC major groups of the following job post, most likely first.
+Select up to {max_groups} major groups, only select a second major group if the job post could plausibly belong to it.
+Put people manager titles into Management Occupations (11).
+
+Format instructions: {format_instructions}
+
+SOC major groups (code, title, main career clusters):
+{major_groups}
+
+Additional hints: {hints}
+
+job post title: {job_post_title}
+job post description: {job_post_description}
+"""
+
+SUBTREE_PROMPT_TEMPLATE = """Classify the following job post into one or more of the O*NET 28 occupations listed below.
+You can only include a classification if the job post strongly suggests that the occupation is part of that classification.
+Only use occupations from the list, with their exact code and title.
+Prioritize technical/hard skill matches over soft skill matches.
+If there are no clear classifications among the listed occupations, please indicate that in the overall_explanation.
+
+Format instructions: {format_instructions}
+
+Agent should include explanations: {include_explanation}
+
+Occupations (code, title, description):
+{occupations}
+
+Additional hints: {hints}
+
+job post title: {job_post_title}
+job post description: {job_post_description}
+"""
+
+group_parser = PydanticOutputParser(pydantic_object=MajorGroupSelection)
+
+def major_group(occupation_code: str) -> str:
+   return occupation_code[:2]
+
+def first_sentence(text: Optional[str], max_length: int = 160) -> str:
+   if not text:
+      return ""
+   sentence = text.split(". ", 1)[0].rstrip(".")
+   return sentence if len(sentence) <= max_length else sentence[:max_length - 3].rstrip() + "..."
+
+def format_major_groups(taxonomy: TaxonomyIndex, clusters_per_group: int = 3) -> str:
+   '''The major groups of the taxonomy with their most frequent career clusters'''
+   clusters: Dict[str, Counter] = {code: Counter() for code in MAJOR_GROUPS}
+   for occupation in taxonomy.occupations.values():
+      clusters.setdefault(major_group(occupation.code), Counter()).update(occupation.career_clusters)
+
+   lines = []
+   for code, title in MAJOR_GROUPS.items():
+      top = [cluster for cluster, _ in clusters[code].most_common(clusters_per_group)]
+      lines.append(f"- {code} {title}" + (f" ({'; '.join(top)})" if top else ""))
+   return "\n".join(lines)
+
+@tracer.traced("hierarchy.parse_groups")
+def parse_major_groups(output: OpenAIAssistantFinish) -> List[str]:
+   '''The known major group codes of a stage one answer ("15", "15-0000" and "15-1252.00" all select 15), an unusable answer selects none'''
+   try:
+      obj = loads_tolerant(output.return_values.get('output') or "")
+   except ValueError:  # includes json.JSONDecodeError
+      return []
+   items = obj.get("major_groups") if isinstance(obj, dict) else None
+
+   groups = []
+   for item in items if isinstance(items, list) else []:
+      code = major_group(str(item).strip())
+      if code in MAJOR_GROUPS and code not in groups:
+         groups.append(code)
+
+   span = current_span()
+   if span is not None:
+      span.set(major_groups=",".join(groups))
+   return groups
+
+class Hierarchy:
+   '''Prompts, knowledge slices and chains of the two stages for an assistant runnable'''
+
+   def __init__(self, agent: Runnable, taxonomy: TaxonomyIndex, max_groups: int = DEFAULT_MAX_GROUPS):
+      self.taxonomy = taxonomy
+      self.max_groups = max_groups
+      self.group_chain = agent | parse_major_groups
+      self.chain = agent | parse_output | post_process
+      self.group_prompt = ChatPromptTemplate.from_template(GROUP_PROMPT_TEMPLATE, partial_variables={
+         "format_instructions": group_parser.get_format_instructions(),
+         "max_groups": max_groups,
+         "major_groups": format_major_groups(taxonomy)})
+      self.subtree_prompt = ChatPromptTemplate.from_template(SUBTREE_PROMPT_TEMPLATE, partial_variables={
+         "format_instructions": format_instructions()})
+      self.occupations: Dict[str, List[str]] = {}
+      self._slices: Dict[Tuple[str, ...], str] = {}
+      for occupation in sorted(taxonomy.occupations.values(), key=lambda o: o.code):
+         self.occupations.setdefault(major_group(occupation.code), []).append(
+            f"- {occupation.code} {occupation.title}: {first_sentence(occupation.description)}")
+
+   def knowledge_slice(self, groups: Tuple[str, ...]) -> str:
+      '''The occupations of the major groups, one per line'''
+      if groups not in self._slices:
+         self._slices[groups] = "\n".join(line for group in groups for line in self.occupations.get(group, []))
+      return self._slices[groups]
+
+   @tracer.traced("format_prompt")
+   def group_input(self, job_post_title: str, job_post_description: str, hints: Optional[str] = None) -> dict:
+      '''Assistant input of stage one'''
+      content = self.group_prompt.format(job_post_title=job_post_title, job_post_description=job_post_description, hints=hints if hints else "N/A")
+      return {"content": content, "tools": NO_TOOLS}
+
+   @tracer.traced("format_prompt")
+   def subtree_input(self, groups: List[str], job_post_title: str, job_post_description: str, include_explanation: bool = True,
+                     hints: Optional[str] = None) -> dict:
+      '''Assistant input of stage two, restricted to the occupations of the selected major groups'''
+      content = self.subtree_prompt.format(occupations=self.knowledge_slice(tuple(groups[:self.max_groups])), include_explanation=include_explanation,
+                                           hints=hints if hints else "N/A", job_post_title=job_post_title, job_post_description=job_post_description)
+      return {"content": content, "tools": NO_TOOLS}
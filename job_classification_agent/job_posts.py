@@ -0,0 +1,31 @@
+'''Job post input records'''
+
+import csv
+import json
+
+from dataclasses import dataclass
+from typing import Iterator
+
+@dataclass
+class JobPost:
+   id: str
+   title: str
+   description: str
+
+def read_job_posts(path: str) -> Iterator[JobPost]:
+   '''Read job posts from a JSON Lines (.json/.jsonl) or CSV file
+
+   Each record needs a title (`job_post_title` or `title`) and a description
+   (`job_post_description` or `description`).  An `id` column is optional,
+   the line number is used when it is missing.
+   '''
+   with open(path, newline="", encoding="utf-8") as f:
+      if path.endswith(".csv"):
+         records = csv.DictReader(f)
+      else:
+         records = (json.loads(line) for line in f if line.strip())
+
+      for line_no, record in enumerate(records, start=1):
+         yield JobPost(id=str(record.get("id") or line_no),
+                       title=record.get("job_post_title", record.get("title")) or "",
+                       description=record.get("job_post_description", record.get("description")) or "")
@@ -0,0 +1,313 @@
+'''Persistent job queue of the classification service
+
+Every submitted job post is a job in a local SQLite database, so accepted job posts
+survive restarts of the service.  Workers claim the queued job with the highest
+priority (oldest first within a priority).  Failed jobs are retried after a delay until
+they reach max_attempts, then they are moved to the dead letter state where they can
+be inspected and re-queued.  Per-client quotas bound the pending jobs, the submissions
+per hour and the running jobs of each client, so one client's burst cannot starve the
+others.  Finished jobs with a webhook URL are delivered by the service (see service.py).
+'''
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from job_classification_agent.job_posts import JobPost
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR
+
+QUEUE_PATH = os.path.join(os.path.dirname(PROCESSED_DATA_DIR), "queue", "jobs.db")
+
+# queued -> running -> succeeded | queued (retry) | dead;  queued -> cancelled;  dead -> queued (manual retry)
+JOB_STATUSES = ("queued", "running", "succeeded", "dead", "cancelled")
+FINISHED_STATUSES = ("succeeded", "dead", "cancelled")
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETENTION = 7 * 24 * 60 * 60
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_BASE = 10.0
+
+@dataclass
+class ClientQuota:
+   max_pending: int = 10_000  # queued and running jobs
+   max_per_hour: int = 50_000  # jobs submitted in the last hour
+   max_running: int = 4  # jobs running at the same time
+
+class QuotaExceeded(Exception):
+   '''A submission was rejected by the client's quota'''
+
+   def __init__(self, message: str, retry_after: Optional[float] = None):
+      super().__init__(message)
+      self.retry_after = retry_after
+
+def load_quotas(path: str) -> Tuple[ClientQuota, Dict[str, ClientQuota]]:
+   '''Read the default and per-client quotas from a JSON file ({"default": {...}, "clients": {"<client id>": {...}}})'''
+   with open(path, encoding="utf-8") as f:
+      config = json.load(f)
+   default = ClientQuota(**config.get("default", {}))
+   clients = {client_id: ClientQuota(**{**asdict(default), **quota}) for client_id, quota in config.get("clients", {}).items()}
+   return default, clients
+
+@dataclass
+class Job:
+   id: str
+   batch_id: str
+   client_id: str
+   post_id: str
+   title: str
+   description: str
+   include_explanation: bool = True
+   hints: Optional[str] = None
+   priority: int = 0
+   status: str = "queued"
+   attempts: int = 0
+   max_attempts: int = DEFAULT_MAX_ATTEMPTS
+   created_at: float = 0.0
+   started_at: Optional[float] = None
+   finished_at: Optional[float] = None
+   result: Optional[dict] = None
+   error: Optional[str] = None
+   webhook_url: Optional[str] = None
+   webhook_status: Optional[str] = None
+   webhook_attempts: int = 0
+
+   @classmethod
+   def from_row(cls, row: sqlite3.Row) -> "Job":
+      return cls(id=row["id"], batch_id=row["batch_id"], client_id=row["client_id"], post_id=row["post_id"],
+                 title=row["title"], description=row["description"], include_explanation=bool(row["include_explanation"]),
+                 hints=row["hints"], priority=row["priority"], status=row["status"], attempts=row["attempts"],
+                 max_attempts=row["max_attempts"], created_at=row["created_at"], started_at=row["started_at"],
+                 finished_at=row["finished_at"], result=json.loads(row["result"]) if row["result"] else None,
+                 error=row["error"], webhook_url=row["webhook_url"], webhook_status=row["webhook_status"],
+                 webhook_attempts=row["webhook_attempts"])
+
+   def to_job_post(self) -> JobPost:
+      return JobPost(id=self.post_id, title=self.title, description=self.description)
+
+   def to_record(self) -> dict:
+      '''The job as returned by the HTTP API and sent to webhooks'''
+      record = {"job_id": self.id, "batch_id": self.batch_id, "id": self.post_id, "status": self.status,
+                "priority": self.priority, "attempts": self.attempts, "created_at": self.created_at}
+      if self.finished_at is not None:
+         record["finished_at"] = self.finished_at
+      if self.result is not None:
+         record["result"] = self.result
+      if self.error is not None:
+         record["error"] = self.error
+      return record
+
+class JobQueue:
+   '''SQLite backed priority queue of classification jobs with retries, dead-lettering and per-client quotas
+
+   A single connection is shared by the service's event loop and threads, guarded by
+   a lock; every operation is a short transaction.
+   '''
+
+   def __init__(self, path: str = QUEUE_PATH, default_quota: Optional[ClientQuota] = None, quotas: Optional[Dict[str, ClientQuota]] = None):
+      self.path = path
+      self.default_quota = default_quota or ClientQuota()
+      self.quotas = quotas or {}
+      self._lock = threading.Lock()
+
+      if path != ":memory:":
+         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+      self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+      self._db.row_factory = sqlite3.Row
+      self._db.execute("PRAGMA journal_mode=WAL")
+      self._db.execute("PRAGMA synchronous=NORMAL")
+      self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+         id TEXT PRIMARY KEY,
+         batch_id TEXT NOT NULL,
+         client_id TEXT NOT NULL,
+         post_id TEXT NOT NULL,
+         title TEXT NOT NULL,
+         description TEXT NOT NULL,
+         include_explanation INTEGER NOT NULL,
+         hints TEXT,
+         priority INTEGER NOT NULL,
+         status TEXT NOT NULL,
+         attempts INTEGER NOT NULL DEFAULT 0,
+         max_attempts INTEGER NOT NULL,
+         available_at REAL NOT NULL,
+         created_at REAL NOT NULL,
+         started_at REAL,
+         finished_at REAL,
+         result TEXT,
+         error TEXT,
+         webhook_url TEXT,
+         webhook_status TEXT,
+         webhook_attempts INTEGER NOT NULL DEFAULT 0,
+         webhook_next_at REAL)""")
+      self._db.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at)")
+      self._db.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client_id, created_at)")
+      self._db.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+      self._db.execute("CREATE INDEX IF NOT EXISTS jobs_webhook ON jobs (webhook_status, webhook_next_at)")
+
+   def quota(self, client_id: str) -> ClientQuota:
+      return self.quotas.get(client_id, self.default_quota)
+
+   def submit(self, client_id: str, posts: Sequence[JobPost], priority: int = 0, include_explanation: bool = True,
+              hints: Optional[str] = None, webhook_url: Optional[str] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Tuple[str, List[Job]]:
+      '''Queue job posts as one batch of jobs (all or none), returning the batch id and the jobs
+
+      Raises QuotaExceeded if the client has too many pending jobs or submissions in the last hour.
+      '''
+      quota = self.quota(client_id)
+      now = time.time()
+      batch_id = uuid.uuid4().hex
+      jobs = [Job(id=uuid.uuid4().hex, batch_id=batch_id, client_id=client_id, post_id=post.id, title=post.title,
+                  description=post.description, include_explanation=include_explanation, hints=hints, priority=priority,
+                  max_attempts=max_attempts, created_at=now, webhook_url=webhook_url,
+                  webhook_status="pending" if webhook_url else None)
+              for post in posts]
+
+      with self._lock:
+         pending = self._db.execute("SELECT COUNT(*) FROM jobs WHERE client_id = ? AND status IN ('queued', 'running')", (client_id,)).fetchone()[0]
+         if pending + len(jobs) > quota.max_pending:
+            raise QuotaExceeded(f"client {client_id} has {pending} pending jobs, {len(jobs)} more would exceed the quota of {quota.max_pending}", retry_after=60)
+
+         hour = self._db.execute("SELECT COUNT(*), MIN(created_at) FROM jobs WHERE client_id = ? AND created_at > ?", (client_id, now - 3600)).fetchone()
+         if hour[0] + len(jobs) > quota.max_per_hour:
+            raise QuotaExceeded(f"client {client_id} submitted {hour[0]} jobs in the last hour, the quota is {quota.max_per_hour}",
+                                retry_after=max(1.0, hour[1] + 3600 - now) if hour[1] else 3600)
+
+         self._db.execute("BEGIN")
+         try:
+            self._db.executemany("""INSERT INTO jobs (id, batch_id, client_id, post_id, title, description, include_explanation, hints,
+                                    priority, status, max_attempts, available_at, created_at, webhook_url, webhook_status)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)""",
+                                 [(job.id, job.batch_id, job.client_id, job.post_id, job.title, job.description, int(job.include_explanation),
+                                   job.hints, job.priority, job.max_attempts, now, now, job.webhook_url, job.webhook_status) for job in jobs])
+            self._db.execute("COMMIT")
+         except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+      return batch_id, jobs
+
+   def claim(self) -> Optional[Job]:
+      '''Take the next job for a worker (highest priority, oldest first), skipping clients at their running quota'''
+      now = time.time()
+      with self._lock:
+         running = self._db.execute("SELECT client_id, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY client_id").fetchall()
+         busy = [client_id for client_id, count in running if count >= self.quota(client_id).max_running]
+         placeholders = ",".join("?" * len(busy))
+         row = self._db.execute(f"""UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?
+            WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? AND client_id NOT IN ({placeholders})
+                        ORDER BY priority DESC, created_at LIMIT 1)
+            RETURNING *""", (now, now, *busy)).fetchone()
+      return Job.from_row(row) if row is not None else None
+
+   def complete(self, job_id: str, result: dict) -> None:
+      with self._lock:
+         self._db.execute("UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, finished_at = ?, webhook_next_at = ? WHERE id = ?",
+                          (json.dumps(result), time.time(), time.time(), job_id))
+
+   def fail(self, job_id: str, error: str, retry_delay: Optional[float] = None) -> str:
+      '''Record a failed attempt: re-queue the job after retry_delay, or dead-letter it (no delay or out of attempts)
+
+      Returns the new status of the job.
+      '''
+      now = time.time()
+      with self._lock:
+         row = self._db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+         if retry_delay is not None and row is not None and row["attempts"] < row["max_attempts"]:
+            self._db.execute("UPDATE jobs SET status = 'queued', error = ?, available_at = ? WHERE id = ?", (error, now + retry_delay, job_id))
+            return "queued"
+         self._db.execute("UPDATE jobs SET status = 'dead', error = ?, finished_at = ?, webhook_next_at = ? WHERE id = ?", (error, now, now, job_id))
+         return "dead"
+
+   def cancel(self, job_id: str, client_id: str) -> bool:
+      '''Cancel a queued job (running jobs are not interrupted)'''
+      with self._lock:
+         return self._db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ?, webhook_status = NULL WHERE id = ? AND client_id = ? AND status = 'queued'",
+                                 (time.time(), job_id, client_id)).rowcount > 0
+
+   def retry_dead(self, job_id: str, client_id: str) -> bool:
+      '''Re-queue a dead-lettered job with a fresh set of attempts'''
+      now = time.time()
+      with self._lock:
+         return self._db.execute("""UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?, finished_at = NULL,
+                                    webhook_status = CASE WHEN webhook_url IS NULL THEN NULL ELSE 'pending' END, webhook_attempts = 0
+                                    WHERE id = ? AND client_id = ? AND status = 'dead'""", (now, job_id, client_id)).rowcount > 0
+
+   def requeue_running(self) -> int:
+      '''Re-queue jobs left running by a previous process (call before starting workers)'''
+      with self._lock:
+         return self._db.execute("UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), available_at = ? WHERE status = 'running'",
+                                 (time.time(),)).rowcount
+
+   def get(self, job_id: str, client_id: Optional[str] = None) -> Optional[Job]:
+      with self._lock:
+         row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+      if row is None or (client_id is not None and row["client_id"] != client_id):
+         return None
+      return Job.from_row(row)
+
+   def batch(self, batch_id: str, client_id: str, status: Optional[str] = None, limit: int = 1000, offset: int = 0) -> List[Job]:
+      query = "SELECT * FROM jobs WHERE batch_id = ? AND client_id = ?"
+      params: list = [batch_id, client_id]
+      if status is not None:
+         query += " AND status = ?"
+         params.append(status)
+      with self._lock:
+         rows = self._db.execute(query + " ORDER BY created_at, rowid LIMIT ? OFFSET ?", (*params, limit, offset)).fetchall()
+      return [Job.from_row(row) for row in rows]
+
+   def batch_counts(self, batch_id: str, client_id: str) -> Dict[str, int]:
+      with self._lock:
+         rows = self._db.execute("SELECT status, COUNT(*) FROM jobs WHERE batch_id = ? AND client_id = ? GROUP BY status", (batch_id, client_id)).fetchall()
+      return {status: count for status, count in rows}
+
+   def dead_letters(self, client_id: str, limit: int = 100) -> List[Job]:
+      with self._lock:
+         rows = self._db.execute("SELECT * FROM jobs WHERE client_id = ? AND status = 'dead' ORDER BY finished_at DESC LIMIT ?", (client_id, limit)).fetchall()
+      return [Job.from_row(row) for row in rows]
+
+   def counts(self) -> Dict[str, int]:
+      '''Number of jobs per status'''
+      with self._lock:
+         rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+      return {status: count for status, count in rows}
+
+   def next_available_at(self) -> Optional[float]:
+      '''When the earliest queued job becomes available (retries wait for their delay)'''
+      with self._lock:
+         return self._db.execute("SELECT MIN(available_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+   # -- webhooks --
+
+   def due_webhooks(self, limit: int = 50) -> List[Job]:
+      '''Finished jobs whose webhook is due for (re)delivery'''
+      with self._lock:
+         rows = self._db.execute("""SELECT * FROM jobs WHERE webhook_status = 'pending' AND status IN ('succeeded', 'dead')
+                                    AND webhook_next_at <= ? ORDER BY webhook_next_at LIMIT ?""", (time.time(), limit)).fetchall()
+      return [Job.from_row(row) for row in rows]
+
+   def webhook_delivered(self, job_id: str) -> None:
+      with self._lock:
+         self._db.execute("UPDATE jobs SET webhook_status = 'delivered', webhook_attempts = webhook_attempts + 1 WHERE id = ?", (job_id,))
+
+   def webhook_failed(self, job: Job) -> None:
+      '''Record a failed delivery, retried with exponential backoff up to WEBHOOK_MAX_ATTEMPTS (results can still be polled)'''
+      attempts = job.webhook_attempts + 1
+      status = "failed" if attempts >= WEBHOOK_MAX_ATTEMPTS else "pending"
+      with self._lock:
+         self._db.execute("UPDATE jobs SET webhook_attempts = ?, webhook_status = ?, webhook_next_at = ? WHERE id = ?",
+                          (attempts, status, time.time() + WEBHOOK_RETRY_BASE * 2 ** job.webhook_attempts, job.id))
+
+   def purge(self, retention: float = DEFAULT_RETENTION) -> int:
+      '''Delete finished jobs older than retention seconds'''
+      with self._lock:
+         return self._db.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'dead', 'cancelled') AND finished_at < ?",
+                                 (time.time() - retention,)).rowcount
+
+   def close(self) -> None:
+      self._db.close()
@@ -0,0 +1,177 @@
+'''Tolerant and incremental parsing of the assistant's JSON answer
+
+The assistant is asked for a JobClassifications JSON object but its answer may be
+wrapped in a Markdown code fence, surrounded by prose, cut off, or contain small
+syntax errors such as trailing commas.  loads_tolerant recovers the object from such
+answers instead of failing the whole run.
+
+ClassificationStreamParser is fed the answer as it is generated and returns every
+object of the "job_classifications" array as soon as its closing brace arrives.
+'''
+
+import json
+import re
+
+from typing import Any, List, Optional
+
+_FENCE = re.compile(r"^```[\w-]*[ \t]*\n?(.*?)\n?```", re.DOTALL)
+
+# attempts to drop a truncated trailing member before giving up on a repair
+MAX_REPAIRS = 8
+
+def strip_code_fence(text: str) -> str:
+   '''Remove a Markdown code fence (```json ... ```) around the text, also when the closing fence is missing'''
+   text = text.strip()
+   match = _FENCE.match(text)
+   if match:
+      return match.group(1).strip()
+   if text.startswith("```"):
+      return text.split("\n", 1)[1].strip() if "\n" in text else ""
+   return text
+
+def _scan(text: str):
+   '''Walk a JSON text and return (end of the root value or None, open brackets, start of an unterminated string or None, positions of commas)'''
+   stack: List[str] = []
+   commas: List[int] = []
+   in_string = escape = False
+   string_start = 0
+   for i, c in enumerate(text):
+      if in_string:
+         if escape:
+            escape = False
+         elif c == "\\":
+            escape = True
+         elif c == '"':
+            in_string = False
+      elif c == '"':
+         in_string = True
+         string_start = i
+      elif c in "{[":
+         stack.append("}" if c == "{" else "]")
+      elif c in "}]":
+         if stack:
+            stack.pop()
+         if not stack:
+            return i + 1, stack, False, commas
+      elif c == ",":
+         commas.append(i)
+   return None, stack, string_start if in_string else None, commas
+
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+def repair_json(text: str) -> str:
+   '''Close a truncated JSON text and remove trailing commas (strings are not modified)
+
+   A truncated string is dropped rather than closed, so a cut-off value ("Soft") does not
+   pass as a complete one: a value becomes null, a key or array item is removed.
+   '''
+   end, stack, string_start, _ = _scan(text)
+   if end is not None:
+      text = text[:end]
+   else:
+      if string_start is not None:
+         text = text[:string_start]
+      text = text.rstrip()
+      if text.endswith(","):
+         text = text[:-1]
+      elif text.endswith(":"):
+         text += " null"
+      text += "".join(reversed(stack))
+   return _remove_trailing_commas(text)
+
+def _remove_trailing_commas(text: str) -> str:
+   # only outside of strings: split on string literals and substitute in the other parts
+   parts = re.split(r'("(?:[^"\\]|\\.)*")', text)
+   return "".join(part if i % 2 else _TRAILING_COMMA.sub(r"\1", part) for i, part in enumerate(parts))
+
+def loads_tolerant(text: str) -> Any:
+   '''Parse the first JSON object in an assistant answer, repairing fences, surrounding prose and truncation
+
+   Raises ValueError (json.JSONDecodeError) if no object can be recovered.
+   '''
+   text = strip_code_fence(text)
+   start = text.find("{")
+   if start < 0:
+      raise json.JSONDecodeError("No JSON object in the assistant output", text, 0)
+   text = text[start:]
+
+   try:
+      return json.JSONDecoder(strict=False).raw_decode(text)[0]
+   except json.JSONDecodeError as e:
+      error = e
+
+   # cut back to the last complete member when a truncated one cannot be closed
+   candidate = text
+   for _ in range(MAX_REPAIRS):
+      try:
+         return json.loads(repair_json(candidate), strict=False)
+      except json.JSONDecodeError:
+         _, _, _, commas = _scan(candidate)
+         if not commas:
+            break
+         candidate = candidate[:commas[-1]]
+
+   raise error
+
+class ClassificationStreamParser:
+   '''Incrementally parse an assistant answer, returning each job classification object as soon as it closes'''
+
+   def __init__(self, array_key: str = "job_classifications"):
+      self.array_key = array_key
+      self.text = ""
+      self._pos = 0
+      self._stack: List[str] = []
+      self._in_string = False
+      self._escape = False
+      self._string_start = 0
+      self._last_string: Optional[str] = None
+      self._key: Optional[str] = None
+      self._array_depth: Optional[int] = None
+      self._object_start: Optional[int] = None
+      self.errors = 0
+
+   def feed(self, delta: str) -> List[dict]:
+      '''Add generated text, returning the job classification objects completed by it'''
+      self.text += delta
+      completed = []
+
+      for i in range(self._pos, len(self.text)):
+         c = self.text[i]
+         if self._in_string:
+            if self._escape:
+               self._escape = False
+            elif c == "\\":
+               self._escape = True
+            elif c == '"':
+               self._in_string = False
+               self._last_string = self.text[self._string_start:i]
+            continue
+
+         if c == '"':
+            self._in_string = True
+            self._string_start = i + 1
+         elif c == ":":
+            self._key = self._last_string
+         elif c == "[":
+            if self._key == self.array_key and len(self._stack) == 1 and self._array_depth is None:
+               self._array_depth = len(self._stack) + 1
+            self._stack.append(c)
+         elif c == "{":
+            self._stack.append(c)
+            if self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+               self._object_start = i
+         elif c in "}]":
+            if self._stack:
+               self._stack.pop()
+            if c == "}" and self._object_start is not None and len(self._stack) == self._array_depth:
+               try:
+                  completed.append(loads_tolerant(self.text[self._object_start:i + 1]))
+               except ValueError:
+                  self.errors += 1
+               self._object_start = None
+            elif c == "]" and self._array_depth is not None and len(self._stack) == self._array_depth - 1:
+               # the array is complete, later arrays with the same key are not classifications
+               self._array_depth = -1
+
+      self._pos = len(self.text)
+      return completed
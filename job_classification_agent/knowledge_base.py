@@ -0,0 +1,81 @@
+'''O*NET knowledge base lookups used to validate and repair assistant classifications'''
+
+from typing import List, Optional
+
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, TaxonomyIndex
+from job_classification_agent.tracing import tracer
+
+# the taxonomy index is built once per process and shared by the app and batch runs
+_taxonomy: Optional[TaxonomyIndex] = None
+
+def load_knowledge_base(data_dir: str = PROCESSED_DATA_DIR) -> TaxonomyIndex:
+   '''Build the taxonomy index from the processed occupation and career cluster JSONL files'''
+   global _taxonomy
+   if _taxonomy is None:
+      _taxonomy = TaxonomyIndex.from_directory(data_dir)
+   return _taxonomy
+
+def get_taxonomy() -> Optional[TaxonomyIndex]:
+   '''Get the loaded taxonomy index (None if load_knowledge_base has not been called)'''
+   return _taxonomy
+
+# check that the occupation code exists in the knowledge base
+@tracer.traced("kb.get_occupation_by_code")
+def get_occupation_by_code(occupation_code: str) -> Optional[dict]:
+   '''Verify that occupation code exists in knowledge base'''
+   if _taxonomy is None:
+      return None
+
+   occupation = _taxonomy.get(occupation_code)
+   return occupation.to_dict() if occupation else None
+
+# check that the occupation title exists in the knowledge base
+@tracer.traced("kb.get_occupation_by_title")
+def get_occupation_by_title(occupation_title: str) -> Optional[dict]:
+   '''Verify that occupation title exists in knowledge base'''
+   if _taxonomy is None:
+      return None
+
+   occupation = _taxonomy.get_by_title(occupation_title)
+   return occupation.to_dict() if occupation else None
+
+# Verify that occupation code is valid for occupation title
+@tracer.traced("kb.validate_occupation_code")
+def validate_occupation_code(occupation_code: str, occupation_title: str) -> bool:
+   '''Verify that occupation code is valid for occupation title'''
+   if _taxonomy is None:
+      return False
+
+   return _taxonomy.is_valid(occupation_code, occupation_title)
+
+@tracer.traced("kb.repair_occupation")
+def repair_occupation(occupation_code: str, occupation_title: str) -> Optional[dict]:
+   '''Find the occupation meant by a near-miss title or a malformed code (see repair.py), with the repair confidence'''
+   if _taxonomy is None:
+      return None
+
+   # the repair index is only loaded when an answer needs a fuzzy repair
+   from job_classification_agent.repair import load_repair_index
+
+   repair = load_repair_index().repair(occupation_title, occupation_code)
+   if repair is None:
+      return None
+   return {"occupation_code": repair.occupation_code, "occupation_title": repair.occupation_title, "confidence": repair.confidence}
+
+@tracer.traced("kb.get_career_clusters")
+def get_career_clusters(occupation_code: str) -> List[str]:
+   '''Get Career Clusters for a given occupation code'''
+
+   if _taxonomy is None:
+      return []
+
+   return list(_taxonomy.career_clusters(occupation_code))
+
+@tracer.traced("kb.get_career_pathways")
+def get_career_pathways(occupation_code: str) -> List[str]:
+   '''Get Career Pathways for a given occupation code'''
+
+   if _taxonomy is None:
+      return []
+
+   return list(_taxonomy.career_pathways(occupation_code))
@@ -0,0 +1,243 @@
+'''Offline classification by similarity to O*NET occupation vectors
+
+Every occupation is represented by a TF-IDF vector of hashed unigram and bigram
+features of its title, description, sample and alternate titles, task statements
+and technology skills.  The L2 normalized vectors are stored as a float32 matrix in
+a .npy file that is memory-mapped on load.  A batch of job posts is vectorized the
+same way, scored against every occupation with a sparse-dense matrix product and
+reduced to a top-K selection, returning the same JobClassifications as the
+assistant chain.
+
+No network access is needed and there are no LLM explanations, which makes this
+engine suited to bulk backfills.
+
+usage: python -m job_classification_agent.local_classifier [-h] [--dims DIMS] [--benchmark N] [query]
+'''
+
+import argparse
+import os
+import time
+import zlib
+
+from collections import Counter, defaultdict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from job_classification_agent.models import JobClassification, JobClassifications
+from job_classification_agent.retrieval import INDEX_PATH, SOURCES, tokenize
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, read_jsonl
+
+VECTORS_PATH = os.path.join(os.path.dirname(INDEX_PATH), "occupation_vectors.npy")
+
+DEFAULT_DIMS = 1 << 14
+
+# a classification needs this cosine similarity, and secondary classifications this fraction of the best score
+MIN_SCORE = 0.05
+SECONDARY_RATIO = 0.85
+MAX_CLASSIFICATIONS = 3
+
+def features(text: str) -> List[str]:
+   '''Unigram and bigram features of a text'''
+   tokens = tokenize(text)
+   return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+def hash_features(feature_counts: Counter, dims: int) -> Tuple[np.ndarray, np.ndarray]:
+   '''Sorted unique bucket indexes and summed signed counts of hashed features
+
+   A sign bit is taken from the hash so that colliding features tend to cancel out
+   instead of inflating the bucket.
+   '''
+   hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in feature_counts), dtype=np.int64, count=len(feature_counts))
+   counts = np.fromiter(feature_counts.values(), dtype=np.float64, count=len(feature_counts))
+   indexes, inverse = np.unique(hashes % dims, return_inverse=True)
+   values = np.bincount(inverse, weights=np.where(hashes & 0x80000000, counts, -counts), minlength=len(indexes))
+   return indexes, values
+
+def sublinear(values: np.ndarray) -> np.ndarray:
+   '''Sublinear term frequency that keeps the sign of hashed features'''
+   return np.sign(values) * np.log1p(np.abs(values))
+
+def normalized(values: np.ndarray) -> np.ndarray:
+   norm = np.linalg.norm(values)
+   return values / norm if norm > 0 else values
+
+class LocalClassifier:
+   '''Classify job posts by cosine similarity to occupation vectors
+
+   The matrix is stored feature-major (dims x occupations), so scoring a job post
+   only reads (and pages in) the rows of the features it contains.
+   '''
+
+   def __init__(self, codes: np.ndarray, titles: np.ndarray, idf: np.ndarray, vectors: np.ndarray,
+                min_score: float = MIN_SCORE, secondary_ratio: float = SECONDARY_RATIO):
+      self.codes = codes
+      self.titles = titles
+      self.idf = idf
+      self.vectors = vectors
+      self.dims = len(idf)
+      self.min_score = min_score
+      self.secondary_ratio = secondary_ratio
+
+   @classmethod
+   def build(cls, data_dir: str = PROCESSED_DATA_DIR, dims: int = DEFAULT_DIMS) -> "LocalClassifier":
+      '''Build the occupation vectors from the processed JSON Lines files (files that are missing are skipped)
+
+      Each source is vectorized and normalized separately before the weighted sum, so the
+      many task statements and technology skills of an occupation do not drown out its titles.
+      '''
+      occupations = {}
+      counts = defaultdict(Counter)
+
+      for source, (filename, text_field, _) in enumerate(SOURCES):
+         path = os.path.join(data_dir, filename)
+         if not os.path.exists(path):
+            continue
+         for record in read_jsonl(path):
+            code = record["occupation_code"]
+            occupations.setdefault(code, record["occupation_title"])
+            counts[(code, source)].update(features(record.get(text_field)))
+
+      codes = sorted(occupations)
+      hashed = {key: hash_features(feature_counts, dims) for key, feature_counts in counts.items()}
+
+      occurrences = np.zeros(dims, dtype=bool)
+      df = np.zeros(dims, dtype=np.int64)
+      for code in codes:
+         occurrences[:] = False
+         for source in range(len(SOURCES)):
+            if (code, source) in hashed:
+               occurrences[hashed[(code, source)][0]] = True
+         df += occurrences
+      idf = np.log((len(codes) + 1) / (df + 1)) + 1
+
+      vectors = np.zeros((dims, len(codes)), dtype=np.float32)
+      for column, code in enumerate(codes):
+         vector = np.zeros(dims)
+         for source, (_, _, weight) in enumerate(SOURCES):
+            if (code, source) in hashed:
+               indexes, values = hashed[(code, source)]
+               vector[indexes] += weight * normalized(sublinear(values) * idf[indexes])
+         vectors[:, column] = normalized(vector)
+
+      return cls(np.array(codes), np.array([occupations[code] for code in codes]), idf.astype(np.float32), vectors)
+
+   def save(self, path: str = VECTORS_PATH) -> None:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      np.save(path, np.ascontiguousarray(self.vectors, dtype=np.float32))
+      np.savez(os.path.splitext(path)[0] + ".meta.npz", codes=self.codes, titles=self.titles, idf=self.idf)
+
+   @classmethod
+   def load(cls, path: str = VECTORS_PATH, **kwargs) -> "LocalClassifier":
+      with np.load(os.path.splitext(path)[0] + ".meta.npz", allow_pickle=False) as meta:
+         codes, titles, idf = meta["codes"], meta["titles"], meta["idf"]
+      return cls(codes, titles, idf, np.load(path, mmap_mode="r"), **kwargs)
+
+   @classmethod
+   def load_or_build(cls, path: str = VECTORS_PATH, data_dir: str = PROCESSED_DATA_DIR, dims: int = DEFAULT_DIMS) -> "LocalClassifier":
+      '''Load the persisted vectors, rebuilding them if they are missing or older than the processed data'''
+      if os.path.exists(path):
+         sources = [os.path.join(data_dir, filename) for filename, _, _ in SOURCES]
+         newest_source = max((os.path.getmtime(p) for p in sources if os.path.exists(p)), default=0)
+         if os.path.getmtime(path) >= newest_source:
+            return cls.load(path)
+
+      cls.build(data_dir, dims).save(path)
+      return cls.load(path)
+
+   def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+      '''Sparse TF-IDF vector (feature indexes and L2 normalized values) of a text'''
+      indexes, values = hash_features(Counter(features(text)), self.dims)
+      return indexes, normalized(sublinear(values) * self.idf[indexes]).astype(np.float32)
+
+   def scores(self, job_posts: Sequence[Tuple[str, str]]) -> np.ndarray:
+      '''Cosine similarity of (title, description) job posts to every occupation, the title counts twice'''
+      scores = np.zeros((len(job_posts), self.vectors.shape[1]), dtype=np.float32)
+      for row, (title, description) in enumerate(job_posts):
+         indexes, values = self.vectorize(f"{title} {title} {description}")
+         # sparse query x dense matrix: only the rows of the query's features take part
+         scores[row] = values @ self.vectors[indexes]
+      return scores
+
+   def classify_batch(self, job_posts: Sequence[Tuple[str, str]], top_k: int = MAX_CLASSIFICATIONS) -> List[JobClassifications]:
+      '''Classify a batch of (title, description) job posts'''
+      if not job_posts:
+         return []
+
+      scores = self.scores(job_posts)
+      top_k = min(top_k, scores.shape[1])
+      top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+      top_scores = np.take_along_axis(scores, top, axis=1)
+      order = np.argsort(-top_scores, axis=1)
+      top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+      results = []
+      for candidates, candidate_scores in zip(top.tolist(), top_scores.tolist()):
+         best = candidate_scores[0]
+         selected = [(i, score) for i, score in zip(candidates, candidate_scores)
+                     if score >= self.min_score and score >= best * self.secondary_ratio]
+         classifications = [JobClassification(occupation_code=str(self.codes[i]), occupation_title=str(self.titles[i])) for i, _ in selected]
+
+         if classifications:
+            similarities = ", ".join(f"{self.titles[i]} {score:.2f}" for i, score in selected)
+            overall_explanation = f"Classified offline by similarity to O*NET occupations ({similarities})."
+         else:
+            overall_explanation = f"No O*NET occupation is similar enough to the job post (best similarity {best:.2f})."
+
+         results.append(JobClassifications(job_classifications=classifications, overall_explanation=overall_explanation))
+
+      return results
+
+   def classify(self, job_post_title: str, job_post_description: str) -> JobClassifications:
+      return self.classify_batch([(job_post_title, job_post_description)])[0]
+
+# the local classifier is loaded once per process and shared by the app and batch runs
+_classifier: Optional[LocalClassifier] = None
+
+def load_local_classifier(path: str = VECTORS_PATH, data_dir: str = PROCESSED_DATA_DIR) -> LocalClassifier:
+   global _classifier
+   if _classifier is None:
+      _classifier = LocalClassifier.load_or_build(path, data_dir)
+   return _classifier
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Build the local occupation vectors and classify a job post offline")
+   parser.add_argument("--data-dir", type=str, default=PROCESSED_DATA_DIR, help="Directory with the processed JSON Lines data")
+   parser.add_argument("--vectors", type=str, default=VECTORS_PATH, help="Path of the occupation vector matrix (.npy)")
+   parser.add_argument("--dims", type=int, default=DEFAULT_DIMS, help=f"Number of hashed feature dimensions (default: {DEFAULT_DIMS})")
+   parser.add_argument("--benchmark", type=int, default=0, metavar="N", help="Classify N O*NET sample titles and report the throughput")
+   parser.add_argument("query", type=str, nargs="?", default=None, help="Job post text to classify")
+   return parser.parse_args()
+
+def main(args) -> None:
+
+   start_time = time.perf_counter()
+   LocalClassifier.build(args.data_dir, args.dims).save(args.vectors)
+   print(f"Built occupation vectors in {time.perf_counter() - start_time:.2f} seconds")
+
+   start_time = time.perf_counter()
+   classifier = LocalClassifier.load(args.vectors)
+   print(f"Loaded {classifier.vectors.shape[0]} x {classifier.vectors.shape[1]} matrix in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+   if args.query:
+      start_time = time.perf_counter()
+      result = classifier.classify(args.query, "")
+      print(f"Classified in {(time.perf_counter() - start_time) * 1000:.2f} ms")
+      print(result.json(indent=2))
+
+   if args.benchmark:
+      samples = list(read_jsonl(os.path.join(args.data_dir, "occupation_sample_titles.json")))[:args.benchmark]
+      job_posts = [(s["sample_job_title"], "") for s in samples]
+
+      start_time = time.perf_counter()
+      results = []
+      for i in range(0, len(job_posts), 1000):
+         results.extend(classifier.classify_batch(job_posts[i:i + 1000]))
+      elapsed = time.perf_counter() - start_time
+
+      correct = sum(any(c.occupation_code == s["occupation_code"] for c in r.job_classifications) for s, r in zip(samples, results))
+      print(f"Classified {len(job_posts)} job posts in {elapsed:.2f} seconds ({len(job_posts) / elapsed:.0f} posts/s), accuracy {correct / len(job_posts):.3f}")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
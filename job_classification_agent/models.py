@@ -0,0 +1,37 @@
+from typing import List, Optional
+
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+
+class JobClassification (BaseModel):
+   occupation_code: str = Field(description="O*NET 28 occupation code", pattern=r'(\d{2}-\d{4}\.\d{2})', examples=["15-2051.00"])
+   occupation_title: str = Field(description="O*NET 28 occupation title", max_length=120, examples=["Data Scientists"])
+   explanation: Optional[str] = Field(description="explanation from Agent for occupation classification", max_length=1000, default=None)
+
+   @property
+   def occupation_link(self) -> str:
+      return f'https://www.onetonline.org/link/summary/{self.occupation_code}'
+
+
+class RepairedJobClassification(JobClassification):
+   """A classification whose occupation title or code was repaired from the knowledge base by post-processing (not part of the assistant's output format)"""
+   repair_confidence: float = Field(description="confidence that the repaired occupation is the one the assistant meant", ge=0, le=1)
+   repaired_from: str = Field(description="occupation code and title returned by the assistant")
+
+
+class JobClassifications(BaseModel):
+   job_classifications: List[JobClassification] = Field(description="List of Job Classifications", min_items=0, max_items=3)
+   overall_explanation: Optional[str] = Field(description="Overall explanation from Agent for all occupation classifications", max_length=1000, default=None)
+
+
+class PackedJobClassification(JobClassifications):
+   post_id: str = Field(description="id of the job post the classifications are for", examples=["1"])
+
+
+class PackedJobClassifications(BaseModel):
+   results: List[PackedJobClassification] = Field(description="Job Classifications of each job post, one result per job post")
+
+
+class MajorGroupSelection(BaseModel):
+   major_groups: List[str] = Field(description="Two digit SOC major group codes of the job post, most likely first", min_items=0, max_items=3, examples=[["15", "11"]])
+   explanation: Optional[str] = Field(description="short explanation of the selection", max_length=300, default=None)
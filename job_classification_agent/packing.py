@@ -0,0 +1,105 @@
+'''Multi-post packing: classify several job posts in a single assistant run
+
+Every single-post run repeats the prompt instructions, the format instructions, the
+knowledge base retrieval and the run overhead.  A packed run sends N job posts in one
+message, each tagged with a short id (1..N), and asks for a list of JobClassifications
+keyed by post id (PackedJobClassifications).  The answer is split per post and every
+post's classifications are validated and post-processed as in single-post mode.  Job
+posts that are missing from the answer or have an invalid result are classified again
+with single-post runs by the caller (see BatchClassifier.classify_pack).
+'''
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from langchain.output_parsers import PydanticOutputParser
+
+from job_classification_agent.models import JobClassifications, PackedJobClassifications
+from job_classification_agent.chain import post_process, to_job_classifications
+from job_classification_agent.json_stream import loads_tolerant
+from job_classification_agent.tracing import current_span, tracer
+
+PACKED_PROMPT_TEMPLATE = """Classify each of the following job posts into one or more O*NET 28 classifications described in the provided knowledge base.
+Classify every job post on its own, independently of the other job posts, and return exactly one result per job post with its post_id.
+You can only include a classification if the job post strongly suggests that the occupation is part of that classification.
+Don't include source references.
+Consider the career pathway and clusters associated with the occupation in the knowledge base when making classification decisions.
+Consider sample and alternate job titles associated with occupations in the knowledge base when making classification decisions.
+Prioritize technical/hard skill matches over soft skill matches.
+Do not makeup O*NET occupations not described in the provided knowledge base.
+If there are no clear O*NET 28 classifications for a job post, please indicate that in the overall_explanation of its result.
+
+Format instructions: {format_instructions}
+
+Agent should include explanations: {include_explanation}
+
+Additional hints: {hints}
+
+Job posts (candidate occupations are pre-selected from the knowledge base, prefer these when one of them fits the job post):
+{job_posts}
+"""
+
+DEFAULT_PACK_SIZE = 5
+
+packed_parser = PydanticOutputParser(pydantic_object=PackedJobClassifications)
+
+# a job post of a pack: (post id, title, description, candidate occupations)
+PackedPost = Tuple[str, str, str, Optional[str]]
+
+def build_packed_prompt(prompt_template: str = PACKED_PROMPT_TEMPLATE, include_explanation: bool = True, hints: Optional[str] = None) -> ChatPromptTemplate:
+   '''Build the packed classification prompt with the format instructions filled in'''
+   return ChatPromptTemplate.from_template(
+      prompt_template,
+      partial_variables={
+         "format_instructions": packed_parser.get_format_instructions(),
+         "include_explanation": include_explanation,
+         "hints": hints if hints else "N/A"
+      })
+
+def format_job_posts(posts: Iterable[PackedPost]) -> str:
+   '''Format the job posts of a pack for the {job_posts} prompt variable'''
+   blocks = []
+   for post_id, title, description, candidate_occupations in posts:
+      block = f'<job_post post_id="{post_id}">\njob post title: {title}\njob post description: {description}\n'
+      if candidate_occupations:
+         block += f"candidate occupations: {candidate_occupations}\n"
+      blocks.append(block + "</job_post>")
+   return "\n".join(blocks)
+
+@tracer.traced("format_prompt")
+def build_packed_input(prompt: ChatPromptTemplate, posts: List[PackedPost]) -> dict:
+   '''Build the assistant input for a pack of job posts'''
+   return {"content": prompt.format(job_posts=format_job_posts(posts))}
+
+@tracer.traced()
+def parse_packed_output(output: OpenAIAssistantFinish) -> Dict[str, JobClassifications]:
+   '''Split a packed assistant answer into the post-processed JobClassifications of each post id
+
+   Results without a post id or with an invalid structure are left out, so that their
+   job posts can be classified again on their own.
+   '''
+   obj = loads_tolerant(output.return_values.get('output'))
+   if not isinstance(obj, dict):
+      raise ValueError(f"Expected a JSON object from the assistant, got {type(obj).__name__}")
+
+   items: List[Any] = obj.get("results") or []
+   results = {}
+   for item in items:
+      if not isinstance(item, dict) or item.get("post_id") is None:
+         continue
+      try:
+         results[str(item["post_id"])] = post_process(to_job_classifications(item))
+      except ValueError:
+         continue
+
+   span = current_span()
+   if span is not None:
+      span.set(results=len(results), invalid_results=len(items) - len(results))
+
+   return results
+
+def build_packed_chain(agent: Runnable) -> Runnable:
+   '''Create the packed classification chain (assistant | parse_packed_output) for an assistant runnable'''
+   return agent | parse_packed_output
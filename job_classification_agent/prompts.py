@@ -0,0 +1,26 @@
+'''Prompt templates of the Job Classification Assistant
+
+Kept free of langchain imports, so the app can render its prompt editor before the
+chain is loaded.
+'''
+
+DEFAULT_PROMPT_TEMPLATE = """Classify the following job post into one or more O*NET 28 classifications described in the provided knowledge base.
+You can only include a classification if the job post strongly suggests that the occupation is part of that classification.
+Don't include source references.
+Consider the career pathway and clusters associated with the occupation in the knowledge base when making classification decisions.
+Consider sample and alternate job titles associated with occupations in the knowledge base when making classification decisions.
+Prioritize technical/hard skill matches over soft skill matches.  
+Do not makeup O*NET occupations not described in the provided knowledge base.
+If there are no clear O*NET 28 classifications, please indicate that in the overall_explanation.
+
+Format instructions: {format_instructions}
+
+Agent should include explanations: {include_explanation}
+
+Candidate occupations (pre-selected from the knowledge base, prefer these when one of them fits the job post): {candidate_occupations}
+
+Additional hints: {hints}
+
+job post title: {job_post_title}
+job post description: {job_post_description}
+"""
@@ -0,0 +1,151 @@
+'''Record and replay assistant responses
+
+RecordingAssistantRunnable wraps the assistant runnable of the chain (TracedAssistantRunnable
+or PooledAssistantRunnable) and stores the answer of every run in a JSON Lines file, keyed by
+the assistant id and the message content (i.e. the rendered prompt).  Replaying the file
+returns the stored answers without calling the API, so the rest of the chain (parse_output,
+post_process, the fast path, the shortlist) runs deterministically and offline, e.g. to
+evaluate post-processing changes against a labeled set (see evaluation.py).  A change to the
+prompt, the hints or the assistant changes the key and needs a new recording.
+
+Every recording keeps the run's model, token usage and duration; replayed runs are traced as
+`assistant.run` spans with the recorded duration and usage (attribute replayed=True).
+
+Modes:
+
+- record: always run the assistant and store its answer
+- replay: only return stored answers, a missing answer raises ReplayMiss
+- auto: return stored answers, run the assistant and store the answer for the others
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, read_jsonl
+from job_classification_agent.tracing import tracer
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(PROCESSED_DATA_DIR), "recordings", "assistant_responses.jsonl")
+
+MODES = ("record", "replay", "auto")
+
+class ReplayMiss(LookupError):
+   '''No recorded answer for an assistant input in replay mode'''
+
+def recording_key(assistant_id: str, content: str) -> str:
+   return hashlib.sha256(f"{assistant_id}\n{content}".encode("utf-8")).hexdigest()
+
+@dataclass
+class Recording:
+   key: str
+   assistant_id: str
+   output: str
+   model: Optional[str] = None
+   usage: Dict[str, int] = field(default_factory=dict)
+   duration: float = 0.0
+   run_id: Optional[str] = None
+   recorded_at: float = 0.0
+
+class RecordingStore:
+   '''Recorded assistant answers, loaded from and appended to a JSON Lines file (later recordings of a key win)'''
+
+   def __init__(self, path: str = RECORDINGS_PATH):
+      self.path = path
+      self.recordings: Dict[str, Recording] = {}
+      if os.path.exists(path):
+         for record in read_jsonl(path):
+            self.recordings[record["key"]] = Recording(**record)
+      self._lock = threading.Lock()
+
+   def get(self, key: str) -> Optional[Recording]:
+      return self.recordings.get(key)
+
+   def add(self, recording: Recording) -> None:
+      with self._lock:
+         os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+         with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(recording)) + "\n")
+         self.recordings[recording.key] = recording
+
+   def __len__(self) -> int:
+      return len(self.recordings)
+
+@dataclass
+class RecordingStats:
+   replayed: int = 0
+   recorded: int = 0
+   missed: int = 0
+
+def usage_dict(run: Any) -> Dict[str, int]:
+   usage = getattr(run, "usage", None)
+   if usage is None:
+      return {}
+   return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens, "total_tokens": usage.total_tokens}
+
+class RecordingAssistantRunnable(Runnable):
+   '''Assistant runnable that records its answers to a RecordingStore or replays them from it
+
+   Recording fetches the finished run once more (one API call per run) for its model and token usage.
+   Replay mode needs no assistant runnable (and no API key).
+   '''
+
+   def __init__(self, assistant_id: str, store: RecordingStore, mode: str = "auto", agent: Optional[Runnable] = None):
+      assert mode in MODES, f"mode must be one of {', '.join(MODES)}"
+      assert agent is not None or mode == "replay", "an assistant runnable is required to record"
+      self.assistant_id = assistant_id
+      self.store = store
+      self.mode = mode
+      self.agent = agent
+      self.stats = RecordingStats()
+
+   def _lookup(self, input: dict) -> tuple:
+      key = recording_key(self.assistant_id, input["content"])
+      recording = self.store.get(key) if self.mode != "record" else None
+      if recording is None and self.mode == "replay":
+         self.stats.missed += 1
+         raise ReplayMiss(f"no recorded answer for this input (key {key[:12]}) of assistant {self.assistant_id}")
+      return key, recording
+
+   def _replay(self, recording: Recording) -> OpenAIAssistantFinish:
+      self.stats.replayed += 1
+      tracer.record("assistant.run", time.time(), recording.duration, replayed=True, run_id=recording.run_id, **recording.usage)
+      return OpenAIAssistantFinish(return_values={"output": recording.output, "thread_id": "", "run_id": recording.run_id or ""},
+                                   log="", run_id=recording.run_id or "", thread_id="")
+
+   def _record(self, key: str, output: OpenAIAssistantFinish, run: Any, duration: float) -> None:
+      self.stats.recorded += 1
+      self.store.add(Recording(key=key, assistant_id=self.assistant_id, output=output.return_values.get("output"),
+                               model=getattr(run, "model", None), usage=usage_dict(run), duration=round(duration, 3),
+                               run_id=output.run_id, recorded_at=time.time()))
+
+   def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> OpenAIAssistantFinish:
+      key, recording = self._lookup(input)
+      if recording is not None:
+         return self._replay(recording)
+
+      start_time = time.perf_counter()
+      output = self.agent.invoke(input, config, **kwargs)
+      duration = time.perf_counter() - start_time
+      run = self.agent.client.beta.threads.runs.retrieve(output.run_id, thread_id=output.thread_id)
+      self._record(key, output, run, duration)
+      return output
+
+   async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> OpenAIAssistantFinish:
+      key, recording = self._lookup(input)
+      if recording is not None:
+         return self._replay(recording)
+
+      start_time = time.perf_counter()
+      output = await self.agent.ainvoke(input, config, **kwargs)
+      duration = time.perf_counter() - start_time
+      run = await self.agent.async_client.beta.threads.runs.retrieve(output.run_id, thread_id=output.thread_id)
+      self._record(key, output, run, duration)
+      return output
@@ -0,0 +1,318 @@
+'''Fuzzy repair of occupation titles and codes returned by the assistant
+
+post_process keeps classifications whose code and title match the knowledge base and
+repairs exact title or code matches; everything else used to be dropped.  The repair
+index resolves the rest: near-miss titles ("Software Developer, Application",
+"Data Scientist") and malformed codes ("15-1252", "151252.00", "15-1253.00").
+
+- malformed codes that normalize to a known code ("151252" -> "15-1252.00") are a candidate
+  repair, more confident the more the assistant's title resembles that occupation's titles
+- every O*NET title, sample title and alternate title is scored by the Dice
+  similarity of its character trigrams with the assistant's title, and every occupation
+  by the proximity of its code to the assistant's code (same O*NET-SOC occupation, broad
+  group, minor group or major group)
+
+The most confident candidate wins if its confidence reaches the threshold.  A title
+repair must beat the best other occupation by a margin, and without code evidence a
+title is not repaired when it is part of the titles of many other occupations: "Nurse"
+or "Manager" name a family of occupations, not one of them.
+
+The trigram index is an inverted index (trigram -> title entries) persisted as numpy
+arrays in data/index/repair_trigrams.npz, rebuilt when the processed data is newer.  A
+repair takes well under a millisecond.
+
+usage: python -m job_classification_agent.repair [-h] [--data-dir DATA_DIR] [--index INDEX] [--benchmark N] [--code CODE] [title ...]
+'''
+
+import argparse
+import os
+import random
+import re
+import time
+
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from job_classification_agent.fast_path import SOURCES, normalize_job_title, title_variants
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, read_jsonl
+
+INDEX_PATH = os.path.join(os.path.dirname(PROCESSED_DATA_DIR), "index", "repair_trigrams.npz")
+
+# weights of the title similarity and of the code proximity in the repair confidence
+TITLE_WEIGHT = 0.7
+CODE_WEIGHT = 0.3
+
+# code proximity by the number of leading code digits shared with the assistant's code:
+# 2 major group, 3 minor group, 5 broad occupation, 6 detailed SOC occupation, 8 O*NET-SOC occupation
+PROXIMITY_BY_PREFIX = np.array([0.0, 0.0, 0.2, 0.4, 0.4, 0.6, 0.8, 0.8, 1.0], dtype=np.float32)
+
+# confidence of a malformed code that normalizes to a known code, raised towards 1 by the similarity of the
+# assistant's title to the titles of that occupation
+NORMALIZED_CODE_CONFIDENCE = 0.5
+
+DEFAULT_MIN_CONFIDENCE = 0.5
+
+# minimum confidence difference between a title repair and the best repair to another occupation
+MIN_MARGIN = 0.03
+
+# a title without code evidence that is contained in the titles of more other SOC occupations is too generic to repair
+MAX_CONTAINING_OCCUPATIONS = 10
+
+# titles that name a family of occupations, the --benchmark checks that they are not repaired without a code
+GENERIC_TITLES = ("Manager", "Nurse", "Engineer", "Teacher", "Director", "Analyst", "Technician", "Specialist", "Consultant",
+                  "Assistant", "Clerk", "Driver", "Designer", "Mechanic", "Physician", "Counselor", "Supervisor", "Operator")
+
+_NON_DIGIT = re.compile(r"\D")
+
+def trigrams(normalized: str) -> List[str]:
+   '''Distinct character trigrams of a normalized title, padded with spaces'''
+   padded = f" {normalized} "
+   return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+def code_digits(occupation_code: Optional[str]) -> str:
+   return _NON_DIGIT.sub("", occupation_code or "")[:8]
+
+def normalize_occupation_code(occupation_code: Optional[str]) -> Optional[str]:
+   '''Format the digits of a code as an O*NET-SOC code ("151252" -> "15-1252.00"), None if there are not 6 or 8 digits'''
+   digits = _NON_DIGIT.sub("", occupation_code or "")
+   if len(digits) == 6:
+      digits += "00"
+   if len(digits) != 8:
+      return None
+   return f"{digits[:2]}-{digits[2:6]}.{digits[6:]}"
+
+class Repair(NamedTuple):
+   occupation_code: str
+   occupation_title: str
+   matched_title: Optional[str]
+   confidence: float
+   title_similarity: float
+   code_proximity: float
+
+class RepairIndex:
+   '''Character trigram index of O*NET titles with the codes of their occupations'''
+
+   def __init__(self, codes: np.ndarray, titles: np.ndarray, entry_codes: np.ndarray, entry_titles: np.ndarray, entry_weights: np.ndarray,
+                entry_lengths: np.ndarray, vocab: np.ndarray, offsets: np.ndarray, entry_ids: np.ndarray):
+      self.codes = codes
+      self.titles = titles
+      self.entry_codes = entry_codes
+      self.entry_titles = entry_titles
+      self.entry_weights = entry_weights
+      self.entry_lengths = entry_lengths
+      self.vocab = vocab
+      self.offsets = offsets
+      self.entry_ids = entry_ids
+      self.trigrams: Dict[str, int] = {gram: i for i, gram in enumerate(vocab.tolist())}
+      self.code_index: Dict[str, int] = {code: i for i, code in enumerate(codes.tolist())}
+      # the 8 code digits of every occupation, for vectorized common prefix lengths
+      self.digits = np.array([[int(d) for d in code_digits(code)] for code in codes.tolist()], dtype=np.int8).reshape(len(codes), 8)
+
+   @classmethod
+   def build(cls, data_dir: str = PROCESSED_DATA_DIR) -> "RepairIndex":
+      '''Build the index from the processed JSON Lines files (title files that are missing are skipped)'''
+      occupations = {record["occupation_code"]: record["occupation_title"]
+                     for record in read_jsonl(os.path.join(data_dir, "occupation_descriptions.json"))}
+
+      # (normalized title, occupation code) -> (matched title, weight)
+      entries = {}
+      for filename, title_field, weight in SOURCES:
+         path = os.path.join(data_dir, filename)
+         if not os.path.exists(path):
+            continue
+         for record in read_jsonl(path):
+            code = record["occupation_code"]
+            # only repair to occupations of the knowledge base
+            if code not in occupations:
+               continue
+            for key in title_variants(record[title_field]):
+               if entries.get((key, code), (None, 0.0))[1] < weight:
+                  entries[(key, code)] = (record[title_field], weight)
+
+      codes = sorted(occupations)
+      code_ids = {code: i for i, code in enumerate(codes)}
+      keys = sorted(entries)
+
+      postings = defaultdict(list)
+      lengths = []
+      for entry_id, (key, _) in enumerate(keys):
+         grams = trigrams(key)
+         lengths.append(len(grams))
+         for gram in grams:
+            postings[gram].append(entry_id)
+
+      vocab = sorted(postings)
+      offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+      offsets[1:] = np.cumsum([len(postings[gram]) for gram in vocab])
+
+      return cls(codes=np.array(codes),
+                 titles=np.array([occupations[code] for code in codes]),
+                 entry_codes=np.array([code_ids[code] for _, code in keys], dtype=np.int32),
+                 entry_titles=np.array([entries[key][0] for key in keys]),
+                 entry_weights=np.array([entries[key][1] for key in keys], dtype=np.float32),
+                 entry_lengths=np.array(lengths, dtype=np.int32),
+                 vocab=np.array(vocab),
+                 offsets=offsets,
+                 entry_ids=np.array([entry_id for gram in vocab for entry_id in postings[gram]], dtype=np.int32))
+
+   def save(self, path: str = INDEX_PATH) -> None:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      np.savez(path, codes=self.codes, titles=self.titles, entry_codes=self.entry_codes, entry_titles=self.entry_titles,
+               entry_weights=self.entry_weights, entry_lengths=self.entry_lengths, vocab=self.vocab, offsets=self.offsets,
+               entry_ids=self.entry_ids)
+
+   @classmethod
+   def load(cls, path: str = INDEX_PATH) -> "RepairIndex":
+      with np.load(path, allow_pickle=False) as data:
+         return cls(**{name: data[name] for name in data.files})
+
+   @classmethod
+   def load_or_build(cls, path: str = INDEX_PATH, data_dir: str = PROCESSED_DATA_DIR) -> "RepairIndex":
+      '''Load the persisted index, rebuilding it if it is missing or older than the processed data'''
+      if os.path.exists(path):
+         sources = [os.path.join(data_dir, filename) for filename, _, _ in SOURCES]
+         newest_source = max((os.path.getmtime(p) for p in sources if os.path.exists(p)), default=0)
+         if os.path.getmtime(path) >= newest_source:
+            return cls.load(path)
+
+      index = cls.build(data_dir)
+      index.save(path)
+      return index
+
+   def shared_trigrams(self, title: str) -> Tuple[np.ndarray, int]:
+      '''Number of the title's trigrams in every entry, and the number of the title's trigrams'''
+      grams = [self.trigrams.get(gram) for gram in trigrams(normalize_job_title(title))]
+      ids = [i for i in grams if i is not None]
+      if not ids:
+         return np.zeros(len(self.entry_codes), dtype=np.int64), len(grams)
+      # every entry appears at most once in a posting list, so the counts are the shared trigrams
+      return np.bincount(np.concatenate([self.entry_ids[self.offsets[i]:self.offsets[i + 1]] for i in ids]), minlength=len(self.entry_codes)), len(grams)
+
+   def title_similarities(self, title: str) -> np.ndarray:
+      '''Dice similarity of the title's trigrams with every entry, times the entry's source weight'''
+      return self._similarities(*self.shared_trigrams(title))
+
+   def _similarities(self, shared: np.ndarray, length: int) -> np.ndarray:
+      return (2 * shared / (length + self.entry_lengths)).astype(np.float32) * self.entry_weights
+
+   def code_proximities(self, occupation_code: Optional[str]) -> np.ndarray:
+      '''Proximity of every occupation's code to a (possibly malformed) code, from their common leading digits'''
+      digits = code_digits(occupation_code)
+      if len(digits) < 2:
+         return np.zeros(len(self.codes), dtype=np.float32)
+      query = np.array([int(d) for d in digits], dtype=np.int8)
+      common = np.cumprod(self.digits[:, :len(query)] == query, axis=1).sum(axis=1)
+      return PROXIMITY_BY_PREFIX[common]
+
+   def containing_occupations(self, entries: np.ndarray, shared: np.ndarray, length: int, occupation_code: str) -> int:
+      '''Number of SOC occupations other than occupation_code's with one of the entries containing all trigrams of a title'''
+      codes = self.codes[np.unique(self.entry_codes[entries[shared[entries] == length]])].tolist()
+      return len({code[:7] for code in codes} - {occupation_code[:7]})
+
+   def repair(self, occupation_title: Optional[str], occupation_code: Optional[str], min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> Optional[Repair]:
+      '''Find the occupation the assistant most likely meant, or None if no repair reaches min_confidence'''
+      shared, length = self.shared_trigrams(occupation_title or "")
+      similarities = self._similarities(shared, length)
+      best_repair = None
+
+      normalized_code = normalize_occupation_code(occupation_code)
+      if normalized_code is not None and normalized_code in self.code_index:
+         code_id = self.code_index[normalized_code]
+         entries = np.flatnonzero(self.entry_codes == code_id)
+         entry = entries[np.argmax(similarities[entries])] if len(entries) else None
+         similarity = float(similarities[entry]) if entry is not None else 0.0
+         best_repair = Repair(normalized_code, str(self.titles[code_id]), str(self.entry_titles[entry]) if similarity > 0 else None,
+                              round(NORMALIZED_CODE_CONFIDENCE + (1 - NORMALIZED_CODE_CONFIDENCE) * similarity, 3), round(similarity, 3), 1.0)
+
+      candidates = np.flatnonzero(similarities)
+      if len(candidates):
+         proximities = self.code_proximities(occupation_code)[self.entry_codes[candidates]]
+         confidences = TITLE_WEIGHT * similarities[candidates] + CODE_WEIGHT * proximities
+         best = int(np.argmax(confidences))
+         entry = candidates[best]
+         code_id = self.entry_codes[entry]
+         others = confidences[self.entry_codes[candidates] != code_id]
+         ambiguous = len(others) > 0 and confidences[best] - others.max() < MIN_MARGIN
+         if not ambiguous and proximities[best] == 0:
+            ambiguous = self.containing_occupations(candidates, shared, length, str(self.codes[code_id])) > MAX_CONTAINING_OCCUPATIONS
+         if not ambiguous and (best_repair is None or confidences[best] > best_repair.confidence):
+            best_repair = Repair(str(self.codes[code_id]), str(self.titles[code_id]), str(self.entry_titles[entry]),
+                                 round(float(confidences[best]), 3), round(float(similarities[entry]), 3), round(float(proximities[best]), 3))
+
+      if best_repair is None or best_repair.confidence < min_confidence:
+         return None
+      return best_repair
+
+# the repair index is loaded once per process and shared by the app and batch runs
+_index: Optional[RepairIndex] = None
+
+def load_repair_index(path: str = INDEX_PATH, data_dir: str = PROCESSED_DATA_DIR) -> RepairIndex:
+   global _index
+   if _index is None:
+      _index = RepairIndex.load_or_build(path, data_dir)
+   return _index
+
+def perturb(title: str, rng: random.Random) -> str:
+   '''A near-miss of a title: a dropped, swapped or repeated character, or a dropped plural'''
+   if title.endswith("s") and rng.random() < 0.3:
+      return title[:-1]
+   i = rng.randrange(max(1, len(title) - 1))
+   kind = rng.choice(("drop", "swap", "repeat"))
+   if kind == "drop":
+      return title[:i] + title[i + 1:]
+   if kind == "swap":
+      return title[:i] + title[i + 1:i + 2] + title[i:i + 1] + title[i + 2:]
+   return title[:i] + title[i] + title[i:]
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Build the occupation repair index and repair test titles")
+   parser.add_argument("--data-dir", type=str, default=PROCESSED_DATA_DIR, help="Directory with the processed JSON Lines data")
+   parser.add_argument("--index", type=str, default=INDEX_PATH, help="Path of the persisted index (.npz)")
+   parser.add_argument("--code", type=str, default=None, help="Occupation code returned with the titles")
+   parser.add_argument("--benchmark", type=int, default=0, metavar="N", help="Repair N perturbed occupation titles and report the latency and accuracy")
+   parser.add_argument("titles", type=str, nargs="*", help="Occupation titles to repair")
+   return parser.parse_args()
+
+def main(args) -> None:
+
+   start_time = time.perf_counter()
+   index = RepairIndex.build(args.data_dir)
+   index.save(args.index)
+   print(f"Indexed {len(index.entry_codes)} titles of {len(index.codes)} occupations ({len(index.vocab)} trigrams) in {time.perf_counter() - start_time:.2f} seconds")
+
+   start_time = time.perf_counter()
+   index = RepairIndex.load(args.index)
+   print(f"Loaded {args.index} in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+   for title in args.titles:
+      repair = index.repair(title, args.code)
+      if repair is None:
+         print(f"{title!r}: no repair")
+      else:
+         print(f"{title!r}: {repair.occupation_code} {repair.occupation_title} (matched {repair.matched_title!r}, confidence {repair.confidence:.2f}, "
+               f"title similarity {repair.title_similarity:.2f}, code proximity {repair.code_proximity:.1f})")
+
+   if args.benchmark:
+      rng = random.Random(0)
+      samples = [rng.randrange(len(index.codes)) for _ in range(args.benchmark)]
+      queries = [(perturb(str(index.titles[i]), rng), str(index.codes[i])) for i in samples]
+      latencies, repaired, correct = [], 0, 0
+      for title, code in queries:
+         start_time = time.perf_counter()
+         repair = index.repair(title, None)
+         latencies.append(time.perf_counter() - start_time)
+         repaired += repair is not None
+         correct += repair is not None and repair.occupation_code == code
+      latencies.sort()
+      print(f"{len(queries)} perturbed titles without a code: repaired {repaired / len(queries):.3f}, correct {correct / len(queries):.3f}, "
+            f"latency p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, p99 {latencies[int(0.99 * (len(latencies) - 1))] * 1000:.3f} ms")
+
+      generic = [(title, index.repair(title, None)) for title in GENERIC_TITLES]
+      wrong = [f"{title} -> {repair.occupation_code} {repair.occupation_title}" for title, repair in generic if repair is not None]
+      print(f"{len(generic)} generic titles without a code: repaired {len(wrong)} (expected none)" + "".join(f"\n  {line}" for line in wrong))
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
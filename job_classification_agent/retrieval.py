@@ -0,0 +1,209 @@
+'''Local lexical (BM25) retrieval of candidate occupations for a job post
+
+The index has one document per occupation, combining the occupation title and
+description with the sample titles, alternate titles, task statements and
+technology skills written by scripts/prepare_data.py (files that are missing
+are skipped).  The BM25 weight of every (term, occupation) pair is computed at
+build time and stored as a compressed sparse row matrix in a .npz file, so a
+query is a handful of numpy slice additions followed by a top-K selection.
+
+usage: python -m job_classification_agent.retrieval [-h] [--data-dir DATA_DIR] [--index INDEX] [--top-k TOP_K] [query]
+'''
+
+import argparse
+import math
+import os
+import re
+import time
+
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from job_classification_agent.taxonomy import PROCESSED_DATA_DIR, read_jsonl
+
+INDEX_PATH = os.path.join(os.path.dirname(PROCESSED_DATA_DIR), "index", "occupation_bm25.npz")
+
+# processed file, text field and term weight of each source that contributes to an occupation document
+SOURCES = [
+   ("occupation_descriptions.json", "occupation_title", 3),
+   ("occupation_descriptions.json", "occupation_description", 1),
+   ("occupation_sample_titles.json", "sample_job_title", 2),
+   ("occupation_alternate_titles.json", "alternate_job_title", 2),
+   ("occupation_task_statements.json", "task_statement", 1),
+   ("occupation_technology_skills.json", "technology", 1),
+]
+
+STOP_WORDS = frozenset("""a an and are as at be by for from has have in is it its may of on or such that the their this
+to will with within who we you your our us all other including job work position""".split())
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#]*")
+
+def stem(token: str) -> str:
+   '''Strip simple plurals so that "nurse" matches "Registered Nurses"'''
+   if len(token) > 4 and token.endswith("ies"):
+      return token[:-3] + "y"
+   if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+      return token[:-1]
+   return token
+
+def tokenize(text: str) -> List[str]:
+   '''Lowercase, stemmed word tokens (keeps '+' and '#' so C++ and C# survive), without stop words'''
+   return [stem(t) for t in _TOKEN.findall(text.lower()) if t not in STOP_WORDS] if text else []
+
+class Candidate(NamedTuple):
+   occupation_code: str
+   occupation_title: str
+   score: float
+
+class OccupationRetriever:
+   '''BM25 index over O*NET occupations'''
+
+   def __init__(self, codes: np.ndarray, titles: np.ndarray, vocab: np.ndarray, offsets: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray):
+      self.codes = codes
+      self.titles = titles
+      self.vocab = vocab
+      self.offsets = offsets
+      self.doc_ids = doc_ids
+      self.weights = weights
+      self.terms: Dict[str, int] = {term: i for i, term in enumerate(vocab.tolist())}
+
+   @classmethod
+   def build(cls, data_dir: str = PROCESSED_DATA_DIR, k1: float = 1.2, b: float = 0.75) -> "OccupationRetriever":
+      '''Build the index from the processed JSON Lines files'''
+      occupations = {}
+      term_counts = defaultdict(Counter)
+
+      for filename, text_field, weight in SOURCES:
+         path = os.path.join(data_dir, filename)
+         if not os.path.exists(path):
+            continue
+         for record in read_jsonl(path):
+            code = record["occupation_code"]
+            occupations.setdefault(code, record["occupation_title"])
+            counts = term_counts[code]
+            for term in tokenize(record.get(text_field)):
+               counts[term] += weight
+
+      codes = sorted(occupations)
+      doc_lengths = np.array([sum(term_counts[code].values()) for code in codes], dtype=np.float64)
+      avg_length = doc_lengths.mean() if len(codes) else 0.0
+
+      postings = defaultdict(list)
+      for doc_id, code in enumerate(codes):
+         for term, tf in term_counts[code].items():
+            postings[term].append((doc_id, tf))
+
+      vocab = sorted(postings)
+      offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+      doc_ids = []
+      weights = []
+      for i, term in enumerate(vocab):
+         docs = postings[term]
+         idf = math.log(1 + (len(codes) - len(docs) + 0.5) / (len(docs) + 0.5))
+         for doc_id, tf in docs:
+            norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_length)
+            doc_ids.append(doc_id)
+            weights.append(idf * tf * (k1 + 1) / (tf + norm))
+         offsets[i + 1] = len(doc_ids)
+
+      return cls(codes=np.array(codes),
+                 titles=np.array([occupations[code] for code in codes]),
+                 vocab=np.array(vocab),
+                 offsets=offsets,
+                 doc_ids=np.array(doc_ids, dtype=np.int32),
+                 weights=np.array(weights, dtype=np.float32))
+
+   def save(self, path: str = INDEX_PATH) -> None:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      np.savez(path, codes=self.codes, titles=self.titles, vocab=self.vocab, offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights)
+
+   @classmethod
+   def load(cls, path: str = INDEX_PATH) -> "OccupationRetriever":
+      with np.load(path, allow_pickle=False) as data:
+         return cls(**{name: data[name] for name in data.files})
+
+   @classmethod
+   def load_or_build(cls, path: str = INDEX_PATH, data_dir: str = PROCESSED_DATA_DIR) -> "OccupationRetriever":
+      '''Load the persisted index, rebuilding it if it is missing or older than the processed data'''
+      if os.path.exists(path):
+         sources = [os.path.join(data_dir, filename) for filename, _, _ in SOURCES]
+         newest_source = max((os.path.getmtime(p) for p in sources if os.path.exists(p)), default=0)
+         if os.path.getmtime(path) >= newest_source:
+            return cls.load(path)
+
+      retriever = cls.build(data_dir)
+      retriever.save(path)
+      return retriever
+
+   def scores(self, text: str) -> np.ndarray:
+      '''BM25 score of every occupation for a query'''
+      scores = np.zeros(len(self.codes), dtype=np.float32)
+      for term, qtf in Counter(tokenize(text)).items():
+         i = self.terms.get(term)
+         if i is None:
+            continue
+         start, end = self.offsets[i], self.offsets[i + 1]
+         # each occupation appears at most once in a posting list, so fancy-index += is safe
+         scores[self.doc_ids[start:end]] += qtf * self.weights[start:end]
+      return scores
+
+   def search(self, text: str, top_k: int = 10) -> List[Candidate]:
+      '''Get the top_k highest scoring occupations for a query'''
+      scores = self.scores(text)
+      top_k = min(top_k, len(scores))
+      if top_k <= 0:
+         return []
+
+      top = np.argpartition(-scores, top_k - 1)[:top_k]
+      top = top[np.argsort(-scores[top], kind="stable")]
+      return [Candidate(str(self.codes[i]), str(self.titles[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+   def shortlist(self, job_post_title: str, job_post_description: str, top_k: int = 10) -> List[Candidate]:
+      '''Get candidate occupations for a job post (the title counts twice)'''
+      return self.search(f"{job_post_title} {job_post_title} {job_post_description}", top_k)
+
+def format_candidates(candidates: Iterable[Candidate]) -> str:
+   '''Format a candidate shortlist for the {candidate_occupations} prompt variable'''
+   lines = [f"- {c.occupation_code} {c.occupation_title}" for c in candidates]
+   return "\n" + "\n".join(lines) if lines else "N/A"
+
+# the retriever is loaded once per process and shared by the app and batch runs
+_retriever: Optional[OccupationRetriever] = None
+
+def load_retriever(path: str = INDEX_PATH, data_dir: str = PROCESSED_DATA_DIR) -> OccupationRetriever:
+   global _retriever
+   if _retriever is None:
+      _retriever = OccupationRetriever.load_or_build(path, data_dir)
+   return _retriever
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Build the local occupation retrieval index and run a test query")
+   parser.add_argument("--data-dir", type=str, default=PROCESSED_DATA_DIR, help="Directory with the processed JSON Lines data")
+   parser.add_argument("--index", type=str, default=INDEX_PATH, help="Path of the persisted index (.npz)")
+   parser.add_argument("--top-k", type=int, default=10, help="Number of candidate occupations to return (default: 10)")
+   parser.add_argument("query", type=str, nargs="?", default=None, help="Job post text to search for")
+   return parser.parse_args()
+
+def main(args) -> None:
+
+   start_time = time.perf_counter()
+   retriever = OccupationRetriever.build(args.data_dir)
+   retriever.save(args.index)
+   print(f"Indexed {len(retriever.codes)} occupations ({len(retriever.vocab)} terms, {len(retriever.weights)} postings) in {time.perf_counter() - start_time:.2f} seconds")
+
+   start_time = time.perf_counter()
+   retriever = OccupationRetriever.load(args.index)
+   print(f"Loaded {args.index} in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+   if args.query:
+      start_time = time.perf_counter()
+      candidates = retriever.search(args.query, args.top_k)
+      print(f"Searched in {(time.perf_counter() - start_time) * 1000:.2f} ms")
+      for c in candidates:
+         print(f"{c.score:8.2f}  {c.occupation_code}  {c.occupation_title}")
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
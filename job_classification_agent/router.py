@@ -0,0 +1,364 @@
+'''Route classifications across assistant tiers, escalate weak answers and hedge slow runs
+
+AssistantRouter holds a list of assistant tiers, cheapest first (e.g. assistants created
+with scripts/create_assistant.py on gpt-4o-mini and gpt-4o).  Every job post is classified
+by the first tier; the answer is escalated to the next tier when:
+
+- invalid: the answer is not valid JSON or some of its classifications fail validation
+- dropped: post_process dropped classifications (unknown occupations)
+- empty: the answer has no classifications
+- low_confidence: the first classification was repaired by post_process with a repair
+  confidence below min_confidence
+
+The answer of the last tier is returned as is (or, when it is invalid, the best answer of
+an earlier tier).  Failed runs and API errors are raised, not escalated, so callers retry
+them as before.
+
+With hedging, a second run of the same tier is started when the first run has not
+finished within the tier's latency budget: the 95th percentile of its recent run
+durations (after 20 runs) or a fixed delay.  The first answer wins; the slower run is
+cancelled (the asyncio task or polling thread is abandoned and the run is cancelled in
+the Assistants API).  Hedging costs about 5% more runs and cuts off the slowest runs.
+
+The router takes the assistant input ({"content": prompt}) and returns JobClassifications,
+so it replaces the whole chain (assistant | parse_output | post_process).
+
+Tiers are configured in a JSON file (ASSISTANT_TIERS environment variable or --tiers):
+
+   [{"name": "mini", "assistant_id": "asst_...", "model": "gpt-4o-mini"},
+    {"name": "4o", "assistant_id": "asst_...", "model": "gpt-4o"}]
+'''
+
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from job_classification_agent.chain import MAX_CLASSIFICATIONS, TracedAssistantRunnable, collect_started_runs, match_classifications, reset_started_runs, to_job_classifications
+from job_classification_agent.json_stream import loads_tolerant
+from job_classification_agent.models import JobClassifications
+from job_classification_agent.run_pool import PooledAssistantRunnable
+from job_classification_agent.tracing import current_span, tracer
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_REASONS = ("invalid", "dropped", "empty", "low_confidence")
+
+DEFAULT_MIN_CONFIDENCE = 0.7
+DEFAULT_HEDGE_PERCENTILE = 95
+
+# run statuses that can still be cancelled
+CANCELLABLE_RUN_STATUSES = ("queued", "in_progress", "requires_action")
+
+@dataclass
+class AssistantTier:
+   name: str
+   assistant_id: str
+   model: Optional[str] = None
+
+def load_tiers(path: str) -> List[AssistantTier]:
+   '''Read a JSON list of tiers, cheapest first'''
+   with open(path, encoding="utf-8") as f:
+      return [AssistantTier(**item) for item in json.load(f)]
+
+class LatencyBudget:
+   '''Hedge delay of a tier: a percentile of its recent run durations, or a fixed delay
+
+   Without a fixed delay, runs are not hedged until min_samples durations are observed.
+   '''
+
+   def __init__(self, percentile: float = DEFAULT_HEDGE_PERCENTILE, fixed: Optional[float] = None, min_samples: int = 20, window: int = 500):
+      self.percentile = percentile
+      self.fixed = fixed
+      self.min_samples = min_samples
+      self.durations: deque = deque(maxlen=window)
+      self._lock = threading.Lock()
+
+   def observe(self, duration: float) -> None:
+      with self._lock:
+         self.durations.append(duration)
+
+   def delay(self) -> Optional[float]:
+      if self.fixed is not None:
+         return self.fixed
+      with self._lock:
+         if len(self.durations) < self.min_samples:
+            return None
+         durations = sorted(self.durations)
+      return durations[min(len(durations) - 1, int(self.percentile / 100 * len(durations)))]
+
+@dataclass
+class RouterStats:
+   posts: int = 0
+   runs: Counter = field(default_factory=Counter)
+   answered: Counter = field(default_factory=Counter)
+   escalations: Counter = field(default_factory=Counter)
+   hedges: int = 0
+   hedge_wins: int = 0
+   cancelled_runs: int = 0
+
+   def format_summary(self) -> str:
+      answered = ", ".join(f"{tier} {count}" for tier, count in self.answered.items())
+      escalations = ", ".join(f"{reason} {count}" for reason, count in self.escalations.most_common()) or "none"
+      return (f"answered by tier: {answered or 'none'} | escalations: {escalations} | "
+              f"hedged runs: {self.hedges} ({self.hedge_wins} won), cancelled runs: {self.cancelled_runs}")
+
+def classification_confidence(classification: Any) -> float:
+   '''The repair confidence of a classification repaired by post_process, 1.0 for a valid one'''
+   confidence = getattr(classification, "repair_confidence", None)
+   return 1.0 if confidence is None else confidence
+
+def assess_answer(output: OpenAIAssistantFinish, min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> Tuple[Optional[JobClassifications], Optional[str]]:
+   '''Parse and post-process an assistant answer, returns the classifications (None if invalid) and the reason to escalate it (None to keep it)'''
+   with tracer.span("parse_output"):
+      try:
+         obj = loads_tolerant(output.return_values.get('output') or "")
+         parsed = to_job_classifications(obj)
+      except ValueError:  # includes json.JSONDecodeError
+         return None, "invalid"
+   with tracer.span("post_process"):
+      result, unmatched = match_classifications(parsed)
+
+   items = obj.get("job_classifications")
+   if isinstance(items, list) and len(parsed.job_classifications) < min(len(items), MAX_CLASSIFICATIONS):
+      return result, "invalid"
+   # duplicates merged after a repair are not dropped answers
+   if unmatched:
+      return result, "dropped"
+   if not result.job_classifications:
+      return result, "empty"
+   if classification_confidence(result.job_classifications[0]) < min_confidence:
+      return result, "low_confidence"
+   return result, None
+
+class AssistantRouter(Runnable):
+   '''Classify with the cheapest assistant tier, escalate weak answers to the next tier and optionally hedge slow runs'''
+
+   def __init__(self, tiers: List[AssistantTier], agents: List[Runnable], min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+                escalate_on: Tuple[str, ...] = ESCALATION_REASONS, hedge: bool = False, hedge_after: Optional[float] = None,
+                hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE, max_workers: int = 32):
+      assert tiers and len(tiers) == len(agents), "every tier needs an assistant runnable"
+      self.tiers = tiers
+      self.agents = agents
+      self.min_confidence = min_confidence
+      self.escalate_on = escalate_on
+      self.hedge = hedge
+      self.budgets = [LatencyBudget(percentile=hedge_percentile, fixed=hedge_after) for _ in tiers]
+      self.stats = RouterStats()
+      self._lock = threading.Lock()
+      # hedged synchronous runs poll in worker threads
+      self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged-runs") if hedge else None
+
+   @property
+   def assistant_id(self) -> str:
+      '''The assistant ids of the tiers (e.g. for cache keys)'''
+      return "+".join(tier.assistant_id for tier in self.tiers)
+
+   def _count(self, **counts) -> None:
+      with self._lock:
+         for name, value in counts.items():
+            setattr(self.stats, name, getattr(self.stats, name) + value)
+
+   def _count_by(self, counter: str, key: str) -> None:
+      with self._lock:
+         getattr(self.stats, counter)[key] += 1
+
+   def _escalation(self, output: OpenAIAssistantFinish) -> Tuple[Optional[JobClassifications], Optional[str]]:
+      result, reason = assess_answer(output, self.min_confidence)
+      if reason not in self.escalate_on and result is not None:
+         reason = None
+      span = current_span()
+      if span is not None and reason is not None:
+         span.set(escalation=reason)
+      return result, reason
+
+   def _finish(self, index: int, result: Optional[JobClassifications], best: Optional[Tuple[int, JobClassifications]],
+               reasons: List[str]) -> JobClassifications:
+      # best: the first escalated answer that had classifications, with the index of its tier
+      if result is None and best is not None:
+         index, result = best
+      if result is None:
+         raise ValueError(f"No valid answer from the assistant tiers ({', '.join(reasons)})")
+      self._count_by("answered", self.tiers[index].name)
+      return result
+
+   # -- hedged runs --
+
+   def _attempt(self, agent: Runnable, input: dict, runs: List[Any]) -> Tuple[OpenAIAssistantFinish, float]:
+      token = collect_started_runs(runs)
+      try:
+         start_time = time.perf_counter()
+         output = agent.invoke(input)
+         return output, time.perf_counter() - start_time
+      finally:
+         reset_started_runs(token)
+
+   async def _aattempt(self, agent: Runnable, input: dict, runs: List[Any]) -> Tuple[OpenAIAssistantFinish, float]:
+      token = collect_started_runs(runs)
+      try:
+         start_time = time.perf_counter()
+         output = await agent.ainvoke(input)
+         return output, time.perf_counter() - start_time
+      finally:
+         reset_started_runs(token)
+
+   def _cancel_runs(self, agent: Runnable, runs: List[Any]) -> None:
+      for run in runs:
+         try:
+            if run.status in CANCELLABLE_RUN_STATUSES:
+               agent.client.beta.threads.runs.cancel(run.id, thread_id=run.thread_id)
+               self._count(cancelled_runs=1)
+         except Exception as e:
+            logger.debug("could not cancel run %s: %s", run.id, e)
+
+   async def _acancel_runs(self, agent: Runnable, runs: List[Any]) -> None:
+      for run in runs:
+         try:
+            if run.status in CANCELLABLE_RUN_STATUSES:
+               await agent.async_client.beta.threads.runs.cancel(run.id, thread_id=run.thread_id)
+               self._count(cancelled_runs=1)
+         except Exception as e:
+            logger.debug("could not cancel run %s: %s", run.id, e)
+
+   def _run(self, index: int, input: dict) -> OpenAIAssistantFinish:
+      agent, budget = self.agents[index], self.budgets[index]
+      self._count_by("runs", self.tiers[index].name)
+      if not self.hedge:
+         return agent.invoke(input)
+
+      start_time = time.perf_counter()
+      attempts = [[]]
+      futures = [self._executor.submit(contextvars.copy_context().run, self._attempt, agent, input, attempts[0])]
+      done, _ = concurrent.futures.wait(futures, timeout=budget.delay())
+      if not done:
+         self._start_hedge()
+         attempts.append([])
+         futures.append(self._executor.submit(contextvars.copy_context().run, self._attempt, agent, input, attempts[1]))
+
+      winner, error, pending = None, None, set(futures)
+      while pending and winner is None:
+         done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+         for future in done:
+            if future.exception() is None and winner is None:
+               winner = future
+            error = error or future.exception()
+
+      # the abandoned run keeps its polling thread until the Assistants API reports it cancelled
+      for future, runs in zip(futures, attempts):
+         if future is not winner and not future.done():
+            future.cancel()
+            self._cancel_runs(agent, runs)
+      return self._hedged_result(budget, futures, winner, error, start_time)
+
+   async def _arun(self, index: int, input: dict) -> OpenAIAssistantFinish:
+      agent, budget = self.agents[index], self.budgets[index]
+      self._count_by("runs", self.tiers[index].name)
+      if not self.hedge:
+         return await agent.ainvoke(input)
+
+      start_time = time.perf_counter()
+      attempts = [[]]
+      tasks = [asyncio.ensure_future(self._aattempt(agent, input, attempts[0]))]
+      try:
+         done, _ = await asyncio.wait(tasks, timeout=budget.delay())
+         if not done:
+            self._start_hedge()
+            attempts.append([])
+            tasks.append(asyncio.ensure_future(self._aattempt(agent, input, attempts[1])))
+
+         winner, error, pending = None, None, set(tasks)
+         while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+               if task.exception() is None and winner is None:
+                  winner = task
+               error = error or task.exception()
+      finally:
+         for task, runs in zip(tasks, attempts):
+            if not task.done():
+               task.cancel()
+               await asyncio.gather(task, return_exceptions=True)
+               await self._acancel_runs(agent, runs)
+      return self._hedged_result(budget, tasks, winner, error, start_time)
+
+   def _start_hedge(self) -> None:
+      self._count(hedges=1)
+      span = current_span()
+      if span is not None:
+         span.set(hedged=True)
+
+   def _hedged_result(self, budget: LatencyBudget, attempts: list, winner: Any, error: Optional[BaseException], start_time: float) -> OpenAIAssistantFinish:
+      # the first run's duration, or how long it had run when it was cancelled (its duration is at least that)
+      primary = attempts[0]
+      if primary.done() and not primary.cancelled() and primary.exception() is None:
+         budget.observe(primary.result()[1])
+      elif primary is not winner:
+         budget.observe(time.perf_counter() - start_time)
+
+      if winner is None:
+         raise error
+      if winner is not primary:
+         self._count(hedge_wins=1)
+      return winner.result()[0]
+
+   # -- routing --
+
+   def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> JobClassifications:
+      self._count(posts=1)
+      best, reasons = None, []
+      for index, tier in enumerate(self.tiers):
+         with tracer.span("router.tier", tier=tier.name, model=tier.model):
+            result, reason = self._escalation(self._run(index, input))
+         if reason is None or index == len(self.tiers) - 1:
+            return self._finish(index, result, best, reasons + ([reason] if reason else []))
+         self._count_by("escalations", reason)
+         reasons.append(reason)
+         if best is None and result is not None:
+            best = (index, result)
+
+   async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> JobClassifications:
+      self._count(posts=1)
+      best, reasons = None, []
+      for index, tier in enumerate(self.tiers):
+         with tracer.span("router.tier", tier=tier.name, model=tier.model):
+            result, reason = self._escalation(await self._arun(index, input))
+         if reason is None or index == len(self.tiers) - 1:
+            return self._finish(index, result, best, reasons + ([reason] if reason else []))
+         self._count_by("escalations", reason)
+         reasons.append(reason)
+         if best is None and result is not None:
+            best = (index, result)
+
+def build_router(tiers: List[AssistantTier], reuse_threads: bool = False, client: Any = None, async_client: Any = None,
+                 trace_run_steps: bool = False, max_in_flight: Optional[int] = None, **kwargs) -> AssistantRouter:
+   '''Create an assistant runnable per tier (sharing one pair of OpenAI clients) and the router'''
+   agents: List[Runnable] = []
+   for tier in tiers:
+      if reuse_threads:
+         pool_kwargs = {"max_in_flight": max_in_flight} if max_in_flight else {}
+         agent = PooledAssistantRunnable(tier.assistant_id, client=client, async_client=async_client, **pool_kwargs)
+      else:
+         agent_kwargs = {key: value for key, value in (("client", client), ("async_client", async_client)) if value is not None}
+         agent = TracedAssistantRunnable(assistant_id=tier.assistant_id, as_agent=True, trace_run_steps=trace_run_steps, **agent_kwargs)
+      client, async_client = agent.client, agent.async_client
+      agents.append(agent)
+   return AssistantRouter(tiers, agents, **kwargs)
+
+# the router keeps the tiers' latency budgets, so the app shares one across sessions
+_router: Optional[Tuple[str, bool, AssistantRouter]] = None
+
+def load_router(tiers_path: str, hedge: bool = False) -> AssistantRouter:
+   global _router
+   if _router is None or _router[:2] != (tiers_path, hedge):
+      _router = (tiers_path, hedge, build_router(load_tiers(tiers_path), hedge=hedge))
+   return _router[2]
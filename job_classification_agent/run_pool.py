@@ -0,0 +1,312 @@
+'''Thread reuse, warm threads and adaptive polling for assistant runs
+
+OpenAIAssistantV2Runnable creates a new thread for every classification and polls
+the run at a fixed interval (1 second by default).  PooledAssistantRunnable instead:
+
+- reuses threads from a pool.  The job post is passed as an additional message of the
+  run and the run is created with a truncation strategy of the last message only, so
+  a run never sees the job posts classified before it on the same thread.  A thread
+  runs one run at a time and is retired after max_thread_uses runs.
+- keeps warm threads, pre-created ahead of demand, so runs never wait for a thread
+- polls adaptively: the first poll is scheduled near the shortest recently observed
+  run durations, later polls at intervals proportional to the run time so far,
+  instead of polling at a fixed interval from the start of the run
+- caps the number of in-flight runs across all callers (app sessions or batch workers)
+
+The runnable returns the same OpenAIAssistantFinish as OpenAIAssistantV2Runnable(as_agent=True),
+so it composes with parse_output and post_process.
+'''
+
+import asyncio
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+import openai
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from job_classification_agent.chain import RunStatusTimer, load_chain, parse_output, post_process, started_run
+from job_classification_agent.tracing import tracer
+
+# run statuses that are still running
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "cancelling")
+
+DEFAULT_MAX_IN_FLIGHT = 16
+DEFAULT_MAX_THREAD_USES = 50
+
+class AdaptivePoller:
+   '''Poll intervals tuned to the observed run durations
+
+   The first poll waits for the lower quantile of recent run durations (runs rarely
+   finish earlier), after that each interval is a fraction (ratio) of the time the run
+   has taken so far, between min_interval and max_interval.  This bounds the time
+   between the end of a run and its detection relative to the run duration, with few
+   polls for long runs.  Until enough runs are observed, initial_interval is used.
+   '''
+
+   def __init__(self, min_interval: float = 0.1, max_interval: float = 1.0, ratio: float = 0.25,
+                initial_interval: float = 0.5, quantile: float = 0.1, window: int = 200):
+      self.min_interval = min_interval
+      self.max_interval = max_interval
+      self.ratio = ratio
+      self.initial_interval = initial_interval
+      self.quantile = quantile
+      self.durations: deque = deque(maxlen=window)
+      self._lock = threading.Lock()
+
+   def observe(self, duration: float) -> None:
+      with self._lock:
+         self.durations.append(duration)
+
+   def first_delay(self) -> float:
+      with self._lock:
+         if len(self.durations) < 5:
+            return self.initial_interval
+         durations = sorted(self.durations)
+      return max(self.min_interval, durations[int(self.quantile * (len(durations) - 1))])
+
+   def delays(self):
+      '''Generate the delays before each poll of a run'''
+      elapsed = self.first_delay()
+      yield elapsed
+      while True:
+         interval = min(self.max_interval, max(self.min_interval, self.ratio * elapsed))
+         elapsed += interval
+         yield interval
+
+@dataclass
+class PoolStats:
+   runs: int = 0
+   polls: int = 0
+   round_trips: int = 0
+   threads_created: int = 0
+   threads_reused: int = 0
+   threads_retired: int = 0
+   waited_for_slot: float = 0.0
+
+   @property
+   def polls_per_run(self) -> float:
+      return self.polls / self.runs if self.runs else 0.0
+
+   @property
+   def round_trips_per_run(self) -> float:
+      return self.round_trips / self.runs if self.runs else 0.0
+
+class PooledAssistantRunnable(Runnable):
+   '''Assistant runnable that reuses pooled threads and polls adaptively (input {"content": prompt})'''
+
+   def __init__(self, assistant_id: str, client: Optional[openai.OpenAI] = None, async_client: Optional[openai.AsyncOpenAI] = None,
+                max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, warm_threads: int = 4, max_thread_uses: int = DEFAULT_MAX_THREAD_USES,
+                poller: Optional[AdaptivePoller] = None):
+      self.assistant_id = assistant_id
+      self.client = client or openai.OpenAI()
+      self.async_client = async_client or openai.AsyncOpenAI()
+      self.max_in_flight = max_in_flight
+      self.warm_threads = warm_threads
+      self.max_thread_uses = max_thread_uses
+      self.poller = poller or AdaptivePoller()
+      self.stats = PoolStats()
+
+      # idle threads as (thread_id, uses)
+      self._idle: List[Tuple[str, int]] = []
+      self._lock = threading.Lock()
+      self._slots = threading.BoundedSemaphore(max_in_flight)
+      self._async_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+      self._refilling = False
+      self._refill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm-threads")
+
+   # -- thread pool --
+
+   def _count(self, **counts) -> None:
+      with self._lock:
+         for name, value in counts.items():
+            setattr(self.stats, name, getattr(self.stats, name) + value)
+
+   def _take_idle(self) -> Optional[Tuple[str, int]]:
+      with self._lock:
+         return self._idle.pop() if self._idle else None
+
+   def _needs_refill(self) -> bool:
+      with self._lock:
+         if self._refilling or len(self._idle) >= self.warm_threads:
+            return False
+         self._refilling = True
+         return True
+
+   def _refill(self) -> None:
+      '''Create threads until warm_threads are idle (runs in the background)'''
+      try:
+         while True:
+            with self._lock:
+               missing = self.warm_threads - len(self._idle)
+            if missing <= 0:
+               break
+            thread_id = self.client.beta.threads.create().id
+            self._count(threads_created=1, round_trips=1)
+            with self._lock:
+               self._idle.append((thread_id, 0))
+      finally:
+         with self._lock:
+            self._refilling = False
+
+   def warm(self) -> None:
+      '''Pre-create the warm threads now (e.g. before a batch starts)'''
+      if self._needs_refill():
+         self._refill()
+
+   def _acquire_thread(self) -> Tuple[Optional[str], int]:
+      # None: no idle thread, the run creates its thread with create_and_run (one round trip either way)
+      thread = self._take_idle()
+      if self._needs_refill():
+         self._refill_executor.submit(self._refill)
+      if thread is None:
+         return None, 0
+      self._count(threads_reused=1)
+      return thread
+
+   def _release_thread(self, thread_id: str, uses: int, run_status: Optional[str]) -> None:
+      # run_status is the status of the thread's last run, None when the run could not be created
+      # a thread whose run did not finish cannot take a new run, and long threads are retired
+      if run_status in ACTIVE_RUN_STATUSES or uses >= self.max_thread_uses:
+         self._count(threads_retired=1)
+         return
+      with self._lock:
+         self._idle.append((thread_id, uses))
+
+   # -- runs --
+
+   def _run_params(self, input: dict) -> dict:
+      # run overrides in the input (e.g. no tools for hierarchical runs) are passed on like OpenAIAssistantV2Runnable does
+      overrides = {key: input[key] for key in ("instructions", "model", "tools") if key in input}
+      return {"assistant_id": self.assistant_id,
+              "truncation_strategy": {"type": "last_messages", "last_messages": 1},
+              **overrides}
+
+   def _message(self, input: dict) -> dict:
+      return {"role": "user", "content": input["content"]}
+
+   def _finish(self, run: Any, messages: Any) -> OpenAIAssistantFinish:
+      if run.status != "completed":
+         raise ValueError(f"Unexpected run status: {run.status}. Last error: {getattr(run, 'last_error', None)}")
+
+      texts = [content.text.value for message in messages if message.run_id == run.id
+               for content in message.content if content.type == "text"]
+      return OpenAIAssistantFinish(return_values={"output": "\n".join(texts), "thread_id": run.thread_id, "run_id": run.id},
+                                   log="", run_id=run.id, thread_id=run.thread_id)
+
+   def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> OpenAIAssistantFinish:
+      start_time = time.perf_counter()
+      self._slots.acquire()
+      self._count(waited_for_slot=time.perf_counter() - start_time)
+      try:
+         thread_id, uses = self._acquire_thread()
+         run = None
+         try:
+            with tracer.span("assistant.create_run", reused_thread=thread_id is not None):
+               if thread_id is None:
+                  run = started_run(self.client.beta.threads.create_and_run(thread={"messages": [self._message(input)]}, **self._run_params(input)))
+                  self._count(threads_created=1)
+               else:
+                  run = started_run(self.client.beta.threads.runs.create(thread_id, additional_messages=[self._message(input)], **self._run_params(input)))
+            self._count(runs=1, round_trips=1)
+            run = self._wait_for_run(run)
+
+            with tracer.span("assistant.get_messages"):
+               messages = self.client.beta.threads.messages.list(run.thread_id, run_id=run.id, order="asc")
+            self._count(round_trips=1)
+            return self._finish(run, messages.data)
+         finally:
+            if run is not None:
+               self._release_thread(run.thread_id, uses + 1, run.status)
+            elif thread_id is not None:
+               # the run could not be created (e.g. rate limited), the thread is still usable
+               self._release_thread(thread_id, uses, None)
+      finally:
+         self._slots.release()
+
+   def _wait_for_run(self, run: Any) -> Any:
+      run_start = time.perf_counter()
+      with tracer.span("assistant.run") as span:
+         timer = RunStatusTimer()
+         for delay in self.poller.delays():
+            time.sleep(delay)
+            run = self.client.beta.threads.runs.retrieve(run.id, thread_id=run.thread_id)
+            self._count(polls=1, round_trips=1)
+            timer.observe(run)
+            if run.status not in ACTIVE_RUN_STATUSES:
+               break
+         timer.finish(span, run)
+      self.poller.observe(time.perf_counter() - run_start)
+      return run
+
+   async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> OpenAIAssistantFinish:
+      # one semaphore per event loop (asyncio primitives cannot be shared between loops)
+      loop = asyncio.get_running_loop()
+      with self._lock:
+         if self._async_slots is None or self._async_slots[0] is not loop:
+            self._async_slots = (loop, asyncio.Semaphore(self.max_in_flight))
+         slots = self._async_slots[1]
+
+      start_time = time.perf_counter()
+      async with slots:
+         self._count(waited_for_slot=time.perf_counter() - start_time)
+         thread_id, uses = self._acquire_thread()
+         run = None
+         try:
+            with tracer.span("assistant.create_run", reused_thread=thread_id is not None):
+               if thread_id is None:
+                  run = started_run(await self.async_client.beta.threads.create_and_run(thread={"messages": [self._message(input)]}, **self._run_params(input)))
+                  self._count(threads_created=1)
+               else:
+                  run = started_run(await self.async_client.beta.threads.runs.create(thread_id, additional_messages=[self._message(input)], **self._run_params(input)))
+            self._count(runs=1, round_trips=1)
+            run = await self._await_for_run(run)
+
+            with tracer.span("assistant.get_messages"):
+               messages = await self.async_client.beta.threads.messages.list(run.thread_id, run_id=run.id, order="asc")
+            self._count(round_trips=1)
+            return self._finish(run, messages.data)
+         finally:
+            if run is not None:
+               self._release_thread(run.thread_id, uses + 1, run.status)
+            elif thread_id is not None:
+               # the run could not be created (e.g. rate limited), the thread is still usable
+               self._release_thread(thread_id, uses, None)
+
+   async def _await_for_run(self, run: Any) -> Any:
+      run_start = time.perf_counter()
+      with tracer.span("assistant.run") as span:
+         timer = RunStatusTimer()
+         for delay in self.poller.delays():
+            await asyncio.sleep(delay)
+            run = await self.async_client.beta.threads.runs.retrieve(run.id, thread_id=run.thread_id)
+            self._count(polls=1, round_trips=1)
+            timer.observe(run)
+            if run.status not in ACTIVE_RUN_STATUSES:
+               break
+         timer.finish(span, run)
+      self.poller.observe(time.perf_counter() - run_start)
+      return run
+
+def build_pooled_chain(assistant_id: str, **kwargs) -> Tuple[PooledAssistantRunnable, Runnable]:
+   '''Create a pooled assistant runnable and its classification chain (assistant | parse_output | post_process)'''
+   agent = PooledAssistantRunnable(assistant_id, **kwargs)
+   return agent, (agent | parse_output | post_process)
+
+# the pooled runnable is shared by all app sessions, so max_in_flight caps the runs of the whole process
+_pooled_chain: Optional[Tuple[PooledAssistantRunnable, Runnable]] = None
+
+def load_pooled_chain(assistant_id: str, **kwargs) -> Tuple[PooledAssistantRunnable, Runnable]:
+   global _pooled_chain
+   if _pooled_chain is None or _pooled_chain[0].assistant_id != assistant_id:
+      agent, _ = load_chain(assistant_id)
+      kwargs.setdefault("client", agent.client)
+      kwargs.setdefault("async_client", agent.async_client)
+      _pooled_chain = build_pooled_chain(assistant_id, **kwargs)
+   return _pooled_chain
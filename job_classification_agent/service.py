@@ -0,0 +1,434 @@
+'''Classification service: an asynchronous HTTP API with a persistent job queue
+
+Upstream systems submit job posts (up to 10,000 per request) and get job ids back
+right away; the job posts are stored in the SQLite job queue (job_queue.py) and
+classified by a bounded pool of workers running the existing chain (through
+BatchClassifier, so the title fast path, cache and shortlist apply).  Results are
+polled per job or per batch, or pushed to a webhook as each job finishes.
+
+- priorities: higher priority jobs are classified first
+- retries: runs that fail with transient errors (rate limits, server errors) are retried
+  in process, then re-queued with exponential backoff; jobs that fail max_attempts
+  times, or with a non-transient error, are dead-lettered
+- quotas: per-client limits on pending jobs, submissions per hour and running jobs
+  (clients are identified by the X-Client-Id header, put the service behind a gateway
+  that authenticates and sets it)
+- webhooks: finished jobs are POSTed as JSON to the webhook_url of their batch, signed with
+  HMAC-SHA256 (X-Signature header) when a webhook secret is set, and retried with backoff
+
+HTTP API:
+
+   POST   /jobs                 {"posts": [{"id", "title", "description"}, ...], "priority", "include_explanation", "hints", "webhook_url"}
+   GET    /jobs/{job_id}        job status and result
+   DELETE /jobs/{job_id}        cancel a queued job
+   POST   /jobs/{job_id}/retry  re-queue a dead-lettered job
+   GET    /batches/{batch_id}   status counts and jobs of a submission (?status=&limit=&offset=)
+   GET    /dead-letters         the client's dead-lettered jobs
+   GET    /health               queue size per status
+
+usage: python -m job_classification_agent.service [-h] [--host HOST] [--port PORT] [--db DB] [--concurrency CONCURRENCY] ...
+'''
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+
+import aiohttp
+
+from aiohttp import web
+from langchain_core.pydantic_v1 import BaseModel, Field, ValidationError, validator
+from langchain_core.runnables import Runnable
+
+from job_classification_agent.batch import BatchClassifier, BatchResult
+from job_classification_agent.cache import CACHE_PATH, ClassificationCache
+from job_classification_agent.chain import DEFAULT_PROMPT_TEMPLATE, build_chain, load_prompt
+from job_classification_agent.fast_path import DEFAULT_THRESHOLD, TitleMatcher
+from job_classification_agent.job_posts import JobPost
+from job_classification_agent.job_queue import (DEFAULT_MAX_ATTEMPTS, DEFAULT_RETENTION, QUEUE_PATH, ClientQuota, Job, JobQueue,
+                                                QuotaExceeded, load_quotas)
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.retrieval import OccupationRetriever, load_retriever
+from job_classification_agent.run_pool import build_pooled_chain
+from job_classification_agent.tracing import configure_tracing, tracer
+
+logger = logging.getLogger(__name__)
+
+MAX_POSTS_PER_REQUEST = 10_000
+DEFAULT_CLIENT_ID = "default"
+
+class JobPostIn(BaseModel):
+   id: Optional[str] = Field(description="Client id of the job post (default: its position in the request, from 1)", max_length=200)
+   title: str = Field("", max_length=1000)
+   description: str = Field("", max_length=50_000)
+
+class SubmitRequest(BaseModel):
+   posts: List[JobPostIn] = Field(min_items=1, max_items=MAX_POSTS_PER_REQUEST)
+   priority: int = Field(0, ge=-100, le=100)
+   include_explanation: bool = True
+   hints: Optional[str] = Field(None, max_length=2000)
+   webhook_url: Optional[str] = Field(None, max_length=2000)
+
+   @validator("webhook_url")
+   def check_webhook_url(cls, value: Optional[str]) -> Optional[str]:
+      if value is not None and not value.startswith(("http://", "https://")):
+         raise ValueError("webhook_url must be an http(s) URL")
+      return value
+
+def rate_limited(result: BatchResult) -> bool:
+   return result.error is not None and ("RateLimitError" in result.error or "rate_limit_exceeded" in result.error)
+
+class ClassificationService:
+   '''Workers that classify queued jobs, and the delivery of their webhooks'''
+
+   def __init__(self, queue: JobQueue, chain: Runnable, concurrency: int = 8, prompt_template: str = DEFAULT_PROMPT_TEMPLATE,
+                assistant_id: str = "", retriever: Optional[OccupationRetriever] = None, shortlist_size: int = 10,
+                fast_path: Optional[TitleMatcher] = None, cache: Optional[ClassificationCache] = None, max_retries: int = 2,
+                retry_base: float = 5.0, retry_max: float = 300.0, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                webhook_secret: Optional[str] = None, retention: float = DEFAULT_RETENTION, poll_interval: float = 1.0):
+      self.queue = queue
+      self.chain = chain
+      self.concurrency = concurrency
+      self.prompt_template = prompt_template
+      self.assistant_id = assistant_id
+      self.retriever = retriever
+      self.shortlist_size = shortlist_size
+      self.fast_path = fast_path
+      self.cache = cache
+      self.max_retries = max_retries
+      self.retry_base = retry_base
+      self.retry_max = retry_max
+      self.max_attempts = max_attempts
+      self.webhook_secret = webhook_secret
+      self.retention = retention
+      self.poll_interval = poll_interval
+      self.running = 0
+      self._classifiers: OrderedDict = OrderedDict()
+      self._resume_at = 0.0
+      self._wakeup: Optional[asyncio.Event] = None
+      self._tasks: List[asyncio.Task] = []
+
+   def classifier(self, include_explanation: bool, hints: Optional[str]) -> BatchClassifier:
+      '''A BatchClassifier per prompt variant (include_explanation, hints), the most recently used are kept'''
+      key = (include_explanation, hints)
+      if key in self._classifiers:
+         self._classifiers.move_to_end(key)
+         return self._classifiers[key]
+
+      classifier = BatchClassifier(self.chain, load_prompt(self.prompt_template, include_explanation, hints),
+                                   max_retries=self.max_retries, include_explanation=include_explanation, hints=hints,
+                                   retriever=self.retriever, shortlist_size=self.shortlist_size, fast_path=self.fast_path,
+                                   cache=self.cache, assistant_id=self.assistant_id)
+      self._classifiers[key] = classifier
+      if len(self._classifiers) > 32:
+         self._classifiers.popitem(last=False)
+      return classifier
+
+   async def queue_call(self, method: Callable, *args, **kwargs) -> Any:
+      '''Call a JobQueue method in the default executor
+
+      The queue's SQLite calls wait on its lock, which a large submission holds for its
+      whole insert, so they are kept off the event loop.
+      '''
+      return await asyncio.get_running_loop().run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+   # -- lifecycle --
+
+   async def start(self) -> None:
+      requeued = await self.queue_call(self.queue.requeue_running)
+      if requeued:
+         logger.info("re-queued %d jobs left running by a previous process", requeued)
+      self._wakeup = asyncio.Event()
+      self._tasks = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+      self._tasks += [asyncio.create_task(self.deliver_webhooks()), asyncio.create_task(self.purge())]
+
+   async def stop(self) -> None:
+      for task in self._tasks:
+         task.cancel()
+      await asyncio.gather(*self._tasks, return_exceptions=True)
+      self._tasks = []
+
+   def notify(self) -> None:
+      '''Wake up idle workers (new jobs were queued or a running slot was freed)'''
+      if self._wakeup is not None:
+         self._wakeup.set()
+
+   # -- workers --
+
+   async def _wait_for_jobs(self) -> None:
+      self._wakeup.clear()
+      now = time.time()
+      next_at = await self.queue_call(self.queue.next_available_at)
+      # queued jobs that are already available are held back by client running quotas: wait for a slot
+      timeout = self.poll_interval if next_at is None or next_at <= now else min(self.poll_interval, next_at - now)
+      try:
+         await asyncio.wait_for(self._wakeup.wait(), timeout)
+      except asyncio.TimeoutError:
+         pass
+
+   async def work(self) -> None:
+      while True:
+         # wait out a service-wide pause triggered by a rate limit
+         pause = self._resume_at - time.monotonic()
+         if pause > 0:
+            await asyncio.sleep(pause)
+            continue
+
+         job = await self.queue_call(self.queue.claim)
+         if job is None:
+            await self._wait_for_jobs()
+            continue
+
+         self.running += 1
+         try:
+            await self.run_job(job)
+         finally:
+            self.running -= 1
+            self.notify()
+
+   async def run_job(self, job: Job) -> None:
+      '''Classify a claimed job and record its result, retry or dead letter'''
+      try:
+         with tracer.span("job", job_id=job.id, client_id=job.client_id, attempt=job.attempts):
+            result = await self.classifier(job.include_explanation, job.hints).classify(job.to_job_post())
+      except Exception as e:
+         logger.exception("job %s failed", job.id)
+         result = BatchResult(post_id=job.post_id, error=f"{type(e).__name__}: {e}", retry_after=self.retry_base)
+
+      if result.ok:
+         await self.queue_call(self.queue.complete, job.id, {**json.loads(result.result.json()), "source": result.source})
+         return
+
+      retry_delay = None
+      if result.retry_after is not None:
+         retry_delay = max(result.retry_after, min(self.retry_max, self.retry_base * 2 ** (job.attempts - 1)))
+         if rate_limited(result):
+            self._resume_at = max(self._resume_at, time.monotonic() + result.retry_after)
+
+      status = await self.queue_call(self.queue.fail, job.id, result.error, retry_delay)
+      if status == "dead":
+         logger.warning("job %s (client %s, post %s) dead-lettered after %d attempts: %s", job.id, job.client_id, job.post_id, job.attempts, result.error)
+
+   # -- webhooks --
+
+   def sign(self, body: bytes) -> Optional[str]:
+      if not self.webhook_secret:
+         return None
+      return "sha256=" + hmac.new(self.webhook_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+   async def _deliver(self, session: aiohttp.ClientSession, job: Job) -> None:
+      body = json.dumps(job.to_record()).encode("utf-8")
+      headers = {"Content-Type": "application/json"}
+      signature = self.sign(body)
+      if signature is not None:
+         headers["X-Signature"] = signature
+
+      try:
+         async with session.post(job.webhook_url, data=body, headers=headers) as response:
+            delivered = 200 <= response.status < 300
+      except (aiohttp.ClientError, asyncio.TimeoutError):
+         delivered = False
+
+      if delivered:
+         await self.queue_call(self.queue.webhook_delivered, job.id)
+      else:
+         await self.queue_call(self.queue.webhook_failed, job)
+
+   async def deliver_webhooks(self) -> None:
+      async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+         while True:
+            jobs = await self.queue_call(self.queue.due_webhooks)
+            if not jobs:
+               await asyncio.sleep(self.poll_interval)
+               continue
+            await asyncio.gather(*(self._deliver(session, job) for job in jobs))
+
+   async def purge(self) -> None:
+      while True:
+         purged = await self.queue_call(self.queue.purge, self.retention)
+         if purged:
+            logger.info("purged %d finished jobs", purged)
+         await asyncio.sleep(3600)
+
+# -- HTTP API --
+
+def _client_id(request: web.Request) -> str:
+   return request.headers.get("X-Client-Id", DEFAULT_CLIENT_ID)
+
+def _error(status: int, message: str, **extra) -> web.Response:
+   return web.json_response({"error": message, **extra}, status=status)
+
+async def _job_or_404(request: web.Request) -> Tuple[Optional[Job], Optional[web.Response]]:
+   service: ClassificationService = request.app["service"]
+   job = await service.queue_call(service.queue.get, request.match_info["job_id"], _client_id(request))
+   return (job, None) if job is not None else (None, _error(404, "unknown job"))
+
+async def submit_jobs(request: web.Request) -> web.Response:
+   service: ClassificationService = request.app["service"]
+   try:
+      submission = SubmitRequest.parse_obj(await request.json())
+   except json.JSONDecodeError:
+      return _error(400, "the request body is not JSON")
+   except ValidationError as e:
+      return _error(400, "invalid request", details=e.errors())
+
+   posts = [JobPost(id=post.id or str(i), title=post.title, description=post.description) for i, post in enumerate(submission.posts, start=1)]
+   try:
+      batch_id, jobs = await service.queue_call(service.queue.submit, _client_id(request), posts, priority=submission.priority,
+                                                include_explanation=submission.include_explanation, hints=submission.hints,
+                                                webhook_url=submission.webhook_url, max_attempts=service.max_attempts)
+   except QuotaExceeded as e:
+      return web.json_response({"error": str(e)}, status=429, headers={"Retry-After": str(int(e.retry_after or 60))})
+
+   service.notify()
+   return web.json_response({"batch_id": batch_id, "status_url": f"/batches/{batch_id}",
+                             "jobs": [{"job_id": job.id, "id": job.post_id} for job in jobs]}, status=202)
+
+async def get_job(request: web.Request) -> web.Response:
+   job, error = await _job_or_404(request)
+   return error or web.json_response(job.to_record())
+
+async def cancel_job(request: web.Request) -> web.Response:
+   job, error = await _job_or_404(request)
+   if error:
+      return error
+   service: ClassificationService = request.app["service"]
+   if not await service.queue_call(service.queue.cancel, job.id, job.client_id):
+      return _error(409, f"only queued jobs can be cancelled, the job is {job.status}")
+   return web.json_response({"job_id": job.id, "status": "cancelled"})
+
+async def retry_job(request: web.Request) -> web.Response:
+   job, error = await _job_or_404(request)
+   if error:
+      return error
+   service: ClassificationService = request.app["service"]
+   if not await service.queue_call(service.queue.retry_dead, job.id, job.client_id):
+      return _error(409, f"only dead-lettered jobs can be retried, the job is {job.status}")
+   service.notify()
+   return web.json_response({"job_id": job.id, "status": "queued"})
+
+async def get_batch(request: web.Request) -> web.Response:
+   service: ClassificationService = request.app["service"]
+   client_id = _client_id(request)
+   batch_id = request.match_info["batch_id"]
+   counts = await service.queue_call(service.queue.batch_counts, batch_id, client_id)
+   if not counts:
+      return _error(404, "unknown batch")
+
+   try:
+      limit = min(int(request.query.get("limit", 1000)), 10_000)
+      offset = int(request.query.get("offset", 0))
+   except ValueError:
+      return _error(400, "limit and offset must be integers")
+   jobs = await service.queue_call(service.queue.batch, batch_id, client_id, status=request.query.get("status"), limit=limit, offset=offset)
+   done = not counts.get("queued") and not counts.get("running")
+   return web.json_response({"batch_id": batch_id, "counts": counts, "done": done, "jobs": [job.to_record() for job in jobs]})
+
+async def get_dead_letters(request: web.Request) -> web.Response:
+   service: ClassificationService = request.app["service"]
+   try:
+      limit = min(int(request.query.get("limit", 100)), 1000)
+   except ValueError:
+      return _error(400, "limit must be an integer")
+   jobs = await service.queue_call(service.queue.dead_letters, _client_id(request), limit=limit)
+   return web.json_response({"jobs": [job.to_record() for job in jobs]})
+
+async def health(request: web.Request) -> web.Response:
+   service: ClassificationService = request.app["service"]
+   counts = await service.queue_call(service.queue.counts)
+   return web.json_response({"status": "ok", "jobs": counts, "workers": service.concurrency, "running": service.running})
+
+def create_app(service: ClassificationService) -> web.Application:
+   '''The aiohttp application of the service (the workers run while the application runs)'''
+   app = web.Application(client_max_size=64 * 1024 ** 2)
+   app["service"] = service
+
+   async def workers(app: web.Application):
+      await service.start()
+      yield
+      await service.stop()
+
+   app.cleanup_ctx.append(workers)
+   app.router.add_post("/jobs", submit_jobs)
+   app.router.add_get("/jobs/{job_id}", get_job)
+   app.router.add_delete("/jobs/{job_id}", cancel_job)
+   app.router.add_post("/jobs/{job_id}/retry", retry_job)
+   app.router.add_get("/batches/{batch_id}", get_batch)
+   app.router.add_get("/dead-letters", get_dead_letters)
+   app.router.add_get("/health", health)
+   return app
+
+def get_args() -> argparse.Namespace:
+   parser = argparse.ArgumentParser(description="Run the classification service (HTTP API and job queue workers)")
+   parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on (default: 127.0.0.1)")
+   parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+   parser.add_argument("--db", type=str, default=QUEUE_PATH, help="Job queue database (default: data/queue/jobs.db)")
+   parser.add_argument("--assistant-id", type=str, default=os.environ.get("ASSISTANT_ID"), help="Assistant ID (default: ASSISTANT_ID environment variable)")
+   parser.add_argument("--concurrency", type=int, default=8, help="Number of workers, i.e. concurrent assistant runs (default: 8)")
+   parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help=f"Attempts before a job is dead-lettered (default: {DEFAULT_MAX_ATTEMPTS})")
+   parser.add_argument("--max-retries", type=int, default=2, help="In-process retries of a transient error within one attempt (default: 2)")
+   parser.add_argument("--quotas", type=str, default=None, help='JSON file with client quotas: {"default": {...}, "clients": {"<client id>": {...}}}')
+   parser.add_argument("--max-pending", type=int, default=ClientQuota.max_pending, help=f"Default quota of queued and running jobs per client (default: {ClientQuota.max_pending})")
+   parser.add_argument("--max-per-hour", type=int, default=ClientQuota.max_per_hour, help=f"Default quota of submitted jobs per client and hour (default: {ClientQuota.max_per_hour})")
+   parser.add_argument("--max-running", type=int, default=ClientQuota.max_running, help=f"Default quota of running jobs per client (default: {ClientQuota.max_running})")
+   parser.add_argument("--webhook-secret", type=str, default=os.environ.get("WEBHOOK_SECRET"), help="Sign webhooks with HMAC-SHA256 (default: WEBHOOK_SECRET environment variable)")
+   parser.add_argument("--retention-days", type=float, default=DEFAULT_RETENTION / 86400, help="Days to keep finished jobs (default: 7)")
+   parser.add_argument("--prompt-template", type=str, default=None, help="File with a custom prompt template")
+   parser.add_argument("--shortlist", type=int, default=0, metavar="K", help="Include the top K candidate occupations from the local search index in the prompt (default: 0, disabled)")
+   parser.add_argument("--fast-path", action="store_true", help="Classify job posts with a matching O*NET title without running the assistant")
+   parser.add_argument("--fast-path-threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Minimum title match confidence for the fast path (default: {DEFAULT_THRESHOLD})")
+   parser.add_argument("--cache", type=str, default=CACHE_PATH, help="Classification cache database (default: data/cache/classifications.db)")
+   parser.add_argument("--no-cache", action="store_true", help="Do not read or write the classification cache")
+   parser.add_argument("--reuse-threads", action="store_true", help="Run on reused warm threads with adaptive polling instead of a new thread per run")
+   parser.add_argument("--trace-file", type=str, default=None, help="JSON Lines file for the trace spans")
+   return parser.parse_args()
+
+def main(args) -> None:
+   assert(args.assistant_id is not None), "ASSISTANT_ID environment variable is not set.  Please run create_assistant.py to create an assistant."
+   logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+   prompt_template = DEFAULT_PROMPT_TEMPLATE
+   if args.prompt_template:
+      with open(args.prompt_template, encoding="utf-8") as f:
+         prompt_template = f.read()
+
+   default_quota, quotas = ClientQuota(args.max_pending, args.max_per_hour, args.max_running), {}
+   if args.quotas:
+      default_quota, quotas = load_quotas(args.quotas)
+
+   if args.trace_file:
+      configure_tracing(args.trace_file)
+
+   load_knowledge_base()
+   if args.reuse_threads:
+      pool, chain = build_pooled_chain(args.assistant_id, max_in_flight=args.concurrency, warm_threads=args.concurrency)
+      pool.warm()
+   else:
+      _, chain = build_chain(args.assistant_id)
+
+   service = ClassificationService(JobQueue(args.db, default_quota, quotas), chain,
+                                   concurrency=args.concurrency,
+                                   prompt_template=prompt_template,
+                                   assistant_id=args.assistant_id,
+                                   retriever=load_retriever() if args.shortlist > 0 else None,
+                                   shortlist_size=args.shortlist,
+                                   fast_path=TitleMatcher.build(threshold=args.fast_path_threshold) if args.fast_path else None,
+                                   cache=None if args.no_cache else ClassificationCache(args.cache),
+                                   max_retries=args.max_retries,
+                                   max_attempts=args.max_attempts,
+                                   webhook_secret=args.webhook_secret,
+                                   retention=args.retention_days * 86400)
+
+   web.run_app(create_app(service), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+   args = get_args()
+   main(args)
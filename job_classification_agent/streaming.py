@@ -0,0 +1,169 @@
+'''Streaming assistant runs with early classification results
+
+Instead of polling the run and fetching the complete message, the run is created
+with stream=True and the assistant's message deltas are fed to an incremental JSON
+parser.  Every job classification is validated and post-processed as soon as its
+object closes, so consumers get the first occupation while the rest of the answer is
+still being generated.  The complete answer is parsed tolerantly at the end (see
+json_stream.py), so a slightly malformed answer does not need a new run.
+'''
+
+import time
+
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator, List, Optional, Set
+
+from openai import AsyncOpenAI, OpenAI
+
+from job_classification_agent.models import JobClassification, JobClassifications
+from job_classification_agent.chain import MAX_CLASSIFICATIONS, load_chain, post_process, post_process_classification, to_job_classification, to_job_classifications
+from job_classification_agent.json_stream import ClassificationStreamParser, loads_tolerant
+from job_classification_agent.tracing import Span, tracer
+
+# run statuses that end a run without an answer
+FAILED_RUN_EVENTS = ("thread.run.failed", "thread.run.cancelled", "thread.run.expired")
+
+@dataclass
+class StreamUpdate:
+   '''A classification completed during generation, or the final result of the run'''
+   classification: Optional[JobClassification] = None
+   result: Optional[JobClassifications] = None
+   elapsed: float = 0.0
+
+class _RunStream:
+   '''State of one streamed run: turns assistant stream events into StreamUpdates'''
+
+   def __init__(self, span: Optional[Span]):
+      self.span = span
+      self.parser = ClassificationStreamParser()
+      self.start_time = time.perf_counter()
+      self.status_since = time.time()
+      self.message_text: Optional[str] = None
+      self.seen: Set[str] = set()
+      # valid classifications of the answer so far, only the first MAX_CLASSIFICATIONS are kept (as in the final result)
+      self.valid = 0
+
+   def _update(self, classification: JobClassification) -> Optional[StreamUpdate]:
+      # post-processing can repair two classifications into the same occupation
+      if classification.occupation_code in self.seen:
+         return None
+      self.seen.add(classification.occupation_code)
+      elapsed = time.perf_counter() - self.start_time
+      if self.span is not None and len(self.seen) == 1:
+         self.span.set(time_to_first_classification=round(elapsed, 3))
+      return StreamUpdate(classification=classification, elapsed=elapsed)
+
+   def _record_status(self, status: str) -> None:
+      now = time.time()
+      tracer.record(f"assistant.run.{status}", self.status_since, now - self.status_since)
+      self.status_since = now
+
+   def handle(self, event: Any) -> List[StreamUpdate]:
+      updates = []
+
+      if event.event == "thread.run.created" and self.span is not None:
+         self.span.set(run_id=event.data.id, thread_id=event.data.thread_id)
+
+      elif event.event == "thread.run.in_progress":
+         self._record_status("queued")
+
+      elif event.event == "thread.message.delta":
+         for block in event.data.delta.content or []:
+            if block.type != "text" or block.text is None or not block.text.value:
+               continue
+            for obj in self.parser.feed(block.text.value):
+               classification = to_job_classification(obj)
+               if classification is None:
+                  continue
+               self.valid += 1
+               if self.valid > MAX_CLASSIFICATIONS:
+                  continue
+               classification = post_process_classification(classification)
+               if classification is not None:
+                  update = self._update(classification)
+                  if update is not None:
+                     updates.append(update)
+
+      elif event.event == "thread.message.completed":
+         self.message_text = "\n".join(block.text.value for block in event.data.content if block.type == "text")
+
+      elif event.event in ("thread.run.completed", "thread.run.incomplete"):
+         self._record_status("in_progress")
+         usage = getattr(event.data, "usage", None)
+         if self.span is not None and usage is not None:
+            self.span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, total_tokens=usage.total_tokens)
+
+      elif event.event in FAILED_RUN_EVENTS:
+         # same message as OpenAIAssistantV2Runnable, so batch retries recognize rate limit and server errors
+         run = event.data
+         raise ValueError(f"Unexpected run status: {run.status}. Last error: {run.last_error}")
+
+      elif event.event == "error":
+         raise ValueError(f"Assistant stream error: {event.data}")
+
+      return updates
+
+   def finish(self) -> StreamUpdate:
+      text = self.message_text if self.message_text is not None else self.parser.text
+      if not text:
+         raise ValueError("The assistant run ended without an answer")
+
+      result = post_process(to_job_classifications(loads_tolerant(text)))
+      if self.span is not None:
+         self.span.set(streamed_classifications=len(self.seen), parser_errors=self.parser.errors)
+      return StreamUpdate(result=result, elapsed=time.perf_counter() - self.start_time)
+
+class StreamingClassifier:
+   '''Classify job posts with streamed assistant runs
+
+   Takes the same input as the classification chain ({"content": prompt}) and offers
+   invoke/ainvoke, so it can replace the chain in batch runs.
+   '''
+
+   def __init__(self, assistant_id: str, client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None):
+      self.assistant_id = assistant_id
+      self.client = client or OpenAI()
+      self.async_client = async_client or AsyncOpenAI()
+
+   def _thread(self, input: dict) -> dict:
+      return {"messages": [{"role": "user", "content": input["content"]}]}
+
+   def stream(self, input: dict) -> Iterator[StreamUpdate]:
+      '''Yield each classification as soon as it is generated, then the final result'''
+      with tracer.span("assistant.stream") as span:
+         run = _RunStream(span)
+         with tracer.span("assistant.create_thread_and_run"):
+            events = self.client.beta.threads.create_and_run(assistant_id=self.assistant_id, thread=self._thread(input), stream=True)
+         for event in events:
+            yield from run.handle(event)
+         yield run.finish()
+
+   async def astream(self, input: dict) -> AsyncIterator[StreamUpdate]:
+      '''Yield each classification as soon as it is generated, then the final result'''
+      with tracer.span("assistant.stream") as span:
+         run = _RunStream(span)
+         with tracer.span("assistant.create_thread_and_run"):
+            events = await self.async_client.beta.threads.create_and_run(assistant_id=self.assistant_id, thread=self._thread(input), stream=True)
+         async for event in events:
+            for update in run.handle(event):
+               yield update
+         yield run.finish()
+
+   def invoke(self, input: dict, config: Optional[dict] = None) -> JobClassifications:
+      # exhaust the stream (rather than returning early) so its trace span is closed here
+      updates = list(self.stream(input))
+      return updates[-1].result
+
+   async def ainvoke(self, input: dict, config: Optional[dict] = None) -> JobClassifications:
+      updates = [update async for update in self.astream(input)]
+      return updates[-1].result
+
+# shared by all app sessions, with the OpenAI clients of the shared assistant runnable (see load_chain)
+_streaming_classifier: Optional[StreamingClassifier] = None
+
+def load_streaming_classifier(assistant_id: str) -> StreamingClassifier:
+   global _streaming_classifier
+   if _streaming_classifier is None or _streaming_classifier.assistant_id != assistant_id:
+      agent, _ = load_chain(assistant_id)
+      _streaming_classifier = StreamingClassifier(assistant_id, client=agent.client, async_client=agent.async_client)
+   return _streaming_classifier
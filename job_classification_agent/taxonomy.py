@@ -0,0 +1,101 @@
+'''In-memory index of the O*NET 28 taxonomy built from the processed JSON Lines data'''
+
+import json
+import os
+import re
+
+from typing import Dict, Iterator, Optional, Tuple
+
+PROCESSED_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "processed")
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_title(title: str) -> str:
+   '''Normalize a title for lookups (case and whitespace insensitive)'''
+   return _WHITESPACE.sub(" ", title).strip().casefold() if title else ""
+
+def read_jsonl(path: str) -> Iterator[dict]:
+   '''Read the records of a JSON Lines file one at a time'''
+   with open(path, encoding="utf-8") as f:
+      for line in f:
+         if line.strip():
+            yield json.loads(line)
+
+class Occupation:
+   '''An O*NET occupation with its career clusters and pathways'''
+   __slots__ = ("code", "title", "description", "career_clusters", "career_pathways")
+
+   def __init__(self, code: str, title: str, description: Optional[str] = None,
+                career_clusters: Tuple[str, ...] = (), career_pathways: Tuple[str, ...] = ()):
+      self.code = code
+      self.title = title
+      self.description = description
+      self.career_clusters = career_clusters
+      self.career_pathways = career_pathways
+
+   def to_dict(self) -> dict:
+      return {"occupation_code": self.code, "occupation_title": self.title, "occupation_description": self.description}
+
+   def __repr__(self) -> str:
+      return f"Occupation({self.code!r}, {self.title!r})"
+
+class TaxonomyIndex:
+   '''Hash map lookups of occupations by code and by normalized title'''
+
+   def __init__(self):
+      self.occupations: Dict[str, Occupation] = {}
+      self.titles: Dict[str, str] = {}
+      self.careers: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+
+   @classmethod
+   def from_directory(cls, data_dir: str = PROCESSED_DATA_DIR) -> "TaxonomyIndex":
+      '''Build the index from occupation_descriptions.json and occupation_career_clusters.json'''
+      index = cls()
+
+      for record in read_jsonl(os.path.join(data_dir, "occupation_descriptions.json")):
+         index.add_occupation(Occupation(record["occupation_code"], record["occupation_title"], record.get("occupation_description")))
+
+      for record in read_jsonl(os.path.join(data_dir, "occupation_career_clusters.json")):
+         index.add_career_paths(record["occupation_code"], record.get("career_cluster") or (), record.get("career_pathway") or ())
+
+      return index
+
+   def add_occupation(self, occupation: Occupation) -> None:
+      self.occupations[occupation.code] = occupation
+      self.titles.setdefault(normalize_title(occupation.title), occupation.code)
+
+      career_clusters, career_pathways = self.careers.get(occupation.code, ((), ()))
+      occupation.career_clusters = career_clusters
+      occupation.career_pathways = career_pathways
+
+   def add_career_paths(self, code: str, career_clusters, career_pathways) -> None:
+      # career clusters are reported for a few codes that have no occupation description
+      self.careers[code] = (tuple(career_clusters), tuple(career_pathways))
+
+      occupation = self.occupations.get(code)
+      if occupation is not None:
+         occupation.career_clusters, occupation.career_pathways = self.careers[code]
+
+   def get(self, code: str) -> Optional[Occupation]:
+      return self.occupations.get(code)
+
+   def get_by_title(self, title: str) -> Optional[Occupation]:
+      code = self.titles.get(normalize_title(title))
+      return self.occupations[code] if code is not None else None
+
+   def is_valid(self, code: str, title: str) -> bool:
+      '''Check that the code exists and that title is its occupation title'''
+      occupation = self.occupations.get(code)
+      return occupation is not None and occupation.title == title
+
+   def career_clusters(self, code: str) -> Tuple[str, ...]:
+      return self.careers.get(code, ((), ()))[0]
+
+   def career_pathways(self, code: str) -> Tuple[str, ...]:
+      return self.careers.get(code, ((), ()))[1]
+
+   def __len__(self) -> int:
+      return len(self.occupations)
+
+   def __contains__(self, code: str) -> bool:
+      return code in self.occupations
@@ -0,0 +1,283 @@
+'''Per-stage latency tracing for the classification chain
+
+A trace is a tree of spans, one per stage of a classification (prompt formatting,
+thread creation, run queue and in-progress time, fetching messages, parse_output,
+post_process, knowledge base lookups, ...).  The current span is tracked in a
+context variable, so concurrent batch workers each build their own trace.
+
+Finished spans are passed to pluggable sinks:
+
+- JsonlSink writes one JSON Lines record per span
+- MetricsSink keeps in-process per-stage latency histograms and token counters
+- OpenTelemetrySink re-emits the spans through an OpenTelemetry tracer (optional dependency)
+
+Without sinks, spans are not created at all and tracing costs a function call per stage.
+'''
+
+import bisect
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+   from opentelemetry import trace as otel_trace
+except ImportError:  # the OpenTelemetry sink is optional
+   otel_trace = None
+
+# upper bounds (in seconds) of the latency histogram buckets, the last bucket is unbounded
+BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# span attributes holding the token usage of a run, summed by MetricsSink
+TOKEN_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+@dataclass
+class Span:
+   name: str
+   trace_id: str
+   span_id: str
+   parent_id: Optional[str] = None
+   start_time: float = 0.0
+   duration: float = 0.0
+   attributes: dict = field(default_factory=dict)
+   error: Optional[str] = None
+
+   def set(self, **attributes) -> None:
+      self.attributes.update(attributes)
+
+   def to_record(self) -> dict:
+      record = {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start_time": round(self.start_time, 6), "duration": round(self.duration, 6)}
+      if self.attributes:
+         record["attributes"] = self.attributes
+      if self.error is not None:
+         record["error"] = self.error
+      return record
+
+class Sink:
+   '''Receives spans as they start and end'''
+
+   def on_start(self, span: Span) -> None:
+      pass
+
+   def on_end(self, span: Span) -> None:
+      pass
+
+class JsonlSink(Sink):
+   '''Append finished spans to a JSON Lines file'''
+
+   def __init__(self, path: str):
+      os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+      self._file = open(path, "a", encoding="utf-8")
+      self._lock = threading.Lock()
+
+   def on_end(self, span: Span) -> None:
+      line = json.dumps(span.to_record(), default=str) + "\n"
+      with self._lock:
+         self._file.write(line)
+         self._file.flush()
+
+   def close(self) -> None:
+      self._file.close()
+
+@dataclass
+class Histogram:
+   '''Latency histogram with fixed buckets and a window of recent samples for percentiles'''
+   counts: List[int] = field(default_factory=lambda: [0] * (len(BUCKETS) + 1))
+   count: int = 0
+   total: float = 0.0
+   max: float = 0.0
+   recent: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+   def observe(self, value: float) -> None:
+      self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+      self.count += 1
+      self.total += value
+      self.max = max(self.max, value)
+      self.recent.append(value)
+
+   @property
+   def mean(self) -> float:
+      return self.total / self.count if self.count else 0.0
+
+   def percentile(self, p: float) -> float:
+      '''Percentile (0-100) of the recent samples'''
+      if not self.recent:
+         return 0.0
+      values = sorted(self.recent)
+      return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+class MetricsSink(Sink):
+   '''In-process per-stage latency histograms and token usage counters'''
+
+   def __init__(self, max_spans: int = 1000):
+      self.histograms: Dict[str, Histogram] = defaultdict(Histogram)
+      self.errors: Dict[str, int] = defaultdict(int)
+      self.tokens: Dict[str, int] = defaultdict(int)
+      self.spans: deque = deque(maxlen=max_spans)
+      self._lock = threading.Lock()
+
+   def on_end(self, span: Span) -> None:
+      with self._lock:
+         self.histograms[span.name].observe(span.duration)
+         if span.error is not None:
+            self.errors[span.name] += 1
+         for key in TOKEN_ATTRIBUTES:
+            if isinstance(span.attributes.get(key), int):
+               self.tokens[key] += span.attributes[key]
+         self.spans.append(span)
+
+   def trace(self, trace_id: str) -> List[Span]:
+      '''Recent spans of one trace, in start order'''
+      with self._lock:
+         return sorted((s for s in self.spans if s.trace_id == trace_id), key=lambda s: s.start_time)
+
+   def summary(self) -> List[dict]:
+      with self._lock:
+         return [{"stage": name, "count": h.count, "errors": self.errors.get(name, 0), "mean": h.mean,
+                  "p50": h.percentile(50), "p95": h.percentile(95), "p99": h.percentile(99), "max": h.max}
+                 for name, h in sorted(self.histograms.items())]
+
+   def format_summary(self) -> str:
+      lines = [f"{'stage':<32} {'count':>7} {'errors':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"]
+      for row in self.summary():
+         lines.append(f"{row['stage']:<32} {row['count']:>7} {row['errors']:>6} " +
+                      " ".join(f"{row[key] * 1000:>7.1f}ms" for key in ("mean", "p50", "p95", "p99", "max")))
+      if self.tokens:
+         lines.append("tokens: " + ", ".join(f"{key} {value}" for key, value in sorted(self.tokens.items())))
+      return "\n".join(lines)
+
+class OpenTelemetrySink(Sink):
+   '''Re-emit spans (with their parent links, timings and attributes) through an OpenTelemetry tracer
+
+   Configure the OpenTelemetry SDK (tracer provider and exporter) before creating the sink.
+   '''
+
+   def __init__(self, tracer_provider=None, instrumentation_name: str = "job_classification_agent"):
+      if otel_trace is None:
+         raise ImportError("OpenTelemetrySink requires the opentelemetry-api package")
+      self._tracer = otel_trace.get_tracer(instrumentation_name, tracer_provider=tracer_provider)
+      self._spans = {}
+      self._lock = threading.Lock()
+
+   def on_start(self, span: Span) -> None:
+      with self._lock:
+         parent = self._spans.get(span.parent_id)
+      context = otel_trace.set_span_in_context(parent) if parent is not None else None
+      otel_span = self._tracer.start_span(span.name, context=context, start_time=int(span.start_time * 1e9))
+      with self._lock:
+         self._spans[span.span_id] = otel_span
+
+   def on_end(self, span: Span) -> None:
+      with self._lock:
+         otel_span = self._spans.pop(span.span_id, None)
+      if otel_span is None:
+         return
+      for key, value in span.attributes.items():
+         if isinstance(value, (str, bool, int, float)):
+            otel_span.set_attribute(key, value)
+      if span.error is not None:
+         otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+      otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+def _new_id() -> str:
+   return uuid.uuid4().hex[:16]
+
+class Tracer:
+   '''Create spans and hand them to the sinks'''
+
+   def __init__(self, sinks: Optional[List[Sink]] = None):
+      self.sinks: List[Sink] = list(sinks or [])
+
+   @property
+   def enabled(self) -> bool:
+      return bool(self.sinks)
+
+   def add_sink(self, sink: Sink) -> None:
+      self.sinks.append(sink)
+
+   def remove_sink(self, sink: Sink) -> None:
+      self.sinks.remove(sink)
+
+   def _start(self, name: str, start_time: float, attributes: dict) -> Span:
+      parent = _current_span.get()
+      span = Span(name=name, trace_id=parent.trace_id if parent else uuid.uuid4().hex, span_id=_new_id(),
+                  parent_id=parent.span_id if parent else None, start_time=start_time, attributes=attributes)
+      for sink in self.sinks:
+         sink.on_start(span)
+      return span
+
+   def _end(self, span: Span) -> None:
+      for sink in self.sinks:
+         sink.on_end(span)
+
+   @contextmanager
+   def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+      '''Time a stage as a child of the current span (yields None when tracing is disabled)'''
+      if not self.sinks:
+         yield None
+         return
+
+      span = self._start(name, time.time(), attributes)
+      token = _current_span.set(span)
+      start_time = time.perf_counter()
+      try:
+         yield span
+      except BaseException as e:
+         span.error = f"{type(e).__name__}: {e}"
+         raise
+      finally:
+         span.duration = time.perf_counter() - start_time
+         _current_span.reset(token)
+         self._end(span)
+
+   def record(self, name: str, start_time: float, duration: float, **attributes) -> None:
+      '''Record a stage that was timed elsewhere (e.g. from run status polling) as a child of the current span'''
+      if not self.sinks:
+         return
+      span = self._start(name, start_time, attributes)
+      span.duration = duration
+      self._end(span)
+
+   def traced(self, name: Optional[str] = None) -> Callable:
+      '''Decorator that runs a function inside a span'''
+      def decorator(func: Callable) -> Callable:
+         span_name = name or func.__name__
+
+         @functools.wraps(func)
+         def wrapper(*args, **kwargs):
+            if not self.sinks:
+               return func(*args, **kwargs)
+            with self.span(span_name):
+               return func(*args, **kwargs)
+
+         return wrapper
+      return decorator
+
+# the process-wide tracer used by the chain, the app and batch runs (disabled until a sink is added)
+tracer = Tracer()
+
+def current_span() -> Optional[Span]:
+   return _current_span.get()
+
+def configure_tracing(jsonl_path: Optional[str] = None, otel: bool = False) -> MetricsSink:
+   '''Enable tracing with in-process metrics, and optionally a JSON Lines log and OpenTelemetry export'''
+   metrics = next((sink for sink in tracer.sinks if isinstance(sink, MetricsSink)), None)
+   if metrics is None:
+      metrics = MetricsSink()
+      tracer.add_sink(metrics)
+   if jsonl_path and not any(isinstance(sink, JsonlSink) for sink in tracer.sinks):
+      tracer.add_sink(JsonlSink(jsonl_path))
+   if otel and not any(isinstance(sink, OpenTelemetrySink) for sink in tracer.sinks):
+      tracer.add_sink(OpenTelemetrySink())
+   return metrics
@@ -1,5 +1,6 @@
 from openai import OpenAI
 import os
+import json
 import argparse
 
 MODEL_OPTIONS = ["gpt-3.5-turbo", "gpt-4o-mini", "gpt-4o", "gpt-4-turbo"]
@@ -9,6 +10,8 @@ def get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Create a Job Classification Assistant")
     parser.add_argument("--model", type=str, default="gpt-4o-mini", choices=MODEL_OPTIONS, help="Model to use for the assistant (default: gpt-4o-mini)")
     parser.add_argument("--name", type=str, default=ASSISTANT_NAME, help="Assistant Name")
+    parser.add_argument("--tiers", type=str, default=None, help="Append the assistant to a JSON file of assistant tiers, cheapest first (used with ASSISTANT_TIERS / batch --tiers)")
+    parser.add_argument("--tier-name", type=str, default=None, help="Name of the assistant's tier (default: the model)")
     parser.add_argument("vector_store_id", type=str, default=None, help="Vector Store ID (e.g. 'vs_UBHS....AlBE')")
     return parser.parse_args()
 
@@ -37,6 +40,17 @@ Put people manager titles into management occupations."""
   # Set the environment variable ASSISTANT_ID
   os.environ["ASSISTANT_ID"] = assistant.id
 
+  # add the assistant as the last (strongest) tier of the tiers file
+  if args.tiers:
+    tiers = []
+    if os.path.exists(args.tiers):
+      with open(args.tiers) as f:
+        tiers = json.load(f)
+    tiers.append({"name": args.tier_name or args.model, "assistant_id": assistant.id, "model": args.model})
+    with open(args.tiers, "w") as f:
+      json.dump(tiers, f, indent=2)
+    print(f"Added tier {tiers[-1]['name']} to {args.tiers}")
+
 if __name__ == "__main__":
     args = get_args()
     main(args)
\ No newline at end of file
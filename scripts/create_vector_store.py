@@ -1,32 +1,235 @@
 from openai import OpenAI
 from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import json
 import os
-
-client = OpenAI()
+import time
 
 VECTOR_STORE_NAME = "ONET 28 Vector Store"
 
-vector_store = client.beta.vector_stores.create(name=VECTOR_STORE_NAME)
-print("Vector Store ID: ", vector_store.id)
-os.environ["VECTOR_STORE_ID"] = vector_store.id
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSED_DATA_DIR = os.path.join(ROOT_DIR, "data", "processed")
+MANIFEST_DIR = os.path.join(ROOT_DIR, "data", "cache")
 
 # # Ready the files for upload to OpenAI
 def get_files(directory: str, file_ext=".json") -> Iterator[str]:
-    for filename in os.listdir(directory):
+    for filename in sorted(os.listdir(directory)):
         if filename.endswith(file_ext):
             yield os.path.join(directory, filename)
 
+def split_lines(data: bytes, chunk_size: int) -> List[bytes]:
+    '''Split JSON Lines data into chunks of at most chunk_size bytes at line boundaries'''
+    chunks, chunk, size = [], [], 0
+    for line in data.splitlines(keepends=True):
+        if chunk and size + len(line) > chunk_size:
+            chunks.append(b"".join(chunk))
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        chunks.append(b"".join(chunk))
+    return chunks
+
+def get_documents(directory: str, chunk_size: Optional[int] = None) -> Dict[str, bytes]:
+    '''Get the documents to upload by name, splitting files larger than chunk_size into parts'''
+    documents = {}
+    for path in get_files(directory):
+        with open(path, "rb") as f:
+            data = f.read()
+        filename = os.path.basename(path)
+        if chunk_size is None or len(data) <= chunk_size:
+            documents[filename] = data
+            continue
+        stem, ext = os.path.splitext(filename)
+        for i, chunk in enumerate(split_lines(data, chunk_size), start=1):
+            documents[f"{stem}.part{i:03d}{ext}"] = chunk
+    return documents
+
+class VectorStoreSync:
+    '''Keep a vector store in sync with local documents
+
+    A local manifest maps every uploaded document name to the SHA-256 of its content
+    and its OpenAI file id.  Only new or changed documents are uploaded, and files of
+    changed or removed documents are deleted from the vector store and from OpenAI.
+
+    The manifest is only saved after the file batch completed.  When an upload or the
+    file batch fails, the files uploaded by the sync are deleted again and the manifest is
+    left unchanged, so the next sync uploads the same documents.
+
+    Only client.files.create/delete and client.beta.vector_stores.files.list/delete and
+    file_batches.create_and_poll are used, so a local stub client can stand in for OpenAI
+    (see tests/test_create_vector_store.py).
+    '''
+
+    def __init__(self, client, vector_store_id: str, manifest_path: str, parallelism: int = 8):
+        self.client = client
+        self.vector_store_id = vector_store_id
+        self.manifest_path = manifest_path
+        self.parallelism = parallelism
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self) -> Dict[str, dict]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        return manifest["files"] if manifest.get("vector_store_id") == self.vector_store_id else {}
+
+    def save_manifest(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"vector_store_id": self.vector_store_id, "files": self.manifest}, f, indent=2, sort_keys=True)
+
+    def remote_file_ids(self) -> set:
+        return {f.id for f in self.client.beta.vector_stores.files.list(vector_store_id=self.vector_store_id)}
+
+    def plan(self, documents: Dict[str, bytes], prune: bool = False) -> Tuple[Dict[str, str], List[str]]:
+        '''Get the documents to upload (name -> sha256) and the file ids to delete'''
+        remote = self.remote_file_ids()
+        uploads = {}
+        stale = []
+
+        for name, data in documents.items():
+            sha256 = hashlib.sha256(data).hexdigest()
+            entry = self.manifest.get(name)
+            if entry and entry["sha256"] == sha256 and entry["file_id"] in remote:
+                continue
+            uploads[name] = sha256
+            if entry and entry["file_id"] in remote:
+                stale.append(entry["file_id"])
+
+        stale.extend(entry["file_id"] for name, entry in self.manifest.items() if name not in documents and entry["file_id"] in remote)
+
+        if prune:
+            # files in the vector store that are not tracked by the manifest (e.g. from a full upload)
+            tracked = {entry["file_id"] for entry in self.manifest.values()}
+            stale.extend(file_id for file_id in remote if file_id not in tracked)
+
+        return uploads, stale
+
+    def upload(self, name: str, data: bytes) -> str:
+        return self.client.files.create(file=(name, data), purpose="assistants").id
+
+    def delete(self, file_id: str) -> None:
+        self.client.beta.vector_stores.files.delete(file_id, vector_store_id=self.vector_store_id)
+        self.client.files.delete(file_id)
+
+    def discard(self, file_ids: List[str], in_vector_store: bool = False) -> None:
+        '''Delete the files uploaded by a failed sync (best effort, the original error is raised by the caller)'''
+        for file_id in file_ids:
+            if in_vector_store:
+                try:
+                    self.client.beta.vector_stores.files.delete(file_id, vector_store_id=self.vector_store_id)
+                except Exception:
+                    pass  # the file may not have been added to the vector store
+            try:
+                self.client.files.delete(file_id)
+            except Exception as e:
+                print(f"could not delete uploaded file {file_id}: {e}")
+        if file_ids:
+            print(f"deleted {len(file_ids)} files uploaded by the failed sync")
+
+    def sync(self, documents: Dict[str, bytes], prune: bool = False, dry_run: bool = False) -> dict:
+        start_time = time.perf_counter()
+        uploads, stale = self.plan(documents, prune)
+        unchanged = len(documents) - len(uploads)
+        print(f"{len(documents)} documents: {len(uploads)} to upload, {unchanged} unchanged, {len(stale)} stale files to delete")
+
+        if dry_run:
+            for name in uploads:
+                print(f"  upload {name} ({len(documents[name]) / 1e6:.2f} MB)")
+            for file_id in stale:
+                print(f"  delete {file_id}")
+            return {"uploaded": 0, "unchanged": unchanged, "deleted": 0, "seconds": time.perf_counter() - start_time}
+
+        uploaded = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            futures = {executor.submit(self.upload, name, documents[name]): (name, time.perf_counter()) for name in uploads}
+            for i, future in enumerate(as_completed(futures), start=1):
+                name, submitted_at = futures[future]
+                try:
+                    uploaded[name] = future.result()
+                except Exception as e:
+                    print(f"[{i}/{len(uploads)}] upload of {name} failed: {e}")
+                    error = error or e
+                    continue
+                print(f"[{i}/{len(uploads)}] uploaded {name} ({len(documents[name]) / 1e6:.2f} MB) in {time.perf_counter() - submitted_at:.1f}s")
+        if error is not None:
+            self.discard(list(uploaded.values()))
+            raise error
+
+        if uploaded:
+            # Use the file batch SDK helper to add the files to the vector store and poll the status of the batch for completion.
+            batch_start = time.perf_counter()
+            try:
+                file_batch = self.client.beta.vector_stores.file_batches.create_and_poll(
+                    vector_store_id=self.vector_store_id, file_ids=list(uploaded.values())
+                )
+            except Exception:
+                self.discard(list(uploaded.values()), in_vector_store=True)
+                raise
+            print(f"file batch {file_batch.status} in {time.perf_counter() - batch_start:.1f}s: {file_batch.file_counts}")
+            if file_batch.status != "completed" or file_batch.file_counts.failed:
+                self.discard(list(uploaded.values()), in_vector_store=True)
+                raise RuntimeError(f"file batch {file_batch.id} {file_batch.status}: {file_batch.file_counts}")
+
+        for name, file_id in uploaded.items():
+            self.manifest[name] = {"sha256": uploads[name], "file_id": file_id, "bytes": len(documents[name])}
+        for name in [name for name in self.manifest if name not in documents]:
+            del self.manifest[name]
+        self.save_manifest()
+
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            list(executor.map(self.delete, stale))
+        if stale:
+            print(f"deleted {len(stale)} stale files")
+
+        return {"uploaded": len(uploaded), "unchanged": unchanged, "deleted": len(stale), "seconds": time.perf_counter() - start_time}
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Create or sync the O*NET vector store")
+    parser.add_argument("--sync", type=str, default=None, metavar="VECTOR_STORE_ID", help="Sync an existing vector store instead of creating a new one")
+    parser.add_argument("--data-dir", type=str, default=PROCESSED_DATA_DIR, help="Directory with the processed .json files (default: data/processed)")
+    parser.add_argument("--manifest", type=str, default=None, help="Manifest of uploaded files (default: data/cache/vector_store_<id>.json)")
+    parser.add_argument("--chunk-size", type=float, default=None, help="Split files larger than this many MB into parts at line boundaries")
+    parser.add_argument("--parallelism", type=int, default=8, help="Number of concurrent uploads and deletes (default: 8)")
+    parser.add_argument("--prune", action="store_true", help="Also delete vector store files that are not in the manifest")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the files that would be uploaded and deleted (makes no API calls without --sync)")
+    return parser.parse_args()
+
+def main(args) -> None:
+
+    chunk_size = int(args.chunk_size * 1e6) if args.chunk_size else None
+    documents = get_documents(args.data_dir, chunk_size)
+
+    if args.dry_run and not args.sync:
+        # nothing to compare against, and creating the vector store would not be a dry run
+        print(f"{len(documents)} documents: a new vector store would be created and all of them uploaded")
+        for name, data in documents.items():
+            print(f"  upload {name} ({len(data) / 1e6:.2f} MB)")
+        return
+
+    client = OpenAI()
+
+    if args.sync:
+        vector_store_id = args.sync
+    else:
+        vector_store = client.beta.vector_stores.create(name=VECTOR_STORE_NAME)
+        vector_store_id = vector_store.id
+        print("Vector Store ID: ", vector_store_id)
+        os.environ["VECTOR_STORE_ID"] = vector_store_id
+
+    manifest_path = args.manifest or os.path.join(MANIFEST_DIR, f"vector_store_{vector_store_id}.json")
+    syncer = VectorStoreSync(client, vector_store_id, manifest_path, parallelism=args.parallelism)
 
-file_paths = [f for f in get_files("../data/processed")]
-file_streams = [open(path, "rb") for path in file_paths]
- 
-# Use the upload and poll SDK helper to upload the files, add them to the vector store,
-# and poll the status of the file batch for completion.
-print("Uploading files to vector store...")
-file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-  vector_store_id=vector_store.id, files=file_streams
-)
+    print("Uploading files to vector store...")
+    stats = syncer.sync(documents, prune=args.prune, dry_run=args.dry_run)
+    print(f"uploaded {stats['uploaded']}, unchanged {stats['unchanged']}, deleted {stats['deleted']} in {stats['seconds']:.1f} seconds")
 
-# # You can print the status and the file counts of the batch to see the result of this operation.
-print(file_batch.status)
-print(file_batch.file_counts)
\ No newline at end of file
+if __name__ == "__main__":
+    args = get_args()
+    main(args)
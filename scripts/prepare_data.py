@@ -1,132 +1,236 @@
+import argparse
+import hashlib
+import json
+import os
+import time
 
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
 
-RAW_DATA_DIR = "../data/raw"
-PROCESSED_DATA_DIR = "../data/processed"
+from openpyxl import load_workbook
 
-# generate JSONL files for ONET 28 data
-
-def process_desciptions():
-    '''Create a JSONL file of occupation descriptions and reported titles for occupations'''
-
-    # load data/Occupation Data.xslx in a DataFrame
-    df = pd.read_excel(f"{RAW_DATA_DIR}/Occupation Data.xlsx")
-
-    # rename column 'O*NET-SOC Code' to 'code'
-    column_map = {
-        "O*NET-SOC Code": "occupation_code",
-        "Title": "occupation_title",
-        "Description": "occupation_description"
-    }
-
-    df.rename(columns=column_map, inplace=True)
-
-    # create a JSONL file of 'occupation_descriptions.jsonl' of df
-    df.to_json(f"{PROCESSED_DATA_DIR}/occupation_descriptions.json", orient="records", lines=True)
-
-def process_sample_titles():
-
-    # load data/Sample of Reported Titles.xlsx in a DataFrame
-    df = pd.read_excel(f"{RAW_DATA_DIR}/Sample of Reported Titles.xlsx")
-
-    # drop column 'Shown in My Next Move'
-    df.drop(columns=["Shown in My Next Move"], inplace=True)
-
-    # rename column 'O*NET-SOC Code' to 'occupation_code' and 'Title' to 'occupation_title'
-    column_map = {
-        "O*NET-SOC Code": "occupation_code", 
-        "Title": "occupation_title", 
-        "Reported Job Title": "sample_job_title"
-    }
-    df.rename(columns=column_map, inplace=True)
-
-    # create a JSONL file 'occupation_sample_titles.jsonl' of df
-    df.to_json(f"{PROCESSED_DATA_DIR}/occupation_sample_titles.json", orient="records", lines=True)
-
-def process_alternate_titles():
-    '''Create a JSONL file of alternate job titles for occupations'''
-
-    # load data/Alternate Titles.xlsx in a DataFrame
-    df = pd.read_excel(f"{RAW_DATA_DIR}/Alternate Titles.xlsx")
-
-    # drop columns 'Alternate Title' and 'Short Title' from df_alternate_titles
-    df.drop(columns=["Short Title", "Source(s)"], inplace=True)
-
-    # rename column 'O*NET-SOC Code' to 'occupation_code' and 'Title' to 'occupation_title'
-    columnn_map = {
-        "O*NET-SOC Code": "occupation_code",
-        "Title": "occupation_title",
-        "Alternate Title": "alternate_job_title"
-    }
-    df.rename(columns=columnn_map, inplace=True)
-
-    # create a JSONL file of df
-    df.to_json(f"{PROCESSED_DATA_DIR}/occupation_alternate_titles.json", orient="records", lines=True)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the Parquet cache is optional
+    pa = None
 
-def process_task_statements():
-    '''Create a JSONL file of Task Statements for occupations'''
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_DATA_DIR = os.path.join(ROOT_DIR, "data", "raw")
+PROCESSED_DATA_DIR = os.path.join(ROOT_DIR, "data", "processed")
+CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache", "raw")
+MANIFEST_PATH = os.path.join(ROOT_DIR, "data", "cache", "prepare_data_manifest.json")
 
-    df = pd.read_excel(f"{RAW_DATA_DIR}/Task Statements.xlsx")
+# rows of a sheet are read and converted in batches of this size
+BATCH_SIZE = 5000
 
-    # drop unnecessary columns
-    df.drop(columns=["Task ID", "Incumbents Responding", "Date", "Domain Source"], inplace=True)
-
-    column_map = {
-        "O*NET-SOC Code": "occupation_code",
-        "Title": "occupation_title",
-        "Task": "task_statement",
-        "Task Type": "task_type",
-    }
-    df.rename(columns=column_map, inplace=True)
-
-    df.to_json(f"{PROCESSED_DATA_DIR}/occupation_task_statements.json", orient="records", lines=True)
-
-def process_technology_skills():
-    '''Create a JSONL file of Technology Skills for occupations'''
-
-    df = pd.read_excel(f"{RAW_DATA_DIR}/Technology Skills.xlsx")
-
-     # drop unnecessary columns
-    df.drop(columns=["Commodity Code"], inplace=True)
-
-    column_map = {
-        "O*NET-SOC Code": "occupation_code",
-        "Title": "occupation_title",
-        "Example": "technology",
-        "Commodity Title": "technology_category",
-        "Hot Technology": "hot_technology",
-        "In Demand": "in_demand",
-    }
-    df.rename(columns=column_map, inplace=True)
-
-    df.to_json(f"{PROCESSED_DATA_DIR}/occupation_technology_skills.json", orient="records", lines=True)
-
-def process_career_clusters():
-    '''Create a JSONL file of Career Clusters for occupations'''
-
-    df = pd.read_excel(f"{RAW_DATA_DIR}/All Career Clusters.xlsx", skiprows=3)
-
-    column_map = {
-        "Code": "occupation_code",
-        "Occupation": "occupation_title",
-        "Career Cluster": "career_cluster",
-        "Career Pathway": "career_pathway",
-    }
-    df.rename(columns=column_map, inplace=True)
-    df = df[["occupation_code", "occupation_title", "career_pathway", "career_cluster"]]
-
-    df.sort_values(by=['occupation_code'], inplace=True)
-
-    # split career_cluster and career_pathway by ';'
-    df['career_cluster'] = df['career_cluster'].apply(lambda x: [y.strip() for y in x.split(';')] if isinstance(x, str) else x)
-    df['career_pathway'] = df['career_pathway'].apply(lambda x: [y.strip() for y in x.split(';')] if isinstance(x, str) else x)
-
-    df.to_json(f"{PROCESSED_DATA_DIR}/occupation_career_clusters.json", orient="records", lines=True)
-
-process_desciptions()
-process_sample_titles()
-process_alternate_titles()
-process_task_statements()
-process_technology_skills()
-process_career_clusters()
+# generate JSONL files for ONET 28 data
 
+@dataclass
+class Output:
+    '''How a processed JSONL file is generated from a raw O*NET XLSX file'''
+    filename: str
+    source: str
+    # source column -> output field (in output order), other columns are dropped
+    columns: Dict[str, str]
+    # rows before the header row
+    skiprows: int = 0
+    # fields holding ';' separated values that are split into lists
+    list_fields: List[str] = field(default_factory=list)
+    sort_by: Optional[str] = None
+    description: str = ""
+
+    def fingerprint(self) -> str:
+        '''Hash of the output definition, so that changing it invalidates the output'''
+        return hashlib.sha256(repr(self).encode("utf-8")).hexdigest()
+
+OUTPUTS = [
+    Output("occupation_descriptions.json", "Occupation Data.xlsx",
+           {"O*NET-SOC Code": "occupation_code", "Title": "occupation_title", "Description": "occupation_description"},
+           description="occupation descriptions"),
+    Output("occupation_sample_titles.json", "Sample of Reported Titles.xlsx",
+           {"O*NET-SOC Code": "occupation_code", "Title": "occupation_title", "Reported Job Title": "sample_job_title"},
+           description="sample of reported job titles for occupations"),
+    Output("occupation_alternate_titles.json", "Alternate Titles.xlsx",
+           {"O*NET-SOC Code": "occupation_code", "Title": "occupation_title", "Alternate Title": "alternate_job_title"},
+           description="alternate job titles for occupations"),
+    Output("occupation_task_statements.json", "Task Statements.xlsx",
+           {"O*NET-SOC Code": "occupation_code", "Title": "occupation_title", "Task": "task_statement", "Task Type": "task_type"},
+           description="task statements for occupations"),
+    Output("occupation_technology_skills.json", "Technology Skills.xlsx",
+           {"O*NET-SOC Code": "occupation_code", "Title": "occupation_title", "Example": "technology",
+            "Commodity Title": "technology_category", "Hot Technology": "hot_technology", "In Demand": "in_demand"},
+           description="technology skills for occupations"),
+    Output("occupation_career_clusters.json", "All Career Clusters.xlsx",
+           {"Code": "occupation_code", "Occupation": "occupation_title", "Career Pathway": "career_pathway", "Career Cluster": "career_cluster"},
+           skiprows=3, list_fields=["career_pathway", "career_cluster"], sort_by="occupation_code",
+           description="career clusters and pathways for occupations"),
+]
+
+def file_hash(path: str) -> str:
+    '''SHA-256 of a file, read in chunks'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def to_json_line(row: dict) -> str:
+    # match the formatting of pandas to_json (compact, ASCII only, escaped '/') so unchanged data stays byte-identical
+    return json.dumps(row, separators=(",", ":")).replace("/", "\\/") + "\n"
+
+def read_xlsx(path: str, skiprows: int = 0) -> Iterator[List[dict]]:
+    '''Stream the rows of the first sheet of an XLSX file as batches of dicts keyed by the header row'''
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        for _ in range(skiprows):
+            next(rows)
+        header = next(rows)
+
+        batch = []
+        for values in rows:
+            if all(v is None for v in values):
+                continue
+            batch.append(dict(zip(header, values)))
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        workbook.close()
+
+def parquet_cache_path(output: Output, source_hash: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{os.path.splitext(output.source)[0]}.{source_hash[:16]}.parquet")
+
+def read_parquet(path: str) -> Iterator[List[dict]]:
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE):
+        yield batch.to_pylist()
+
+def write_parquet(batches: Iterator[List[dict]], path: str) -> Iterator[List[dict]]:
+    '''Pass batches through while also writing them to a Parquet file'''
+    tmp_path = path + ".tmp"
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                # all columns are stored as strings (O*NET codes look like numbers to type inference)
+                schema = pa.schema([(str(name), pa.string()) for name in batch[0]])
+                writer = pq.ParquetWriter(tmp_path, schema)
+            columns = {str(name): [None if row[name] is None else str(row[name]) for row in batch] for name in batch[0]}
+            writer.write_table(pa.Table.from_pydict(columns, schema=writer.schema))
+            yield batch
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(tmp_path, path)
+
+def transform(output: Output, batches: Iterator[List[dict]]) -> Iterator[dict]:
+    '''Select, rename and split the columns of the raw rows'''
+    for batch in batches:
+        for raw in batch:
+            row = {name: raw.get(column) for column, name in output.columns.items()}
+            for name in output.list_fields:
+                if isinstance(row[name], str):
+                    row[name] = [value.strip() for value in row[name].split(";")]
+            yield row
+
+def process_output(output: Output, raw_dir: str, processed_dir: str, cache_dir: Optional[str], source_hash: str) -> dict:
+    '''Generate one processed JSONL file (runs in a worker process)'''
+    start_time = time.perf_counter()
+    source_path = os.path.join(raw_dir, output.source)
+
+    cache_path = parquet_cache_path(output, source_hash, cache_dir) if cache_dir and pa is not None else None
+    if cache_path and os.path.exists(cache_path):
+        batches, source = read_parquet(cache_path), "parquet"
+    else:
+        batches, source = read_xlsx(source_path, output.skiprows), "xlsx"
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            batches = write_parquet(batches, cache_path)
+
+    rows = transform(output, batches)
+    if output.sort_by:
+        rows = sorted(rows, key=lambda row: row[output.sort_by] or "")
+
+    path = os.path.join(processed_dir, output.filename)
+    count = 0
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(to_json_line(row))
+            count += 1
+    os.replace(path + ".tmp", path)
+
+    return {"filename": output.filename, "rows": count, "source": source, "seconds": time.perf_counter() - start_time}
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert O*NET XLSX files into JSON Lines files for the vector store")
+    parser.add_argument("--raw-dir", type=str, default=RAW_DATA_DIR, help="Directory with the O*NET XLSX files (default: data/raw)")
+    parser.add_argument("--processed-dir", type=str, default=PROCESSED_DATA_DIR, help="Directory for the JSON Lines files (default: data/processed)")
+    parser.add_argument("--manifest", type=str, default=MANIFEST_PATH, help="Content hashes of the sources of the last run (default: data/cache/prepare_data_manifest.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true", help="Regenerate outputs even if their source has not changed")
+    parser.add_argument("--no-parquet-cache", action="store_true", help="Do not read or write the Parquet cache of parsed XLSX files")
+    parser.add_argument("outputs", type=str, nargs="*", help=f"Outputs to generate (default: all) {[o.filename for o in OUTPUTS]}")
+    return parser.parse_args()
+
+def main(args) -> None:
+
+    start_time = time.perf_counter()
+    manifest = load_manifest(args.manifest)
+    cache_dir = None if args.no_parquet_cache else CACHE_DIR
+    os.makedirs(args.processed_dir, exist_ok=True)
+
+    outputs = [o for o in OUTPUTS if not args.outputs or o.filename in args.outputs]
+
+    # only regenerate outputs whose source XLSX or definition changed since the last run
+    pending = {}
+    for output in outputs:
+        source_path = os.path.join(args.raw_dir, output.source)
+        if not os.path.exists(source_path):
+            print(f"{output.filename}: skipped, {source_path} not found")
+            continue
+
+        source_hash = file_hash(source_path)
+        entry = manifest.get(output.filename, {})
+        unchanged = entry.get("source_sha256") == source_hash and entry.get("fingerprint") == output.fingerprint()
+        if unchanged and not args.force and os.path.exists(os.path.join(args.processed_dir, output.filename)):
+            print(f"{output.filename}: up to date")
+            continue
+        pending[output.filename] = (output, source_hash)
+
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(pending) or 1))) as executor:
+        futures = {
+            filename: executor.submit(process_output, output, args.raw_dir, args.processed_dir, cache_dir, source_hash)
+            for filename, (output, source_hash) in pending.items()
+        }
+
+        try:
+            for filename, future in futures.items():
+                result = future.result()
+                output, source_hash = pending[filename]
+                manifest[filename] = {"source": output.source, "source_sha256": source_hash, "fingerprint": output.fingerprint(), "rows": result["rows"]}
+                print(f"{filename}: {result['rows']} {output.description} from {result['source']} in {result['seconds']:.2f} seconds")
+        finally:
+            # record the outputs that were generated, even if another one failed
+            save_manifest(manifest, args.manifest)
+
+    print(f"Done in {time.perf_counter() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    args = get_args()
+    main(args)
@@ -0,0 +1,190 @@
+'''Tests of the incremental vector store sync against a local fake of the OpenAI files and vector store APIs'''
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import create_vector_store  # noqa: E402
+from create_vector_store import VectorStoreSync  # noqa: E402
+
+VECTOR_STORE_ID = "vs_test"
+
+class FakeOpenAI:
+    '''In-memory stand-in for the files and vector store endpoints used by VectorStoreSync
+
+    Uploads of the names in fail_uploads raise, file batches end with batch_status.
+    '''
+
+    def __init__(self, fail_uploads=(), batch_status="completed"):
+        self.fail_uploads = set(fail_uploads)
+        self.batch_status = batch_status
+        self.uploaded = {}  # file id -> (name, data)
+        self.vector_store = set()  # file ids in the vector store
+        self.created_vector_stores = []
+        self._ids = itertools.count(1)
+
+        self.files = SimpleNamespace(create=self._create_file, delete=self._delete_file)
+        self.beta = SimpleNamespace(vector_stores=SimpleNamespace(
+            create=self._create_vector_store,
+            files=SimpleNamespace(list=self._list, delete=self._remove),
+            file_batches=SimpleNamespace(create_and_poll=self._create_file_batch)))
+
+    def contents(self):
+        '''The documents in the vector store by name'''
+        return {self.uploaded[file_id][0]: self.uploaded[file_id][1] for file_id in self.vector_store}
+
+    def _create_vector_store(self, name):
+        self.created_vector_stores.append(name)
+        return SimpleNamespace(id=VECTOR_STORE_ID)
+
+    def _create_file(self, file, purpose):
+        name, data = file
+        if name in self.fail_uploads:
+            raise ConnectionError(f"upload of {name} failed")
+        file_id = f"file-{next(self._ids)}"
+        self.uploaded[file_id] = (name, data)
+        return SimpleNamespace(id=file_id)
+
+    def _delete_file(self, file_id):
+        del self.uploaded[file_id]
+
+    def _list(self, vector_store_id):
+        return [SimpleNamespace(id=file_id) for file_id in sorted(self.vector_store)]
+
+    def _remove(self, file_id, vector_store_id):
+        self.vector_store.remove(file_id)
+
+    def _create_file_batch(self, vector_store_id, file_ids):
+        completed = self.batch_status == "completed"
+        if completed:
+            self.vector_store.update(file_ids)
+        counts = SimpleNamespace(completed=len(file_ids) if completed else 0, failed=0 if completed else len(file_ids), total=len(file_ids))
+        return SimpleNamespace(id="vsfb_1", status=self.batch_status, file_counts=counts)
+
+DOCUMENTS = {"occupations.json": b'{"code": "15-1252.00"}\n', "tasks.json": b'{"task": "write code"}\n', "skills.json": b'{"skill": "python"}\n'}
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / "manifest.json")
+
+def sync(client, manifest_path, documents, **kwargs):
+    return VectorStoreSync(client, VECTOR_STORE_ID, manifest_path, parallelism=2).sync(documents, **kwargs)
+
+def read_manifest(manifest_path):
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+def test_first_sync_uploads_all_documents(manifest_path):
+    client = FakeOpenAI()
+    stats = sync(client, manifest_path, DOCUMENTS)
+
+    assert stats["uploaded"] == 3 and stats["deleted"] == 0
+    assert client.contents() == DOCUMENTS
+    assert set(read_manifest(manifest_path)) == set(DOCUMENTS)
+
+def test_unchanged_documents_are_not_uploaded(manifest_path):
+    client = FakeOpenAI()
+    sync(client, manifest_path, DOCUMENTS)
+    stats = sync(client, manifest_path, DOCUMENTS)
+
+    assert stats["uploaded"] == 0 and stats["unchanged"] == 3
+    assert len(client.uploaded) == 3
+
+def test_changed_document_replaces_its_file(manifest_path):
+    client = FakeOpenAI()
+    sync(client, manifest_path, DOCUMENTS)
+    old_file_id = read_manifest(manifest_path)["tasks.json"]["file_id"]
+
+    changed = {**DOCUMENTS, "tasks.json": b'{"task": "review code"}\n'}
+    stats = sync(client, manifest_path, changed)
+
+    assert stats["uploaded"] == 1 and stats["deleted"] == 1
+    assert client.contents() == changed
+    assert old_file_id not in client.uploaded
+    assert read_manifest(manifest_path)["tasks.json"]["file_id"] != old_file_id
+
+def test_removed_document_is_deleted(manifest_path):
+    client = FakeOpenAI()
+    sync(client, manifest_path, DOCUMENTS)
+
+    remaining = {name: data for name, data in DOCUMENTS.items() if name != "skills.json"}
+    stats = sync(client, manifest_path, remaining)
+
+    assert stats["deleted"] == 1
+    assert client.contents() == remaining
+    assert len(client.uploaded) == 2
+    assert set(read_manifest(manifest_path)) == set(remaining)
+
+def test_failed_upload_deletes_the_other_uploads(manifest_path):
+    client = FakeOpenAI(fail_uploads={"tasks.json"})
+    with pytest.raises(ConnectionError):
+        sync(client, manifest_path, DOCUMENTS)
+
+    assert client.uploaded == {} and client.vector_store == set()
+    assert not os.path.exists(manifest_path)
+
+def test_failed_file_batch_keeps_the_manifest(manifest_path):
+    client = FakeOpenAI()
+    sync(client, manifest_path, DOCUMENTS)
+    manifest = read_manifest(manifest_path)
+
+    client.batch_status = "failed"
+    changed = {**DOCUMENTS, "tasks.json": b'{"task": "review code"}\n'}
+    with pytest.raises(RuntimeError):
+        sync(client, manifest_path, changed)
+
+    # the old version is still synced, the new upload is gone and the next sync retries it
+    assert read_manifest(manifest_path) == manifest
+    assert client.contents() == DOCUMENTS
+    assert len(client.uploaded) == 3
+
+    client.batch_status = "completed"
+    assert sync(client, manifest_path, changed)["uploaded"] == 1
+    assert client.contents() == changed
+
+@pytest.fixture
+def data_dir(tmp_path):
+    directory = tmp_path / "processed"
+    directory.mkdir()
+    for name, data in DOCUMENTS.items():
+        (directory / name).write_bytes(data)
+    return str(directory)
+
+def run_main(monkeypatch, client, data_dir, manifest_path, **options):
+    monkeypatch.setattr(create_vector_store, "OpenAI", lambda: client)
+    args = argparse.Namespace(sync=None, data_dir=data_dir, manifest=manifest_path, chunk_size=None, parallelism=2, prune=False, dry_run=False)
+    vars(args).update(options)
+    create_vector_store.main(args)
+
+def test_dry_run_without_sync_makes_no_api_calls(monkeypatch, data_dir, manifest_path, capsys):
+    def no_client():
+        raise AssertionError("a dry run must not create an OpenAI client")
+    monkeypatch.setattr(create_vector_store, "OpenAI", no_client)
+    args = argparse.Namespace(sync=None, data_dir=data_dir, manifest=manifest_path, chunk_size=None, parallelism=2, prune=False, dry_run=True)
+    create_vector_store.main(args)
+
+    assert "3 documents" in capsys.readouterr().out
+    assert not os.path.exists(manifest_path)
+
+def test_dry_run_with_sync_changes_nothing(monkeypatch, data_dir, manifest_path):
+    client = FakeOpenAI()
+    run_main(monkeypatch, client, data_dir, manifest_path, sync=VECTOR_STORE_ID, dry_run=True)
+
+    assert client.created_vector_stores == [] and client.uploaded == {}
+    assert not os.path.exists(manifest_path)
+
+def test_create_uploads_all_documents(monkeypatch, data_dir, manifest_path):
+    client = FakeOpenAI()
+    run_main(monkeypatch, client, data_dir, manifest_path)
+
+    assert client.created_vector_stores == [create_vector_store.VECTOR_STORE_NAME]
+    assert client.contents() == DOCUMENTS
+    assert set(read_manifest(manifest_path)) == set(DOCUMENTS)
@@ -0,0 +1,56 @@
+'''Tests of the near-duplicate clustering of job posts'''
+
+import random
+
+import numpy as np
+
+from job_classification_agent.dedup import NearDuplicateDetector
+from job_classification_agent.job_posts import JobPost
+
+WORDS = [f"word{i}" for i in range(400)]
+
+def description(seed, length=200):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+def mutate(text, changes, seed):
+    rng = random.Random(seed)
+    words = text.split()
+    for _ in range(changes):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words)
+
+def clusters_of(posts):
+    return sorted(sorted([c.representative.id] + [m.id for m in c.members]) for c in NearDuplicateDetector().cluster(posts))
+
+def test_same_post_in_different_locations_is_clustered():
+    text = description(0)
+    posts = [JobPost(id=str(i), title=f"Software Engineer - {city}", description=text) for i, city in enumerate(["Boston, MA", "Chicago, IL", "Austin, TX"])]
+    assert clusters_of(posts) == [["0", "1", "2"]]
+
+def test_different_posts_are_not_clustered():
+    posts = [JobPost(id=str(i), title="Software Engineer", description=description(i)) for i in range(3)]
+    assert clusters_of(posts) == [["0"], ["1"], ["2"]]
+
+def test_members_do_not_chain_through_each_other():
+    # each post is a near-duplicate of the previous one, but drifts away from the first
+    texts = [description(0)]
+    for i in range(8):
+        texts.append(mutate(texts[-1], 6, seed=i))
+    posts = [JobPost(id=str(i), title="Software Engineer", description=text) for i, text in enumerate(texts)]
+
+    detector = NearDuplicateDetector()
+    clusters = detector.cluster(posts)
+    assert len(clusters) > 1
+    for cluster in clusters:
+        representative = detector.signature(cluster.representative.description)
+        for member in cluster.members:
+            assert np.mean(detector.signature(member.description) == representative) >= detector.threshold
+
+def test_posts_without_a_description_are_never_merged():
+    posts = [JobPost(id="1", title="Registered Nurse", description=""),
+             JobPost(id="2", title="Nurse Practitioner", description=""),
+             JobPost(id="3", title="Registered Nurse", description="See website"),
+             JobPost(id="4", title="Nurse Practitioner", description="See website"),
+             JobPost(id="5", title="Registered Nurse", description="Apply on our website today")]
+    assert clusters_of(posts) == [["1"], ["2"], ["3"], ["4"], ["5"]]
@@ -0,0 +1,111 @@
+'''Tests of the escalation and hedging of AssistantRouter against the simulated Assistants API'''
+
+import asyncio
+import json
+
+import pytest
+
+from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
+
+from job_classification_agent.benchmarks.assistant_overhead import FakeAssistantsAPI
+from job_classification_agent.chain import TracedAssistantRunnable
+from job_classification_agent.knowledge_base import load_knowledge_base
+from job_classification_agent.router import AssistantRouter, AssistantTier, assess_answer
+
+SOFTWARE_DEVELOPERS = {"occupation_code": "15-1252.00", "occupation_title": "Software Developers"}
+UNKNOWN = {"occupation_code": "99-9999.00", "occupation_title": "Imaginary Occupation"}
+
+# simulated durations are scaled down 100 times: a run takes 30 ms, a slow run 300 ms
+TIME_SCALE = 0.01
+
+@pytest.fixture(scope="module", autouse=True)
+def knowledge_base():
+    load_knowledge_base()
+
+def answer(*classifications):
+    return json.dumps({"job_classifications": list(classifications), "overall_explanation": "test answer"})
+
+def finish(output):
+    return OpenAIAssistantFinish(return_values={"output": output}, log="", run_id="run_1", thread_id="thread_1")
+
+@pytest.mark.parametrize("output, reason", [
+    (answer(SOFTWARE_DEVELOPERS), None),
+    ("Sorry, I could not find an occupation for this job post.", "invalid"),
+    (answer(SOFTWARE_DEVELOPERS, UNKNOWN), "dropped"),
+    (answer(), "empty"),
+    (answer({"occupation_code": "99-1252.00", "occupation_title": "Software Develop"}), "low_confidence"),
+])
+def test_escalation_reasons(output, reason):
+    assert assess_answer(finish(output))[1] == reason
+
+def test_variants_of_one_occupation_are_not_dropped():
+    # both resolve to 15-1252.00 and are merged, no classification was lost
+    result, reason = assess_answer(finish(answer(SOFTWARE_DEVELOPERS, {"occupation_code": "15-1252", "occupation_title": "Software Developers"})))
+    assert reason is None
+    assert [c.occupation_code for c in result.job_classifications] == ["15-1252.00"]
+
+class SlowFirstRun(FakeAssistantsAPI):
+    '''Simulated Assistants API where only the first run is slow'''
+
+    def __init__(self, **kwargs):
+        super().__init__(sigma=0.0, time_scale=TIME_SCALE, slow_fraction=1.0, **kwargs)
+
+    def _new_run(self, thread_id, messages):
+        run = super()._new_run(thread_id, messages)
+        self.slow_fraction = 0.0
+        return run
+
+def tier(name, api):
+    client, async_client = api.clients()
+    agent = TracedAssistantRunnable(assistant_id=f"asst_{name}", as_agent=True, client=client, async_client=async_client, check_every_ms=5)
+    return AssistantTier(name=name, assistant_id=f"asst_{name}"), agent
+
+def router(apis, **kwargs):
+    tiers, agents = zip(*(tier(name, api) for name, api in apis.items()))
+    return AssistantRouter(list(tiers), list(agents), **kwargs)
+
+def test_weak_answer_is_escalated():
+    apis = {"fast": FakeAssistantsAPI(time_scale=TIME_SCALE, answer=lambda content: answer(UNKNOWN)),
+            "strong": FakeAssistantsAPI(time_scale=TIME_SCALE, answer=lambda content: answer(SOFTWARE_DEVELOPERS))}
+    r = router(apis)
+    result = asyncio.run(r.ainvoke({"content": "Job Post Title: developer"}))
+
+    assert [c.occupation_code for c in result.job_classifications] == ["15-1252.00"]
+    assert r.stats.escalations == {"dropped": 1}
+    assert r.stats.answered == {"strong": 1}
+
+def test_good_answer_is_not_escalated():
+    apis = {"fast": FakeAssistantsAPI(time_scale=TIME_SCALE), "strong": FakeAssistantsAPI(time_scale=TIME_SCALE)}
+    r = router(apis)
+    asyncio.run(r.ainvoke({"content": "Job Post Title: developer"}))
+
+    assert r.stats.answered == {"fast": 1}
+    assert apis["strong"].calls["threads.create_and_run"] == 0
+
+def test_invalid_last_tier_returns_best_earlier_answer():
+    apis = {"fast": FakeAssistantsAPI(time_scale=TIME_SCALE, answer=lambda content: answer(SOFTWARE_DEVELOPERS, UNKNOWN)),
+            "strong": FakeAssistantsAPI(time_scale=TIME_SCALE, answer=lambda content: "no JSON here")}
+    r = router(apis)
+    result = r.invoke({"content": "Job Post Title: developer"})
+
+    assert [c.occupation_code for c in result.job_classifications] == ["15-1252.00"]
+    assert r.stats.answered == {"fast": 1}
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_hedged_run_wins_and_slow_run_is_cancelled(asynchronous):
+    api = SlowFirstRun()
+    r = router({"fast": api}, hedge=True, hedge_after=0.08)
+    input = {"content": "Job Post Title: developer"}
+    result = asyncio.run(r.ainvoke(input)) if asynchronous else r.invoke(input)
+
+    assert [c.occupation_code for c in result.job_classifications] == ["15-1252.00"]
+    assert (r.stats.hedges, r.stats.hedge_wins, r.stats.cancelled_runs) == (1, 1, 1)
+    assert [run.status for run in api.runs.values()] == ["cancelled", "completed"]
+
+def test_fast_run_is_not_hedged():
+    api = FakeAssistantsAPI(sigma=0.0, time_scale=TIME_SCALE)
+    r = router({"fast": api}, hedge=True, hedge_after=0.5)
+    asyncio.run(r.ainvoke({"content": "Job Post Title: developer"}))
+
+    assert (r.stats.hedges, r.stats.hedge_wins, r.stats.cancelled_runs) == (0, 0, 0)
+    assert api.calls["threads.create_and_run"] == 1